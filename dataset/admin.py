@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Dataset, ImageFile, PDFFile
+from .models import ArchiveImport, Dataset, DatasetExport, DatasetSnapshot, ImageBlob, ImageFile, PDFFile, UploadSession
 
 
 @admin.register(Dataset)
@@ -16,13 +16,45 @@ class DatasetAdmin(admin.ModelAdmin):
 
 @admin.register(ImageFile)
 class ImageFileAdmin(admin.ModelAdmin):
-    list_display = ['original_filename', 'dataset', 'uploaded_at', 'is_annotated']
-    list_filter = ['is_annotated', 'uploaded_at', 'dataset']
-    search_fields = ['original_filename', 'dataset__name']
+    list_display = ['original_filename', 'dataset', 'uploaded_at', 'is_annotated', 'width', 'height', 'image_format']
+    list_filter = ['is_annotated', 'image_format', 'uploaded_at', 'dataset']
+    search_fields = ['original_filename', 'dataset__name', 'sha256']
 
 
 @admin.register(PDFFile)
 class PDFFileAdmin(admin.ModelAdmin):
-    list_display = ['original_filename', 'dataset', 'uploaded_at', 'images_extracted']
-    list_filter = ['images_extracted', 'uploaded_at', 'dataset']
-    search_fields = ['original_filename', 'dataset__name']
\ No newline at end of file
+    list_display = ['original_filename', 'dataset', 'uploaded_at', 'status', 'page_count', 'images_count']
+    list_filter = ['status', 'extraction_mode', 'images_extracted', 'uploaded_at', 'dataset']
+    search_fields = ['original_filename', 'dataset__name']
+
+
+@admin.register(ArchiveImport)
+class ArchiveImportAdmin(admin.ModelAdmin):
+    list_display = ['original_filename', 'dataset', 'uploaded_at', 'status', 'images_count', 'annotations_count',
+                    'error_count']
+    list_filter = ['status', 'uploaded_at', 'dataset']
+    search_fields = ['original_filename', 'dataset__name']
+
+@admin.register(DatasetExport)
+class DatasetExportAdmin(admin.ModelAdmin):
+    list_display = ['dataset', 'user', 'export_format', 'deduplicate', 'status', 'file_size', 'created_at']
+    list_filter = ['status', 'export_format', 'created_at']
+    search_fields = ['dataset__name']
+
+@admin.register(DatasetSnapshot)
+class DatasetSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'dataset', 'created_by', 'created_at']
+    list_filter = ['created_at', 'dataset']
+    search_fields = ['name', 'dataset__name']
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['original_filename', 'dataset', 'user', 'kind', 'status', 'received_size', 'total_size', 'updated_at']
+    list_filter = ['status', 'kind', 'created_at']
+    search_fields = ['original_filename', 'dataset__name']
+
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'ref_count', 'created_at']
+    search_fields = ['sha256', 'name']
@@ -0,0 +1,325 @@
+import io
+import json
+import math
+import posixpath
+import tarfile
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+import yaml
+from PIL import Image, UnidentifiedImageError
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from detection.models import Annotation
+from .models import ArchiveImport, ImageFile
+from .snapshots import retire_or_delete_images
+from .uploads import register_image_batch
+
+# Служебные каталоги архиваторов, их содержимое не импортируется
+IGNORED_DIRS = ('__MACOSX',)
+
+
+def iter_archive_members(path):
+    """
+    Файлы архива в порядке хранения: (путь, размер, файловый объект).
+
+    ZIP читается по центральному каталогу, TAR (в т.ч. сжатый) - потоково в
+    режиме 'r|*', поэтому файловый объект действителен только до перехода к
+    следующему файлу. Архив целиком не распаковывается ни в память, ни на диск.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as f:
+                        yield info.filename, info.file_size, f
+    else:
+        with tarfile.open(path, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, member.size, archive.extractfile(member)
+
+
+def normalize_member_path(path):
+    return posixpath.normpath('/' + path.replace('\\', '/'))
+
+
+def get_label_key(path):
+    """Ключ разметки YOLO для изображения: последний каталог images заменяется на labels, как в Ultralytics"""
+    if '/images/' in path:
+        path = '/labels/'.join(path.rsplit('/images/', 1))
+    return posixpath.splitext(path)[0]
+
+
+def normalize_box(x, y, width, height, image_width, image_height):
+    """Рамка (левый верхний угол, размеры) в долях изображения, как хранит Annotation; обрезается по краям"""
+    # Проверяются исходные значения: max/min при обрезке молча заменили бы NaN границей изображения
+    if not all(math.isfinite(value) for value in (x, y, width, height)):
+        raise ValueError(f"Неверная рамка: {x}, {y}, {width}, {height}")
+    x0 = max(0.0, x / image_width)
+    y0 = max(0.0, y / image_height)
+    x1 = min(1.0, (x + width) / image_width)
+    y1 = min(1.0, (y + height) / image_height)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"Неверная рамка: {x}, {y}, {width}, {height}")
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def parse_yolo_line(line):
+    """(class_id, x, y, w, h) в долях из строки YOLO; строка сегментации (полигон) дает описанную рамку"""
+    values = line.split()
+    class_id = int(values[0])
+    coords = [float(value) for value in values[1:]]
+    if len(coords) == 4:
+        x_center, y_center, width, height = coords
+        return class_id, x_center - width / 2, y_center - height / 2, width, height
+    if len(coords) >= 6 and len(coords) % 2 == 0:
+        xs, ys = coords[0::2], coords[1::2]
+        return class_id, min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)
+    raise ValueError(f"Ожидалось 5 значений или полигон, получено {len(values)}")
+
+
+def parse_coco(data):
+    """
+    Разметка COCO: список (имя файла изображения, [(метка, x, y, w, h) в пикселях]).
+    JSON без разделов images и annotations (не COCO) дает пустой список.
+    """
+    if not isinstance(data, dict) or 'images' not in data or 'annotations' not in data:
+        return []
+    categories = {category['id']: category['name'] for category in data.get('categories', [])}
+    boxes = defaultdict(list)
+    for annotation in data['annotations']:
+        if len(annotation.get('bbox') or []) == 4:
+            label = categories.get(annotation['category_id'], str(annotation['category_id']))
+            boxes[annotation['image_id']].append((label, *annotation['bbox']))
+    return [(image['file_name'], boxes[image['id']]) for image in data['images'] if image['id'] in boxes]
+
+
+def parse_voc(data):
+    """Разметка Pascal VOC: (имя файла изображения, [(метка, x, y, w, h) в пикселях]) или None для чужого XML"""
+    root = ElementTree.fromstring(data)
+    if root.tag != 'annotation':
+        return None
+    file_name = root.findtext('filename') or posixpath.basename(root.findtext('path') or '')
+    if not file_name:
+        raise ValueError("Не указано имя изображения (filename)")
+    boxes = []
+    for obj in root.iter('object'):
+        bndbox = obj.find('bndbox')
+        xmin, ymin, xmax, ymax = (float(bndbox.findtext(tag)) for tag in ('xmin', 'ymin', 'xmax', 'ymax'))
+        boxes.append((obj.findtext('name', '').strip(), xmin, ymin, xmax - xmin, ymax - ymin))
+    return file_name, boxes
+
+
+def parse_class_names(name, data):
+    """Имена классов YOLO {id: имя} из classes.txt / *.names или data.yaml (раздел names)"""
+    if name.endswith(('.yaml', '.yml')):
+        config = yaml.safe_load(data)
+        names = config.get('names') if isinstance(config, dict) else None
+        if isinstance(names, list):
+            return dict(enumerate(names))
+        return {int(class_id): str(label) for class_id, label in (names or {}).items()}
+    lines = [line.strip() for line in data.decode('utf-8').splitlines()]
+    return dict(enumerate(line for line in lines if line))
+
+
+class ArchiveImporter:
+    """
+    Импорт архива ZIP/TAR в датасет за один проход.
+
+    Изображения читаются по одному и регистрируются пачками по
+    ARCHIVE_IMPORT_BATCH_SIZE (запись в хранилище потоками, строки - bulk_create),
+    в памяти держится только текущая пачка. Разметка YOLO (txt + classes.txt /
+    data.yaml), COCO (json) и Pascal VOC (xml) может идти в архиве до или после
+    изображений, поэтому она разбирается сразу, а сопоставляется с изображениями
+    и загружается в Annotation пачками в конце. Ошибки отдельных файлов не
+    прерывают импорт и копятся в ArchiveImport.errors.
+    """
+
+    def __init__(self, archive_import):
+        self.archive_import = archive_import
+        self.dataset = archive_import.dataset
+        self.pending_images = {}
+        self.images_by_key = {}
+        self.images_by_name = defaultdict(list)
+        self.yolo_labels = []
+        self.box_labels = []
+        self.class_names = {}
+        self.errors = []
+        self.error_count = 0
+        self.files_processed = 0
+        self.images_count = 0
+        self.annotations_count = 0
+
+    def add_error(self, path, error):
+        self.error_count += 1
+        if len(self.errors) < settings.ARCHIVE_IMPORT_MAX_ERRORS:
+            self.errors.append({'file': path.lstrip('/'), 'error': str(error)})
+
+    def save_progress(self, **fields):
+        ArchiveImport.objects.filter(id=self.archive_import.id).update(
+            files_processed=self.files_processed,
+            images_count=self.images_count,
+            annotations_count=self.annotations_count,
+            error_count=self.error_count,
+            errors=self.errors,
+            **fields
+        )
+
+    def read_member(self, path, size, f):
+        name = posixpath.basename(path)
+        ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+        if ext in settings.ALLOWED_IMAGE_EXTENSIONS:
+            kind = 'image'
+        elif name == 'classes.txt' or ext in ('names', 'yaml', 'yml'):
+            kind = 'classes'
+        elif ext in ('txt', 'json', 'xml'):
+            kind = ext
+        else:
+            return
+        if size > settings.ARCHIVE_MAX_MEMBER_SIZE:
+            raise ValueError(f"Файл больше {settings.ARCHIVE_MAX_MEMBER_SIZE} байт")
+
+        data = f.read()
+        if kind == 'image':
+            try:
+                with Image.open(io.BytesIO(data)) as image:
+                    image_size = image.size
+                    image.verify()
+            except UnidentifiedImageError:
+                raise ValueError("Файл не является изображением")
+            self.pending_images[ContentFile(data, name=name)] = (path, image_size)
+        elif kind == 'classes':
+            self.class_names.update(parse_class_names(name, data))
+        elif kind == 'txt':
+            self.yolo_labels.append((path, data.decode('utf-8')))
+        elif kind == 'json':
+            self.box_labels.extend((path, file_name, boxes) for file_name, boxes in parse_coco(json.loads(data)))
+        else:
+            voc = parse_voc(data)
+            if voc:
+                self.box_labels.append((path, *voc))
+
+    def flush_images(self, executor):
+        files = list(self.pending_images)
+        errors = []
+        registered = register_image_batch(self.dataset, executor, files, errors, source_archive=self.archive_import)
+        for uploaded_file, row in registered:
+            path, (width, height) = self.pending_images[uploaded_file]
+            image = (path, row.id, width, height)
+            self.images_by_key[get_label_key(path)] = image
+            self.images_by_name[posixpath.basename(path)].append(image)
+        for name, error in errors:
+            self.add_error(name, error)
+        self.images_count += len(registered)
+        self.pending_images = {}
+        self.save_progress()
+
+    def find_image(self, label_path, file_name):
+        """
+        Изображение для имени из разметки COCO/VOC: по имени файла, если оно
+        в архиве одно, иначе по пути относительно файла разметки или по окончанию пути.
+        """
+        candidates = self.images_by_name.get(posixpath.basename(file_name), [])
+        if len(candidates) == 1:
+            return candidates[0]
+        relative_path = normalize_member_path(posixpath.join(posixpath.dirname(label_path), file_name))
+        suffix = normalize_member_path(file_name)
+        matches = [image for image in candidates if image[0] == relative_path or image[0].endswith(suffix)]
+        return matches[0] if len(matches) == 1 else None
+
+    def iter_annotations(self):
+        """(id изображения, метка, x, y, w, h в долях) по всей собранной разметке"""
+        for path, text in self.yolo_labels:
+            image = self.images_by_key.get(posixpath.splitext(path)[0])
+            if image is None:
+                self.add_error(path, "Изображение для разметки не найдено")
+                continue
+            for line_number, line in enumerate(text.splitlines(), start=1):
+                if not line.strip():
+                    continue
+                try:
+                    class_id, *box = parse_yolo_line(line)
+                    yield image[1], self.class_names.get(class_id, str(class_id)), *normalize_box(*box, 1, 1)
+                except ValueError as e:
+                    self.add_error(path, f"Строка {line_number}: {e}")
+                    break
+
+        for path, file_name, boxes in self.box_labels:
+            image = self.find_image(path, file_name)
+            if image is None:
+                self.add_error(path, f"Изображение {file_name} не найдено")
+                continue
+            _, image_id, width, height = image
+            for label, *box in boxes:
+                try:
+                    yield image_id, label, *normalize_box(*box, width, height)
+                except (TypeError, ValueError) as e:
+                    self.add_error(path, f"{file_name}: {e}")
+                    break
+
+    def load_annotations(self):
+        batch_size = settings.UPLOAD_BULK_CREATE_BATCH
+        user_id = self.archive_import.user_id
+        batch, annotated_ids = [], set()
+
+        for image_id, label, x, y, width, height in self.iter_annotations():
+            batch.append(Annotation(image_id=image_id, label=label[:100], x=x, y=y, width=width, height=height,
+                                    created_by_id=user_id))
+            annotated_ids.add(image_id)
+            if len(batch) >= batch_size:
+                Annotation.objects.bulk_create(batch)
+                self.annotations_count += len(batch)
+                batch = []
+        Annotation.objects.bulk_create(batch)
+        self.annotations_count += len(batch)
+
+        annotated_ids = list(annotated_ids)
+        for start in range(0, len(annotated_ids), batch_size):
+            ImageFile.objects.filter(id__in=annotated_ids[start:start + batch_size]).update(is_annotated=True)
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=settings.UPLOAD_STORAGE_THREADS) as executor:
+            for path, size, f in iter_archive_members(self.archive_import.archive.path):
+                path = normalize_member_path(path)
+                parts = path.split('/')
+                if parts[-1].startswith('.') or any(part in IGNORED_DIRS for part in parts):
+                    continue
+                try:
+                    self.read_member(path, size, f)
+                except Exception as e:
+                    self.add_error(path, e)
+                self.files_processed += 1
+                if len(self.pending_images) >= settings.ARCHIVE_IMPORT_BATCH_SIZE:
+                    self.flush_images(executor)
+            self.flush_images(executor)
+
+        self.load_annotations()
+        return self.images_count
+
+
+def import_archive(archive_import):
+    """
+    Импорт изображений и разметки из архива в датасет (см. ArchiveImporter).
+
+    Остатки прерванного импорта (повторная доставка задачи) удаляются, а входящие
+    в снимки датасета - помечаются удаленными (retire_or_delete_images). После
+    успешного импорта архив удаляется из хранилища. Возвращает число изображений.
+    """
+    with transaction.atomic():
+        retire_or_delete_images(archive_import.images.all())
+        archive_import.status = 'processing'
+        archive_import.error_message = ''
+        archive_import.save(update_fields=['status', 'error_message'])
+
+    importer = ArchiveImporter(archive_import)
+    importer.run()
+
+    archive_name = archive_import.archive.name
+    importer.save_progress(status='done', archive='')
+    default_storage.delete(archive_name)
+    archive_import.refresh_from_db()
+    return importer.images_count
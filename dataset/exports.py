@@ -0,0 +1,241 @@
+import json
+import os
+import posixpath
+import zipfile
+from datetime import datetime
+from uuid import uuid4
+from xml.etree import ElementTree
+import yaml
+from django.core.files.storage import default_storage
+from detection.models import Annotation
+from .models import DatasetExport
+
+# Блок копирования файла изображения в архив и число строк ImageFile за один запрос к БД
+COPY_BLOCK_SIZE = 1024 * 1024
+QUERY_CHUNK_SIZE = 500
+
+
+class ZipStream:
+    """
+    Приемник для zipfile без seek и tell: записанные байты забираются генератором
+    через pop(). zipfile в этом случае пишет размеры после данных (data descriptor),
+    поэтому архиву не нужен ни временный файл, ни буфер размером с архив.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_zip(entries):
+    """
+    Генератор байтов ZIP-архива из записей (имя, путь к файлу или итерируемые куски байтов).
+
+    Файлы изображений копируются блоками без сжатия (JPEG/PNG уже сжаты),
+    разметка сжимается. В памяти в каждый момент не больше одного блока.
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for name, source in entries:
+            if isinstance(source, str):
+                info = zipfile.ZipInfo.from_file(source, name)
+                info.compress_type = zipfile.ZIP_STORED
+                with open(source, 'rb') as src, archive.open(info, 'w') as dest:
+                    while block := src.read(COPY_BLOCK_SIZE):
+                        dest.write(block)
+                        if stream.buffer:
+                            yield stream.pop()
+            else:
+                info = zipfile.ZipInfo(name, datetime.now().timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with archive.open(info, 'w', force_zip64=True) as dest:
+                    for chunk in source:
+                        dest.write(chunk)
+                        if len(stream.buffer) >= COPY_BLOCK_SIZE:
+                            yield stream.pop()
+            # Заголовок следующей записи и дескриптор этой
+            if stream.buffer:
+                yield stream.pop()
+    # Центральный каталог дописывается при закрытии архива
+    if stream.buffer:
+        yield stream.pop()
+
+
+def iter_export_images(dataset, deduplicate=False):
+    """
+    (имя файла в архиве, ImageFile, аннотации) по изображениям датасета.
+
+    При deduplicate копии одного содержимого (одинаковый SHA-256 или один файл
+    хранилища) дают одну запись с объединенной разметкой; строки идут
+    отсортированными по содержимому, поэтому копии соседние и группа не
+    держит в памяти больше одного изображения. Изображения без файла в
+    хранилище пропускаются.
+    """
+    images = dataset.imagefile_set.prefetch_related('annotation_set')
+
+    if not deduplicate:
+        for image in images.order_by('id').iterator(chunk_size=QUERY_CHUNK_SIZE):
+            if not os.path.exists(image.image.path):
+                continue
+            name = f"{image.id}_{os.path.basename(image.original_filename)}"
+            yield name, image, list(image.annotation_set.all())
+        return
+
+    group_key, group = None, None
+    for image in images.order_by('sha256', 'image', 'id').iterator(chunk_size=QUERY_CHUNK_SIZE):
+        key = image.sha256 or image.image.name
+        if key != group_key and not os.path.exists(image.image.path):
+            continue
+        if key != group_key:
+            if group:
+                yield group
+            ext = os.path.splitext(image.image.name)[1].lower()
+            name = f"{image.sha256}{ext}" if image.sha256 else os.path.basename(image.image.name)
+            group_key, group = key, (name, image, [])
+        group[2].extend(image.annotation_set.all())
+    if group:
+        yield group
+
+
+def unique_boxes(annotations):
+    """Рамки без повторов (копии изображения при дедупликации обычно размечены одинаково)"""
+    return list(dict.fromkeys((ann.label, ann.x, ann.y, ann.width, ann.height) for ann in annotations))
+
+
+def get_class_names(dataset):
+    # order_by() без полей: сортировка модели по created_at иначе попала бы в DISTINCT
+    labels = Annotation.objects.filter(image__dataset=dataset).order_by().values_list('label', flat=True)
+    return sorted(labels.distinct())
+
+
+def iter_yolo_entries(dataset, deduplicate=False):
+    """images/, labels/ (центр и размеры рамки в долях) и data.yaml со списком классов"""
+    class_names = get_class_names(dataset)
+    class_ids = {name: index for index, name in enumerate(class_names)}
+    data = {'path': '.', 'train': 'images', 'val': 'images', 'nc': len(class_names), 'names': class_names}
+    yield 'data.yaml', [yaml.safe_dump(data, allow_unicode=True, sort_keys=False).encode('utf-8')]
+
+    for name, image, annotations in iter_export_images(dataset, deduplicate):
+        yield f"images/{name}", image.image.path
+        lines = [
+            f"{class_ids[label]} {x + width / 2:.6f} {y + height / 2:.6f} {width:.6f} {height:.6f}\n"
+            for label, x, y, width, height in unique_boxes(annotations)
+        ]
+        yield f"labels/{posixpath.splitext(name)[0]}.txt", [''.join(lines).encode('utf-8')]
+
+
+def iter_coco_json(dataset, deduplicate, categories):
+    """annotations.json по кускам: разделы images и annotations - отдельные проходы по изображениям"""
+    yield b'{"info": ' + json.dumps({'description': dataset.name}, ensure_ascii=False).encode('utf-8')
+    yield b', "categories": ' + json.dumps(
+        [{'id': category_id, 'name': name} for name, category_id in categories.items()], ensure_ascii=False
+    ).encode('utf-8')
+
+    yield b', "images": ['
+    for index, (name, image, _) in enumerate(iter_export_images(dataset, deduplicate)):
+        width, height = image.get_size()
+        entry = {'id': image.id, 'file_name': f"images/{name}", 'width': width, 'height': height}
+        yield (b', ' if index else b'') + json.dumps(entry, ensure_ascii=False).encode('utf-8')
+
+    yield b'], "annotations": ['
+    annotation_id = 0
+    for name, image, annotations in iter_export_images(dataset, deduplicate):
+        width, height = image.get_size()
+        for label, x, y, box_width, box_height in unique_boxes(annotations):
+            annotation_id += 1
+            bbox = [round(x * width, 2), round(y * height, 2), round(box_width * width, 2), round(box_height * height, 2)]
+            entry = {'id': annotation_id, 'image_id': image.id, 'category_id': categories[label],
+                     'bbox': bbox, 'area': round(bbox[2] * bbox[3], 2), 'iscrowd': 0}
+            yield (b', ' if annotation_id > 1 else b'') + json.dumps(entry, ensure_ascii=False).encode('utf-8')
+    yield b']}'
+
+
+def iter_coco_entries(dataset, deduplicate=False):
+    """images/ и annotations.json (рамки в пикселях: левый верхний угол, ширина, высота)"""
+    for name, image, _ in iter_export_images(dataset, deduplicate):
+        yield f"images/{name}", image.image.path
+    categories = {name: index for index, name in enumerate(get_class_names(dataset), start=1)}
+    yield 'annotations.json', iter_coco_json(dataset, deduplicate, categories)
+
+
+def get_voc_xml(name, width, height, boxes):
+    root = ElementTree.Element('annotation')
+    ElementTree.SubElement(root, 'folder').text = 'JPEGImages'
+    ElementTree.SubElement(root, 'filename').text = name
+    size = ElementTree.SubElement(root, 'size')
+    for tag, value in (('width', width), ('height', height), ('depth', 3)):
+        ElementTree.SubElement(size, tag).text = str(value)
+    for label, x, y, box_width, box_height in boxes:
+        obj = ElementTree.SubElement(root, 'object')
+        ElementTree.SubElement(obj, 'name').text = label
+        ElementTree.SubElement(obj, 'difficult').text = '0'
+        bndbox = ElementTree.SubElement(obj, 'bndbox')
+        for tag, value in (('xmin', x * width), ('ymin', y * height),
+                           ('xmax', (x + box_width) * width), ('ymax', (y + box_height) * height)):
+            ElementTree.SubElement(bndbox, tag).text = str(round(value))
+    return ElementTree.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+def iter_voc_entries(dataset, deduplicate=False):
+    """JPEGImages/, Annotations/ (по XML на изображение, рамки в пикселях) и labels.txt"""
+    yield 'labels.txt', ['\n'.join(get_class_names(dataset)).encode('utf-8')]
+    for name, image, annotations in iter_export_images(dataset, deduplicate):
+        yield f"JPEGImages/{name}", image.image.path
+        width, height = image.get_size()
+        yield f"Annotations/{posixpath.splitext(name)[0]}.xml", [
+            get_voc_xml(name, width, height, unique_boxes(annotations))
+        ]
+
+
+EXPORT_FORMATS = {
+    'yolo': iter_yolo_entries,
+    'coco': iter_coco_entries,
+    'voc': iter_voc_entries,
+}
+
+
+def stream_dataset_export(dataset, export_format, deduplicate=False):
+    """Генератор байтов ZIP-архива датасета в формате export_format (yolo, coco, voc)"""
+    return iter_zip(EXPORT_FORMATS[export_format](dataset, deduplicate))
+
+
+def get_export_filename(dataset, export_format):
+    return f"{dataset.name}_{export_format}.zip"
+
+
+def build_dataset_export(dataset_export):
+    """
+    Запись архива для фоновой выгрузки (большие датасеты) в хранилище.
+
+    Архив пишется тем же генератором, что и при потоковой отдаче, во временный
+    файл рядом с итоговым и переименовывается после записи целиком.
+    """
+    name = f"exports/{uuid4().hex}.zip"
+    path = default_storage.path(name)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in stream_dataset_export(dataset_export.dataset, dataset_export.export_format,
+                                               dataset_export.deduplicate):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    DatasetExport.objects.filter(id=dataset_export.id).update(
+        file=name, file_size=os.path.getsize(path), status='done'
+    )
+    return name
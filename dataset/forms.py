@@ -50,4 +50,10 @@ class PDFUploadForm(forms.Form):
         validators=[FileExtensionValidator(allowed_extensions=['pdf'])],
         label='Выберите PDF файлы',
         help_text='Можно выбрать несколько PDF файлов'
+    )
+    extraction_mode = forms.ChoiceField(
+        choices=PDFFile.EXTRACTION_MODE_CHOICES,
+        initial='pages',
+        label='Что извлекать',
+        widget=forms.Select(attrs={'class': 'form-control'})
     )
\ No newline at end of file
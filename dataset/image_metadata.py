@@ -0,0 +1,77 @@
+import hashlib
+import os
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.db import transaction
+from .models import ImageFile
+
+# Тег EXIF Orientation
+EXIF_ORIENTATION_TAG = 0x0112
+
+METADATA_FIELDS = ['width', 'height', 'file_size', 'sha256', 'phash', 'image_format', 'exif_orientation']
+
+
+def compute_dhash(img, hash_size=8):
+    """
+    Перцептивный разностный хэш (dHash): 64 бита в hex.
+
+    Изображение уменьшается до (hash_size + 1) x hash_size в оттенках серого, бит -
+    ярче ли пиксель соседа справа. Близкие изображения (пережатые, уменьшенные)
+    отличаются в немногих битах, что позволяет искать дубликаты по расстоянию Хэмминга.
+    """
+    pixels = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):0{hash_size * hash_size // 4}x}"
+
+
+def extract_image_metadata(path):
+    """Размеры, размер файла, SHA-256, dHash, формат и EXIF Orientation файла изображения"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+
+    with Image.open(path) as img:
+        width, height = img.size
+        image_format = (img.format or '').lower()
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG)
+        # Для хэша нужен лишь крошечный растр: JPEG декодируется сразу с уменьшением
+        img.draft('L', (64, 64))
+        phash = compute_dhash(img)
+
+    return {
+        'width': width,
+        'height': height,
+        'file_size': os.path.getsize(path),
+        'sha256': sha256.hexdigest(),
+        'phash': phash,
+        'image_format': image_format,
+        'exif_orientation': orientation,
+    }
+
+
+def update_image_metadata(image_files):
+    """Заполнение метаданных у списка ImageFile одним bulk_update; возвращает (обновлено, ошибки)"""
+    updated, errors = [], []
+    for image_file in image_files:
+        try:
+            for field, value in extract_image_metadata(image_file.image.path).items():
+                setattr(image_file, field, value)
+            updated.append(image_file)
+        except Exception as e:
+            errors.append((image_file.id, str(e)))
+
+    ImageFile.objects.bulk_update(updated, METADATA_FIELDS)
+    return len(updated), errors
+
+
+def queue_image_metadata(image_ids):
+    """Постановка новых изображений в очередь на получение метаданных (после фиксации транзакции)"""
+    from .tasks import extract_image_metadata_task
+
+    image_ids = list(image_ids)
+    batch_size = settings.IMAGE_METADATA_BATCH_SIZE
+    for start in range(0, len(image_ids), batch_size):
+        batch = image_ids[start:start + batch_size]
+        transaction.on_commit(lambda batch=batch: extract_image_metadata_task.delay(batch))
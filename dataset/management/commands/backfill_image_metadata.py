@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from dataset.image_metadata import update_image_metadata
+from dataset.models import ImageFile
+from dataset.tasks import extract_image_metadata_task
+
+
+class Command(BaseCommand):
+    help = 'Заполнение метаданных (размеры, SHA-256, перцептивный хэш, формат, EXIF) у загруженных ранее изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, help='Только изображения датасета с этим ID')
+        parser.add_argument('--batch-size', type=int, default=200, help='Изображений в пачке')
+        parser.add_argument('--all', action='store_true', help='Пересчитать и уже заполненные метаданные')
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Поставить пачки в очередь ingest вместо обработки в этом процессе')
+
+    def handle(self, *args, **options):
+        images = ImageFile.objects.order_by('id')
+        if options['dataset']:
+            images = images.filter(dataset_id=options['dataset'])
+        if not options['all']:
+            images = images.filter(sha256='')
+
+        image_ids = list(images.values_list('id', flat=True))
+        batch_size = options['batch_size']
+        self.stdout.write(f"Изображений без метаданных: {len(image_ids)}")
+
+        updated = failed = 0
+        for start in range(0, len(image_ids), batch_size):
+            batch = image_ids[start:start + batch_size]
+            if options['run_async']:
+                extract_image_metadata_task.delay(batch)
+                continue
+
+            batch_updated, errors = update_image_metadata(list(ImageFile.objects.filter(id__in=batch)))
+            updated += batch_updated
+            failed += len(errors)
+            for image_id, error in errors:
+                self.stderr.write(f"Изображение {image_id}: {error}")
+            self.stdout.write(f"Обработано {min(start + batch_size, len(image_ids))} из {len(image_ids)}")
+
+        if options['run_async']:
+            self.stdout.write(f"Поставлено в очередь пачек: {-(-len(image_ids) // batch_size)}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Метаданные заполнены: {updated}, ошибок: {failed}"))
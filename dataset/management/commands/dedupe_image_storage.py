@@ -0,0 +1,48 @@
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from dataset.models import ImageBlob, ImageFile
+from dataset.storage import ContentAddressedStorage, image_storage
+
+
+class Command(BaseCommand):
+    help = 'Перенос изображений, загруженных до хранилища по содержимому, в общие blob-файлы со счетчиком ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, help='Только изображения датасета с этим ID')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать файлы для переноса')
+
+    def handle(self, *args, **options):
+        images = ImageFile.all_objects.exclude(image__startswith=f"{ContentAddressedStorage.prefix}/").order_by('id')
+        if options['dataset']:
+            images = images.filter(dataset_id=options['dataset'])
+
+        self.stdout.write(f"Изображений для переноса: {images.count()}")
+        if options['dry_run']:
+            return
+
+        # Старые файлы удаляются напрямую: у них нет строки ImageBlob
+        legacy_storage = FileSystemStorage()
+        moved = failed = 0
+        for image_file in images.iterator():
+            old_name = image_file.image.name
+            try:
+                with image_storage.open(old_name) as f:
+                    new_name = image_storage.save(old_name, File(f))
+                ImageFile.all_objects.filter(id=image_file.id).update(image=new_name)
+                legacy_storage.delete(old_name)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Изображение {image_file.id} ({old_name}): {e}")
+                continue
+
+            moved += 1
+            if moved % 500 == 0:
+                self.stdout.write(f"Перенесено {moved}")
+
+        blobs = ImageBlob.objects.aggregate(count=Count('id'), size=Sum('size'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено: {moved}, ошибок: {failed}. Уникальных файлов: {blobs['count']} "
+            f"({(blobs['size'] or 0) / 1024 / 1024:.0f} МБ) на {ImageFile.objects.count()} изображений"
+        ))
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='page_number',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Страница PDF'),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='source_pdf',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='images', to='dataset.pdffile', verbose_name='Исходный PDF'),
+        ),
+        migrations.AddField(
+            model_name='pdffile',
+            name='error_message',
+            field=models.TextField(blank=True, verbose_name='Ошибка обработки'),
+        ),
+        migrations.AddField(
+            model_name='pdffile',
+            name='extraction_mode',
+            field=models.CharField(choices=[('pages', 'Страницы целиком'), ('images', 'Встроенные изображения')], default='pages', max_length=20, verbose_name='Режим извлечения'),
+        ),
+        migrations.AddField(
+            model_name='pdffile',
+            name='images_count',
+            field=models.IntegerField(default=0, verbose_name='Получено изображений'),
+        ),
+        migrations.AddField(
+            model_name='pdffile',
+            name='pages_processed',
+            field=models.IntegerField(default=0, verbose_name='Обработано страниц'),
+        ),
+        migrations.AddField(
+            model_name='pdffile',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает обработки'), ('processing', 'Обрабатывается'), ('done', 'Обработан'), ('error', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус обработки'),
+        ),
+    ]
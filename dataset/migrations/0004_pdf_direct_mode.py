@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0003_pdf_ingest'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pdffile',
+            name='extraction_mode',
+            field=models.CharField(choices=[('pages', 'Страницы целиком'), ('images', 'Встроенные изображения'), ('direct', 'Без извлечения (детекция по страницам)')], default='pages', max_length=20, verbose_name='Режим извлечения'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dataset', '0004_pdf_direct_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('original_filename', models.CharField(max_length=255, verbose_name='Исходное имя файла')),
+                ('kind', models.CharField(choices=[('image', 'Изображение'), ('pdf', 'PDF')], max_length=20, verbose_name='Тип файла')),
+                ('extraction_mode', models.CharField(choices=[('pages', 'Страницы целиком'), ('images', 'Встроенные изображения'), ('direct', 'Без извлечения (детекция по страницам)')], default='pages', max_length=20, verbose_name='Режим извлечения (PDF)')),
+                ('total_size', models.BigIntegerField(verbose_name='Размер файла')),
+                ('chunk_size', models.IntegerField(verbose_name='Размер части')),
+                ('received_size', models.BigIntegerField(default=0, verbose_name='Получено байт')),
+                ('status', models.CharField(choices=[('uploading', 'Загружается'), ('assembling', 'Сборка файла'), ('done', 'Завершена'), ('error', 'Ошибка')], default='uploading', max_length=20, verbose_name='Статус')),
+                ('error_message', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлена')),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dataset.dataset', verbose_name='Датасет')),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dataset.imagefile', verbose_name='Изображение')),
+                ('pdf', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dataset.pdffile', verbose_name='PDF файл')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Загрузка частями',
+                'verbose_name_plural': 'Загрузки частями',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offset', models.BigIntegerField(verbose_name='Смещение')),
+                ('size', models.IntegerField(verbose_name='Размер')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Получена')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='dataset.uploadsession', verbose_name='Загрузка')),
+            ],
+            options={
+                'verbose_name': 'Часть загрузки',
+                'verbose_name_plural': 'Части загрузки',
+                'ordering': ['offset'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='uploadchunk',
+            constraint=models.UniqueConstraint(fields=('session', 'offset'), name='unique_upload_chunk_offset'),
+        ),
+    ]
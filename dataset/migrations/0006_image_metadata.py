@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0005_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='exif_orientation',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='EXIF Orientation'),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Размер файла, байт'),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Высота, px'),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='image_format',
+            field=models.CharField(blank=True, max_length=10, verbose_name='Формат'),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='phash',
+            field=models.CharField(blank=True, max_length=16, verbose_name='Перцептивный хэш'),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Ширина, px'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0006_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Рендишены'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0007_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='tiles_status',
+            field=models.CharField(blank=True, choices=[('', 'Не создана'), ('pending', 'Создается'), ('ready', 'Готова'), ('error', 'Ошибка')], default='', max_length=20, verbose_name='Пирамида тайлов'),
+        ),
+    ]
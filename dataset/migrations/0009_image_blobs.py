@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:40
+
+import dataset.models
+import dataset.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0008_image_tiles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('size', models.BigIntegerField(verbose_name='Размер, байт')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='imagefile',
+            name='image',
+            field=models.ImageField(help_text='Поддерживаемые форматы: JPG, PNG, JPEG', storage=dataset.storage.ContentAddressedStorage(), upload_to=dataset.models.rename_uploaded_file, verbose_name='Изображение'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:46
+
+import dataset.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dataset', '0009_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='kind',
+            field=models.CharField(choices=[('image', 'Изображение'), ('pdf', 'PDF'), ('archive', 'Архив')], max_length=20, verbose_name='Тип файла'),
+        ),
+        migrations.CreateModel(
+            name='ArchiveImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive', models.FileField(blank=True, upload_to=dataset.models.rename_uploaded_archive, verbose_name='Архив')),
+                ('original_filename', models.CharField(max_length=255, verbose_name='Исходное имя файла')),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает обработки'), ('processing', 'Обрабатывается'), ('done', 'Обработан'), ('error', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус обработки')),
+                ('files_processed', models.IntegerField(default=0, verbose_name='Обработано файлов')),
+                ('images_count', models.IntegerField(default=0, verbose_name='Получено изображений')),
+                ('annotations_count', models.IntegerField(default=0, verbose_name='Получено аннотаций')),
+                ('error_count', models.IntegerField(default=0, verbose_name='Файлов с ошибками')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки по файлам')),
+                ('error_message', models.TextField(blank=True, verbose_name='Ошибка обработки')),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dataset.dataset', verbose_name='Датасет')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Импорт архива',
+                'verbose_name_plural': 'Импорт архивов',
+                'ordering': ['-uploaded_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='source_archive',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='images', to='dataset.archiveimport', verbose_name='Исходный архив'),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='archive',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dataset.archiveimport', verbose_name='Импорт архива'),
+        ),
+    ]
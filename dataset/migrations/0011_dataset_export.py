@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dataset', '0010_archive_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('export_format', models.CharField(choices=[('yolo', 'YOLO'), ('coco', 'COCO'), ('voc', 'Pascal VOC')], default='yolo', max_length=10, verbose_name='Формат')),
+                ('deduplicate', models.BooleanField(default=False, verbose_name='Без дубликатов')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('processing', 'Собирается'), ('done', 'Готова'), ('error', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус')),
+                ('file', models.FileField(blank=True, upload_to='exports/', verbose_name='Архив')),
+                ('file_size', models.BigIntegerField(default=0, verbose_name='Размер архива, байт')),
+                ('error_message', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dataset.dataset', verbose_name='Датасет')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка датасета',
+                'verbose_name_plural': 'Выгрузки датасетов',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dataset', '0011_dataset_export'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='retired_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Удалено'),
+        ),
+        migrations.CreateModel(
+            name='DatasetSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=255, verbose_name='Название')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Создал')),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='dataset.dataset', verbose_name='Датасет')),
+            ],
+            options={
+                'verbose_name': 'Снимок датасета',
+                'verbose_name_plural': 'Снимки датасетов',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0012_dataset_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetsnapshot',
+            name='auto_created',
+            field=models.BooleanField(default=False, verbose_name='Создан автоматически'),
+        ),
+    ]
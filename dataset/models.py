@@ -1,6 +1,8 @@
+from django.core.files.storage import default_storage
 from django.db import models
 from django.urls import reverse
 from users.models import CustomUser
+from .storage import image_storage
 import os
 from uuid import uuid4
 
@@ -19,6 +21,24 @@ def rename_uploaded_pdf(instance, filename):
     return os.path.join('uploads/pdf/', filename)
 
 
+def rename_uploaded_archive(instance, filename):
+    """Переименовывает загружаемый архив (составные расширения вроде .tar.gz сохраняются)"""
+    name = filename.lower()
+    ext = next((ext for ext in ('tar.gz', 'tar.bz2', 'tar.xz') if name.endswith(f".{ext}")), name.split('.')[-1])
+    filename = f"{uuid4().hex}.{ext}"
+    return os.path.join('uploads/archives/', filename)
+
+
+class CurrentRowManager(models.Manager):
+    """
+    Только текущие строки: удаленные после снимка датасета (retired_at) остаются
+    в БД для снимков, но в работе с датасетом не видны
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(retired_at__isnull=True)
+
+
 class Dataset(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Черновик'),
@@ -58,7 +78,9 @@ class Dataset(models.Model):
 
     def get_annotated_images_count(self):
         """Количество изображений с аннотациями """
-        return self.imagefile_set.filter(annotation__isnull=False).distinct().count()
+        return self.imagefile_set.filter(
+            annotation__isnull=False, annotation__retired_at__isnull=True
+        ).distinct().count()
 
     def get_unique_classes_count(self):
         """Количество уникальных классов в аннотациях"""
@@ -68,16 +90,75 @@ class Dataset(models.Model):
 
 
 
+class ImageBlob(models.Model):
+    """Файл изображения в хранилище по содержимому (dataset.storage); ref_count - число ссылок ImageFile"""
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='SHA-256')
+    name = models.CharField(max_length=255, unique=True, verbose_name='Имя файла')
+    size = models.BigIntegerField(verbose_name='Размер, байт')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='Ссылок')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создан')
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+
 class ImageFile(models.Model):
+    TILES_STATUS_CHOICES = [
+        ('', 'Не создана'),
+        ('pending', 'Создается'),
+        ('ready', 'Готова'),
+        ('error', 'Ошибка'),
+    ]
+
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, verbose_name='Датасет')
     image = models.ImageField(
         upload_to=rename_uploaded_file,
+        storage=image_storage,
         verbose_name='Изображение',
         help_text='Поддерживаемые форматы: JPG, PNG, JPEG'
     )
     original_filename = models.CharField(max_length=255, verbose_name='Исходное имя файла')
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
     is_annotated = models.BooleanField(default=False, verbose_name='Размечено')
+    source_pdf = models.ForeignKey(
+        'PDFFile',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='images',
+        verbose_name='Исходный PDF'
+    )
+    page_number = models.PositiveIntegerField(null=True, blank=True, verbose_name='Страница PDF')
+    source_archive = models.ForeignKey(
+        'ArchiveImport',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='images',
+        verbose_name='Исходный архив'
+    )
+    # Метаданные заполняются фоновой задачей (dataset.image_metadata), пустой sha256 - еще не получены
+    width = models.PositiveIntegerField(null=True, blank=True, verbose_name='Ширина, px')
+    height = models.PositiveIntegerField(null=True, blank=True, verbose_name='Высота, px')
+    file_size = models.BigIntegerField(null=True, blank=True, verbose_name='Размер файла, байт')
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True, verbose_name='SHA-256')
+    phash = models.CharField(max_length=16, blank=True, verbose_name='Перцептивный хэш')
+    image_format = models.CharField(max_length=10, blank=True, verbose_name='Формат')
+    exif_orientation = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='EXIF Orientation')
+    # Уменьшенные копии в WebP (dataset.renditions): {'thumb': имя файла, 'preview': ...}
+    renditions = models.JSONField(default=dict, blank=True, verbose_name='Рендишены')
+    # Пирамида тайлов для больших снимков (dataset.tiles): '' - не запрошена
+    tiles_status = models.CharField(max_length=20, choices=TILES_STATUS_CHOICES, default='', blank=True,
+                                    verbose_name='Пирамида тайлов')
+    # Удалено из датасета, но входит в снимок (dataset.snapshots); null - текущая строка
+    retired_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name='Удалено')
+
+    objects = CurrentRowManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = 'Изображение'
@@ -87,8 +168,84 @@ class ImageFile(models.Model):
     def __str__(self):
         return f"{self.original_filename} ({self.dataset.name})"
 
+    def get_size(self):
+        """(ширина, высота) пикселей файла; из БД, если метаданные уже получены"""
+        if self.width and self.height:
+            return self.width, self.height
+        from PIL import Image
+        with Image.open(self.image.path) as img:
+            return img.size
+
+    def get_rendition_url(self, rendition):
+        """URL уменьшенной копии; оригинал, пока рендишен не создан"""
+        name = self.renditions.get(rendition)
+        if name:
+            return default_storage.url(name)
+        return self.image.url
+
+    def get_display_size(self):
+        """Размер с учетом EXIF Orientation: при поворотах на 90° ширина и высота меняются местами"""
+        width, height = self.get_size()
+        if self.exif_orientation in (5, 6, 7, 8):
+            return height, width
+        return width, height
+
+
+class DatasetSnapshot(models.Model):
+    """
+    Снимок датасета на момент created_at.
+
+    Строки не копируются: в снимок входят изображения и аннотации, созданные
+    не позже него и не удаленные до него (uploaded_at/created_at и retired_at
+    строк служат интервалом версии). Поэтому создание снимка - одна вставка
+    независимо от размера датасета.
+    """
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='snapshots', verbose_name='Датасет')
+    name = models.CharField(max_length=255, blank=True, verbose_name='Название')
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True,
+                                   verbose_name='Создал')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')
+    # Создан при запуске обучения без выбранного снимка; удаляется вместе с последней моделью на нем
+    auto_created = models.BooleanField(default=False, verbose_name='Создан автоматически')
+
+    class Meta:
+        verbose_name = 'Снимок датасета'
+        verbose_name_plural = 'Снимки датасетов'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.name or f"Снимок {self.created_at:%d.%m.%Y %H:%M} ({self.dataset.name})"
+
+    def get_visibility_filter(self, created_field):
+        """Условие на строку, существовавшую в момент снимка (created_field - поле времени создания)"""
+        return models.Q(**{f"{created_field}__lte": self.created_at}) & (
+            models.Q(retired_at__isnull=True) | models.Q(retired_at__gt=self.created_at)
+        )
+
+    def get_images(self):
+        """Изображения датасета в состоянии на момент снимка"""
+        return ImageFile.all_objects.filter(self.get_visibility_filter('uploaded_at'), dataset=self.dataset)
+
+    def get_annotations(self):
+        """Аннотации датасета в состоянии на момент снимка"""
+        from detection.models import Annotation
+        return Annotation.all_objects.filter(self.get_visibility_filter('created_at'), image__dataset=self.dataset)
+
 
 class PDFFile(models.Model):
+    EXTRACTION_MODE_CHOICES = [
+        ('pages', 'Страницы целиком'),
+        ('images', 'Встроенные изображения'),
+        ('direct', 'Без извлечения (детекция по страницам)'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает обработки'),
+        ('processing', 'Обрабатывается'),
+        ('done', 'Обработан'),
+        ('error', 'Ошибка'),
+    ]
+
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, verbose_name='Датасет')
     pdf = models.FileField(
         upload_to=rename_uploaded_pdf,
@@ -98,10 +255,162 @@ class PDFFile(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
     images_extracted = models.BooleanField(default=False, verbose_name='Изображения извлечены')
     page_count = models.IntegerField(default=0, verbose_name='Количество страниц')
+    extraction_mode = models.CharField(
+        max_length=20,
+        choices=EXTRACTION_MODE_CHOICES,
+        default='pages',
+        verbose_name='Режим извлечения'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Статус обработки')
+    pages_processed = models.IntegerField(default=0, verbose_name='Обработано страниц')
+    images_count = models.IntegerField(default=0, verbose_name='Получено изображений')
+    error_message = models.TextField(blank=True, verbose_name='Ошибка обработки')
 
     class Meta:
         verbose_name = 'PDF файл'
         verbose_name_plural = 'PDF файлы'
 
     def __str__(self):
-        return f"{self.original_filename} ({self.dataset.name})"
\ No newline at end of file
+        return f"{self.original_filename} ({self.dataset.name})"
+
+    def get_progress(self):
+        """Процент обработанных страниц"""
+        if not self.page_count:
+            return 0
+        return int(self.pages_processed * 100 / self.page_count)
+
+
+class ArchiveImport(models.Model):
+    """Импорт изображений и разметки (YOLO, COCO, Pascal VOC) из архива ZIP/TAR (см. dataset.archives)"""
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает обработки'),
+        ('processing', 'Обрабатывается'),
+        ('done', 'Обработан'),
+        ('error', 'Ошибка'),
+    ]
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, verbose_name='Датасет')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name='Пользователь')
+    # Архив удаляется после успешного импорта: изображения уже лежат в хранилище
+    archive = models.FileField(upload_to=rename_uploaded_archive, blank=True, verbose_name='Архив')
+    original_filename = models.CharField(max_length=255, verbose_name='Исходное имя файла')
+    uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Статус обработки')
+    files_processed = models.IntegerField(default=0, verbose_name='Обработано файлов')
+    images_count = models.IntegerField(default=0, verbose_name='Получено изображений')
+    annotations_count = models.IntegerField(default=0, verbose_name='Получено аннотаций')
+    error_count = models.IntegerField(default=0, verbose_name='Файлов с ошибками')
+    # Первые ARCHIVE_IMPORT_MAX_ERRORS ошибок: [{'file': путь в архиве, 'error': текст}]
+    errors = models.JSONField(default=list, blank=True, verbose_name='Ошибки по файлам')
+    error_message = models.TextField(blank=True, verbose_name='Ошибка обработки')
+
+    class Meta:
+        verbose_name = 'Импорт архива'
+        verbose_name_plural = 'Импорт архивов'
+        ordering = ['-uploaded_at']
+
+    def __str__(self):
+        return f"{self.original_filename} ({self.dataset.name})"
+
+
+class DatasetExport(models.Model):
+    """Выгрузка датасета в архив, собранная в фоне (большие датасеты, см. dataset.exports)"""
+    FORMAT_CHOICES = [
+        ('yolo', 'YOLO'),
+        ('coco', 'COCO'),
+        ('voc', 'Pascal VOC'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('processing', 'Собирается'),
+        ('done', 'Готова'),
+        ('error', 'Ошибка'),
+    ]
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, verbose_name='Датасет')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name='Пользователь')
+    export_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='yolo', verbose_name='Формат')
+    deduplicate = models.BooleanField(default=False, verbose_name='Без дубликатов')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Статус')
+    file = models.FileField(upload_to='exports/', blank=True, verbose_name='Архив')
+    file_size = models.BigIntegerField(default=0, verbose_name='Размер архива, байт')
+    error_message = models.TextField(blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+
+    class Meta:
+        verbose_name = 'Выгрузка датасета'
+        verbose_name_plural = 'Выгрузки датасетов'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.dataset.name} ({self.get_export_format_display()})"
+
+
+class UploadSession(models.Model):
+    """Возобновляемая загрузка одного файла частями (см. dataset.uploads)"""
+    KIND_CHOICES = [
+        ('image', 'Изображение'),
+        ('pdf', 'PDF'),
+        ('archive', 'Архив'),
+    ]
+
+    STATUS_CHOICES = [
+        ('uploading', 'Загружается'),
+        ('assembling', 'Сборка файла'),
+        ('done', 'Завершена'),
+        ('error', 'Ошибка'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, verbose_name='Датасет')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name='Пользователь')
+    original_filename = models.CharField(max_length=255, verbose_name='Исходное имя файла')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Тип файла')
+    extraction_mode = models.CharField(max_length=20, choices=PDFFile.EXTRACTION_MODE_CHOICES, default='pages',
+                                       verbose_name='Режим извлечения (PDF)')
+    total_size = models.BigIntegerField(verbose_name='Размер файла')
+    chunk_size = models.IntegerField(verbose_name='Размер части')
+    received_size = models.BigIntegerField(default=0, verbose_name='Получено байт')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading', verbose_name='Статус')
+    error_message = models.TextField(blank=True, verbose_name='Ошибка')
+    image = models.ForeignKey(ImageFile, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Изображение')
+    pdf = models.ForeignKey(PDFFile, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='PDF файл')
+    archive = models.ForeignKey(ArchiveImport, on_delete=models.SET_NULL, null=True, blank=True,
+                                verbose_name='Импорт архива')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлена')
+
+    class Meta:
+        verbose_name = 'Загрузка частями'
+        verbose_name_plural = 'Загрузки частями'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.original_filename} ({self.get_status_display()})"
+
+    def get_chunk_count(self):
+        return -(-self.total_size // self.chunk_size)
+
+    def get_progress(self):
+        """Процент полученных байт"""
+        if not self.total_size:
+            return 0
+        return int(self.received_size * 100 / self.total_size)
+
+
+class UploadChunk(models.Model):
+    """Полученная часть загрузки: байты [offset, offset + size) лежат в отдельном файле на диске"""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks',
+                                verbose_name='Загрузка')
+    offset = models.BigIntegerField(verbose_name='Смещение')
+    size = models.IntegerField(verbose_name='Размер')
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='Получена')
+
+    class Meta:
+        verbose_name = 'Часть загрузки'
+        verbose_name_plural = 'Части загрузки'
+        ordering = ['offset']
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'offset'], name='unique_upload_chunk_offset'),
+        ]
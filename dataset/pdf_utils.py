@@ -1,103 +1,193 @@
+import math
+import billiard
 import fitz
-from io import BytesIO
-from django.core.files import File
-from .models import ImageFile
-
-
-def extract_images_from_pdf(pdf_file):
-    """Извлечение изображений из PDF файла"""
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import F
+from .image_metadata import queue_image_metadata
+from .models import ImageFile, PDFFile, rename_uploaded_file
+from .snapshots import retire_or_delete_images
+from .storage import image_storage
+
+# Форматы встроенных изображений, которые сохраняются без перекодирования
+PASSTHROUGH_IMAGE_EXTENSIONS = ('jpeg', 'jpg', 'png')
+
+
+def _save_image(image_bytes, filename, page_number):
+    """Запись изображения в хранилище; возвращает данные для строки ImageFile"""
+    name = image_storage.save(rename_uploaded_file(None, filename), ContentFile(image_bytes))
+    return {'image': name, 'original_filename': filename, 'page_number': page_number}
+
+
+def _render_page(page, original_filename, page_number, dpi):
+    """Страница PDF целиком в JPEG"""
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+    filename = f"{original_filename}_page_{page_number}.jpg"
+    return [_save_image(pix.tobytes("jpeg"), filename, page_number)]
+
+
+def _extract_page_images(document, page, original_filename, page_number, seen_xrefs):
+    """Встроенные изображения страницы; мелкие (иконки, линии) и повторы пропускаются"""
+    rows = []
+    for img_index, img in enumerate(page.get_images(), start=1):
+        xref = img[0]
+        if xref in seen_xrefs:
+            continue
+        seen_xrefs.add(xref)
+
+        base_image = document.extract_image(xref)
+        if min(base_image["width"], base_image["height"]) < settings.PDF_MIN_IMAGE_SIZE:
+            continue
+
+        image_ext = base_image["ext"]
+        image_bytes = base_image["image"]
+        if image_ext not in PASSTHROUGH_IMAGE_EXTENSIONS:
+            # JPX, JBIG2, CMYK и т.п. перекодируются в PNG, который читают PIL и YOLO
+            pix = fitz.Pixmap(document, xref)
+            if pix.n - pix.alpha >= 4:
+                pix = fitz.Pixmap(fitz.csRGB, pix)
+            image_bytes, image_ext = pix.tobytes("png"), 'png'
+
+        filename = f"{original_filename}_page_{page_number}_img_{img_index}.{image_ext}"
+        rows.append(_save_image(image_bytes, filename, page_number))
+    return rows
+
+
+def _process_page_range(args):
+    """
+    Обработка диапазона страниц [start, end) в процессе пула.
+
+    Каждый процесс открывает документ сам (объекты PyMuPDF не передаются между
+    процессами) и сразу пишет изображения в хранилище, возвращая только имена файлов.
+    """
+    pdf_path, original_filename, start, end, mode, dpi = args
+    document = fitz.open(pdf_path)
+    rows, seen_xrefs = [], set()
     try:
-        # Открываем PDF файл
-        pdf_document = fitz.open(pdf_file.pdf.path)
-        extracted_images = []
-
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-
-            # Получаем изображения со страницы
-            image_list = page.get_images()
-
-            for img_index, img in enumerate(image_list):
-                # Получаем изображение
-                xref = img[0]
-                base_image = pdf_document.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-
-                # Создаем имя файла
-                image_filename = f"{pdf_file.original_filename}_page_{page_num + 1}_img_{img_index + 1}.{image_ext}"
+        for page_index in range(start, end):
+            page = document[page_index]
+            if mode == 'pages':
+                rows.extend(_render_page(page, original_filename, page_index + 1, dpi))
+            else:
+                rows.extend(_extract_page_images(document, page, original_filename, page_index + 1, seen_xrefs))
+    finally:
+        document.close()
+    return end - start, rows
+
+
+def render_page_array(page, imgsz):
+    """
+    Страница в RGB-растр, чья длинная сторона равна imgsz модели.
+
+    Возвращает (pixmap, массив): массив - представление NumPy над буфером
+    pixmap без копирования в порядке каналов BGR, как у cv2.imread. Pixmap
+    нужно держать, пока используется массив.
+    """
+    zoom = imgsz / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+    array = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return pix, array[..., ::-1]
+
+
+def save_page_image(pdf_file, pix, page_number):
+    """Сохранение отрендеренной страницы как изображения датасета"""
+    row = _save_image(pix.tobytes("jpeg"), f"{pdf_file.original_filename}_page_{page_number}.jpg", page_number)
+    image = ImageFile.objects.create(dataset=pdf_file.dataset, source_pdf=pdf_file,
+                                     width=pix.width, height=pix.height, **row)
+    queue_image_metadata([image.id])
+    return image
+
+
+def parse_page_numbers(value, page_count):
+    """Номера страниц (с 1) из строки вида "1, 3-5"; номера вне документа отбрасываются"""
+    pages = set()
+    for part in (value or '').replace(' ', '').split(','):
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        if not start.isdigit() or (end and not end.isdigit()):
+            raise ValueError(f"Неверный диапазон страниц: {part}")
+        pages.update(range(int(start), int(end or start) + 1))
+    return {page for page in pages if 1 <= page <= page_count}
+
+
+def get_page_ranges(page_count, processes):
+    """Диапазоны страниц: по несколько на процесс для равномерной загрузки и частого прогресса"""
+    chunk = max(1, min(settings.PDF_MAX_PAGES_PER_CHUNK, math.ceil(page_count / (processes * 4))))
+    return [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+
+
+def ingest_pdf(pdf_file, processes=None):
+    """
+    Получение изображений из PDF (pdf_file.extraction_mode: страницы целиком
+    или встроенные изображения) в пуле процессов по диапазонам страниц.
+
+    Строки ImageFile создаются bulk_create по мере готовности диапазонов,
+    PDFFile.pages_processed и images_count отражают прогресс. Возвращает число
+    полученных изображений.
+    """
+    with fitz.open(pdf_file.pdf.path) as document:
+        page_count = document.page_count
+
+    with transaction.atomic():
+        # Остатки прерванной обработки (повторная доставка задачи) удаляются; изображения
+        # из снимков датасета только помечаются удаленными
+        retire_or_delete_images(pdf_file.images.all())
+        pdf_file.page_count = page_count
+        pdf_file.pages_processed = 0
+        pdf_file.images_count = 0
+        pdf_file.status = 'processing'
+        pdf_file.error_message = ''
+        pdf_file.save()
 
-                # Создаем объект ImageFile
-                image_file = ImageFile(
+    if pdf_file.extraction_mode == 'direct':
+        # Страницы рендерятся при детекции (YOLODetector.detect_pdf), сохраняются только нужные
+        pdf_file.status = 'done'
+        pdf_file.save(update_fields=['status'])
+        return 0
+
+    ranges = get_page_ranges(page_count, processes or settings.PDF_INGEST_PROCESSES)
+    tasks = [
+        (pdf_file.pdf.path, pdf_file.original_filename, start, end, pdf_file.extraction_mode, settings.PDF_RENDER_DPI)
+        for start, end in ranges
+    ]
+    processes = min(processes or settings.PDF_INGEST_PROCESSES, len(tasks))
+
+    # billiard вместо multiprocessing: дочерний процесс воркера Celery - демон,
+    # а стандартный multiprocessing не дает демонам порождать процессы.
+    # Соединения с БД закрываются, чтобы не делить сокет с процессами пула
+    pool = None
+    if processes > 1:
+        connections.close_all()
+        pool = billiard.Pool(processes)
+    try:
+        results = pool.imap(_process_page_range, tasks) if pool else map(_process_page_range, tasks)
+        for pages_done, rows in results:
+            images = ImageFile.objects.bulk_create([
+                ImageFile(
                     dataset=pdf_file.dataset,
-                    original_filename=image_filename,
+                    image=row['image'],
+                    original_filename=row['original_filename'],
                     source_pdf=pdf_file,
-                    page_number=page_num + 1
+                    page_number=row['page_number'],
                 )
-
-                # Сохраняем изображение
-                image_file.image_file.save(
-                    image_filename,
-                    File(BytesIO(image_bytes))
-                )
-                image_file.save()
-                extracted_images.append(image_file)
-
-        pdf_document.close()
-
-        # Обновляем статус PDF файла
-        pdf_file.images_extracted = True
-        pdf_file.page_count = len(pdf_document)
-        pdf_file.save()
-
-        return extracted_images
-
-    except Exception as e:
-        print(f"Ошибка при извлечении изображений из PDF: {e}")
-        return []
-
-
-def extract_pdf_pages_as_images(pdf_file, dpi=150):
-    """Конвертация страниц PDF в изображения"""
-    try:
-        pdf_document = fitz.open(pdf_file.pdf.path)
-        extracted_images = []
-
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-
-            # Конвертируем страницу в изображение
-            pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
-            img_data = pix.tobytes("jpeg")
-
-            # Создаем имя файла
-            image_filename = f"{pdf_file.original_filename}_page_{page_num + 1}.jpg"
-
-            # Создаем объект ImageFile
-            image_file = ImageFile(
-                dataset=pdf_file.dataset,
-                original_filename=image_filename,
-                source_pdf=pdf_file,
-                page_number=page_num + 1
+                for row in rows
+            ])
+            queue_image_metadata(image.id for image in images)
+            PDFFile.objects.filter(id=pdf_file.id).update(
+                pages_processed=F('pages_processed') + pages_done,
+                images_count=F('images_count') + len(rows),
             )
-
-            # Сохраняем изображение
-            image_file.image_file.save(
-                image_filename,
-                File(BytesIO(img_data))
-            )
-            image_file.save()
-            extracted_images.append(image_file)
-
-        pdf_document.close()
-
-        # Обновляем статус PDF файла
-        pdf_file.images_extracted = True
-        pdf_file.page_count = len(pdf_document)
-        pdf_file.save()
-
-        return extracted_images
-
-    except Exception as e:
-        print(f"Ошибка при конвертации PDF в изображения: {e}")
-        return []
\ No newline at end of file
+    finally:
+        # К этому моменту все диапазоны обработаны (или обработка прервана ошибкой)
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    pdf_file.refresh_from_db()
+    pdf_file.images_extracted = True
+    pdf_file.status = 'done'
+    pdf_file.save()
+    return pdf_file.images_count
@@ -0,0 +1,69 @@
+import io
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from .models import ImageFile
+
+
+def get_rendition_name(sha256, rendition):
+    """
+    Имя файла рендишена по содержимому оригинала и параметрам рендишена.
+
+    Одинаковые изображения делят один файл, а измененное содержимое или размер
+    дают новое имя, поэтому nginx отдает рендишены с бессрочным кэшированием.
+    """
+    size = settings.IMAGE_RENDITIONS[rendition]
+    return f"renditions/{sha256[:2]}/{sha256}_{rendition}_{size}.webp"
+
+
+def render_rendition(img, size):
+    """Уменьшенная копия (длинная сторона не больше size) в WebP"""
+    rendition = img.copy()
+    rendition.thumbnail((size, size), Image.LANCZOS)
+    if rendition.mode not in ('RGB', 'RGBA'):
+        rendition = rendition.convert('RGBA' if 'transparency' in rendition.info else 'RGB')
+    buffer = io.BytesIO()
+    rendition.save(buffer, 'WEBP', quality=settings.IMAGE_RENDITION_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def generate_renditions(image_file):
+    """
+    Создание недостающих рендишенов изображения (нужен заполненный sha256).
+
+    Оригинал декодируется один раз с уменьшением (draft для JPEG) под самый
+    большой рендишен и поворачивается по EXIF Orientation. Возвращает словарь
+    {рендишен: имя файла} для ImageFile.renditions.
+    """
+    names = {rendition: get_rendition_name(image_file.sha256, rendition) for rendition in settings.IMAGE_RENDITIONS}
+    missing = [rendition for rendition, name in names.items() if not default_storage.exists(name)]
+
+    if missing:
+        with Image.open(image_file.image.path) as img:
+            largest = max(settings.IMAGE_RENDITIONS[rendition] for rendition in missing)
+            img.draft('RGB', (largest, largest))
+            img = ImageOps.exif_transpose(img)
+            for rendition in missing:
+                # Параллельная задача для того же содержимого могла успеть раньше
+                if not default_storage.exists(names[rendition]):
+                    default_storage.save(names[rendition],
+                                         ContentFile(render_rendition(img, settings.IMAGE_RENDITIONS[rendition])))
+
+    return names
+
+
+def update_renditions(image_files):
+    """Рендишены для списка ImageFile с метаданными; возвращает (обновлено, ошибки)"""
+    updated, errors = [], []
+    for image_file in image_files:
+        if not image_file.sha256:
+            continue
+        try:
+            image_file.renditions = generate_renditions(image_file)
+            updated.append(image_file)
+        except Exception as e:
+            errors.append((image_file.id, str(e)))
+
+    ImageFile.objects.bulk_update(updated, ['renditions'])
+    return len(updated), errors
@@ -0,0 +1,121 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .models import DatasetSnapshot, ImageFile
+
+
+def create_snapshot(dataset, user=None, name=''):
+    """
+    Снимок текущего состояния датасета.
+
+    Строки изображений и аннотаций не копируются (см. DatasetSnapshot), поэтому
+    время создания не зависит от размера датасета.
+    """
+    return DatasetSnapshot.objects.create(dataset=dataset, created_by=user, name=name[:255])
+
+
+def has_changes_since(dataset, moment):
+    """Добавлялись или удалялись ли изображения и аннотации датасета после moment"""
+    from detection.models import Annotation
+
+    changed = Q(retired_at__gt=moment)
+    return (
+        ImageFile.all_objects.filter(changed | Q(uploaded_at__gt=moment), dataset=dataset).exists()
+        or Annotation.all_objects.filter(changed | Q(created_at__gt=moment), image__dataset=dataset).exists()
+    )
+
+
+def get_training_snapshot(dataset, user=None, name=''):
+    """
+    Снимок для обучения без выбранного пользователем снимка: последний снимок
+    датасета, если данные с тех пор не менялись, иначе новый автоматический
+    (удаляется вместе с последней обученной на нем моделью, см. release_snapshot)
+    """
+    latest = dataset.snapshots.order_by('-created_at').first()
+    if latest is not None and not has_changes_since(dataset, latest.created_at):
+        return latest
+    return DatasetSnapshot.objects.create(dataset=dataset, created_by=user, name=name[:255], auto_created=True)
+
+
+def release_snapshot(snapshot):
+    """
+    Удаление автоматического снимка, на который больше не ссылается ни одна
+    модель, и строк, нужных только ему. Возвращает True, если снимок удален.
+    """
+    if snapshot is None or not snapshot.auto_created or snapshot.ml_models.exists():
+        return False
+    dataset = snapshot.dataset
+    snapshot.delete()
+    purge_retired_rows(dataset)
+    return True
+
+
+def retire_or_delete_images(images):
+    """
+    Удаление изображений (queryset текущих строк) из датасета.
+
+    Изображения, входящие в снимок, и их аннотации только помечаются удаленными
+    (retired_at), файлы остаются; остальные удаляются как обычно. Возвращает
+    (число помеченных, число удаленных).
+    """
+    from detection.models import Annotation
+
+    in_snapshot = Exists(DatasetSnapshot.objects.filter(
+        dataset=OuterRef('dataset'), created_at__gte=OuterRef('uploaded_at')
+    ))
+    now = timezone.now()
+    with transaction.atomic():
+        retired_ids = images.filter(in_snapshot).values('id')
+        # Сначала аннотации: после пометки изображения выпадают из queryset текущих строк
+        Annotation.objects.filter(image_id__in=retired_ids).update(retired_at=now)
+        retired = ImageFile.objects.filter(id__in=retired_ids).update(retired_at=now)
+        deleted = images.exclude(in_snapshot).delete()[1].get(ImageFile._meta.label, 0)
+    return retired, deleted
+
+
+def retire_or_delete_image(image):
+    """Удаление изображения; True, если оно входит в снимок и только помечено удаленным"""
+    retired, _ = retire_or_delete_images(ImageFile.objects.filter(id=image.id))
+    return bool(retired)
+
+
+def retire_or_delete_annotation(annotation):
+    """Удаление аннотации: пометка retired_at, если она входит в снимок, иначе удаление строки"""
+    in_snapshot = DatasetSnapshot.objects.filter(
+        dataset_id=annotation.image.dataset_id, created_at__gte=annotation.created_at
+    )
+    if not in_snapshot.exists():
+        annotation.delete()
+        return False
+
+    annotation.retired_at = timezone.now()
+    annotation.save(update_fields=['retired_at'])
+    return True
+
+
+def purge_retired_rows(dataset):
+    """
+    Окончательное удаление строк, помеченных удаленными, которые не входят
+    ни в один оставшийся снимок датасета (вызывается после удаления снимка).
+    Возвращает (число изображений, число аннотаций).
+    """
+    from detection.models import Annotation
+
+    def in_snapshot(dataset_field, created_field):
+        return Exists(DatasetSnapshot.objects.filter(
+            dataset=OuterRef(dataset_field),
+            created_at__gte=OuterRef(created_field),
+            created_at__lt=OuterRef('retired_at'),
+        ))
+
+    annotations = Annotation.all_objects.filter(image__dataset=dataset, retired_at__isnull=False).exclude(
+        in_snapshot('image__dataset', 'created_at')
+    )
+    annotations_deleted = annotations.delete()[1].get(Annotation._meta.label, 0)
+
+    images = ImageFile.all_objects.filter(dataset=dataset, retired_at__isnull=False).exclude(
+        in_snapshot('dataset', 'uploaded_at')
+    )
+    # Аннотации удаляются каскадом вместе с изображением
+    images_deleted = images.delete()[1].get(ImageFile._meta.label, 0)
+    return images_deleted, annotations_deleted
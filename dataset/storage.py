@@ -0,0 +1,75 @@
+import hashlib
+import os
+from uuid import uuid4
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище изображений с адресацией по содержимому.
+
+    Файл сохраняется под именем blobs/<sha[:2]>/<sha256>.<ext>; повторная загрузка
+    того же содержимого (в любой датасет) не пишет файл, а увеличивает счетчик
+    ссылок ImageBlob. delete() уменьшает счетчик и удаляет файл вместе с
+    последней ссылкой, поэтому django_cleanup, удаляющий файл при удалении
+    ImageFile, работает без изменений. Файлы, сохраненные до перехода на blob'ы
+    (без строки ImageBlob), удаляются как обычно.
+    """
+
+    prefix = 'blobs'
+
+    @staticmethod
+    def _get_blob_model():
+        # Хранилище создается при импорте моделей, поэтому модель берется из реестра
+        return apps.get_model('dataset', 'ImageBlob')
+
+    @staticmethod
+    def _hash_content(content):
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _save(self, name, content):
+        ImageBlob = self._get_blob_model()
+        digest = self._hash_content(content)
+        ext = os.path.splitext(name)[1].lower()
+
+        # Блокировка строки blob'а сериализует сохранение и delete() того же содержимого:
+        # файл не может быть удален между проверкой его наличия и ростом счетчика
+        with transaction.atomic():
+            blob, _ = ImageBlob.objects.select_for_update().get_or_create(
+                sha256=digest,
+                defaults={'name': f"{self.prefix}/{digest[:2]}/{digest}{ext}", 'size': content.size}
+            )
+            ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+            if not self.exists(blob.name):
+                # Запись под временным именем и переименование: читатели не видят неполный файл
+                tmp_name = super()._save(f"{os.path.dirname(blob.name)}/{uuid4().hex}.tmp", content)
+                os.replace(self.path(tmp_name), self.path(blob.name))
+
+        return blob.name
+
+    def add_reference(self, name):
+        """Еще одна ссылка на файл (например, копия ImageFile без записи файла)"""
+        self._get_blob_model().objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+    def delete(self, name):
+        ImageBlob = self._get_blob_model()
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.ref_count > 1:
+                ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+
+
+image_storage = ContentAddressedStorage()
@@ -0,0 +1,124 @@
+import shutil
+from datetime import timedelta
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+from .archives import import_archive
+from .exports import build_dataset_export
+from .image_metadata import update_image_metadata
+from .models import ArchiveImport, DatasetExport, ImageFile, PDFFile, UploadSession
+from .pdf_utils import ingest_pdf
+from .renditions import update_renditions
+from .tiles import generate_tile_pyramid
+from .uploads import assemble_upload, get_session_dir
+
+
+@shared_task(acks_late=True)
+def ingest_pdf_task(pdf_id):
+    """Задача Celery для получения изображений из PDF (очередь ingest)"""
+    pdf_file = PDFFile.objects.get(id=pdf_id)
+    try:
+        images_count = ingest_pdf(pdf_file)
+        return {
+            'status': 'PDF обработан',
+            'pdf_id': pdf_id,
+            'page_count': pdf_file.page_count,
+            'images_count': images_count,
+        }
+
+    except Exception as e:
+        PDFFile.objects.filter(id=pdf_id).update(status='error', error_message=str(e))
+        raise e
+
+
+@shared_task(acks_late=True)
+def import_archive_task(archive_id):
+    """Задача Celery для импорта изображений и разметки из архива ZIP/TAR (очередь ingest)"""
+    archive_import = ArchiveImport.objects.select_related('dataset').get(id=archive_id)
+    if archive_import.status == 'done':
+        # Повторная доставка после успешного импорта: архива уже нет
+        return {'archive_id': archive_id, 'status': archive_import.status}
+
+    try:
+        images_count = import_archive(archive_import)
+        return {
+            'status': 'Архив импортирован',
+            'archive_id': archive_id,
+            'images_count': images_count,
+            'annotations_count': archive_import.annotations_count,
+            'error_count': archive_import.error_count,
+        }
+
+    except Exception as e:
+        ArchiveImport.objects.filter(id=archive_id).update(status='error', error_message=str(e))
+        raise e
+
+
+@shared_task(acks_late=True)
+def export_dataset_task(export_id):
+    """Задача Celery для сборки архива выгрузки большого датасета"""
+    dataset_export = DatasetExport.objects.select_related('dataset').get(id=export_id)
+    DatasetExport.objects.filter(id=export_id).update(status='processing', error_message='')
+    try:
+        name = build_dataset_export(dataset_export)
+        return {'status': 'Выгрузка собрана', 'export_id': export_id, 'file': name}
+
+    except Exception as e:
+        DatasetExport.objects.filter(id=export_id).update(status='error', error_message=str(e))
+        raise e
+
+
+@shared_task(acks_late=True)
+def assemble_upload_task(upload_id):
+    """Сборка файла, загруженного частями, и регистрация его в датасете"""
+    session = UploadSession.objects.select_related('dataset').get(id=upload_id)
+    if session.status != 'assembling':
+        # Повторная доставка после успешной сборки
+        return {'upload_id': upload_id, 'status': session.status}
+
+    assemble_upload(session)
+    return {
+        'status': 'Файл собран',
+        'upload_id': upload_id,
+        'image_id': session.image_id,
+        'pdf_id': session.pdf_id,
+    }
+
+
+@shared_task
+def cleanup_upload_sessions():
+    """Удаление брошенных загрузок частями (без новых частей дольше UPLOAD_SESSION_TTL) и их файлов"""
+    expired_at = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    sessions = UploadSession.objects.filter(status__in=['uploading', 'error'], updated_at__lt=expired_at)
+    removed = 0
+    for session in sessions:
+        shutil.rmtree(get_session_dir(session), ignore_errors=True)
+        session.delete()
+        removed += 1
+    return {'removed': removed}
+
+
+@shared_task
+def extract_image_metadata_task(image_ids):
+    """
+    Получение метаданных (размеры, хэши, формат, EXIF) для пачки изображений
+    и создание их рендишенов (имена рендишенов строятся по SHA-256).
+    """
+    images = list(ImageFile.objects.filter(id__in=image_ids))
+    updated, errors = update_image_metadata(images)
+    rendered, rendition_errors = update_renditions(images)
+    for image_id, error in errors + rendition_errors:
+        print(f"Не удалось обработать изображение {image_id}: {error}")
+    return {'updated': updated, 'renditions': rendered, 'errors': len(errors) + len(rendition_errors)}
+
+
+@shared_task(acks_late=True)
+def generate_tile_pyramid_task(image_id):
+    """Создание пирамиды тайлов большого снимка для инструмента разметки"""
+    image_file = ImageFile.objects.get(id=image_id)
+    try:
+        generate_tile_pyramid(image_file)
+    except Exception as e:
+        ImageFile.objects.filter(id=image_id).update(tiles_status='error')
+        raise e
+    return {'status': 'Пирамида тайлов создана', 'image_id': image_id}
@@ -0,0 +1,16 @@
+from django import template
+from dataset.tiles import needs_tiles as image_needs_tiles
+
+register = template.Library()
+
+
+@register.filter
+def rendition(image_file, name='thumb'):
+    """URL уменьшенной копии изображения: {{ image|rendition:'thumb' }} или {{ image|rendition:'preview' }}"""
+    return image_file.get_rendition_url(name)
+
+
+@register.filter
+def needs_tiles(image_file):
+    """Большой снимок, который инструмент разметки показывает пирамидой тайлов"""
+    return image_needs_tiles(image_file)
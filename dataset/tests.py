@@ -1,3 +1,225 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from detection.models import Annotation
+from users.models import CustomUser
+from .archives import normalize_box, parse_class_names, parse_coco, parse_voc, parse_yolo_line
+from .models import Dataset, DatasetSnapshot, ImageFile
+from .snapshots import (get_training_snapshot, purge_retired_rows, release_snapshot,
+                        retire_or_delete_annotation, retire_or_delete_images)
+from .uploads import UploadError, create_upload_session, get_session_dir, write_chunk
 
-# Create your tests here.
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='user', password='password')
+        self.dataset = Dataset.objects.create(name='Датасет', user=self.user)
+        # Строки и снимки - в прошлом, удаления (retired_at) - в текущий момент
+        self.now = timezone.now() - timedelta(hours=1)
+
+    def at(self, minutes):
+        return self.now + timedelta(minutes=minutes)
+
+    def make_image(self, minutes):
+        image = ImageFile.objects.create(dataset=self.dataset, image=f'images/{minutes}.jpg',
+                                         original_filename=f'{minutes}.jpg')
+        # Время строк задается явно: снимок сравнивает его со своим created_at
+        ImageFile.objects.filter(id=image.id).update(uploaded_at=self.at(minutes))
+        image.refresh_from_db()
+        return image
+
+    def make_annotation(self, image, minutes):
+        annotation = Annotation.objects.create(image=image, label='text', x=0.1, y=0.1, width=0.2, height=0.2,
+                                               created_by=self.user)
+        Annotation.objects.filter(id=annotation.id).update(created_at=self.at(minutes))
+        annotation.refresh_from_db()
+        return annotation
+
+    def make_snapshot(self, minutes, **fields):
+        snapshot = DatasetSnapshot.objects.create(dataset=self.dataset, **fields)
+        DatasetSnapshot.objects.filter(id=snapshot.id).update(created_at=self.at(minutes))
+        snapshot.refresh_from_db()
+        return snapshot
+
+    def test_visibility_filter(self):
+        kept, retired = self.make_image(0), self.make_image(1)
+        snapshot = self.make_snapshot(2)
+        added = self.make_image(3)
+        ImageFile.objects.filter(id=retired.id).update(retired_at=self.at(4))
+
+        self.assertCountEqual(snapshot.get_images(), [kept, retired])
+        self.assertCountEqual(ImageFile.objects.filter(dataset=self.dataset), [kept, added])
+
+    def test_retire_or_delete_images(self):
+        in_snapshot = self.make_image(0)
+        annotation = self.make_annotation(in_snapshot, 0)
+        self.make_snapshot(1)
+        after_snapshot = self.make_image(2)
+
+        retired, deleted = retire_or_delete_images(ImageFile.objects.filter(dataset=self.dataset))
+
+        self.assertEqual((retired, deleted), (1, 1))
+        self.assertFalse(ImageFile.all_objects.filter(id=after_snapshot.id).exists())
+        self.assertIsNotNone(ImageFile.all_objects.get(id=in_snapshot.id).retired_at)
+        self.assertIsNotNone(Annotation.all_objects.get(id=annotation.id).retired_at)
+        self.assertFalse(ImageFile.objects.filter(dataset=self.dataset).exists())
+
+    def test_retire_or_delete_annotation(self):
+        image = self.make_image(0)
+        old = self.make_annotation(image, 0)
+        self.make_snapshot(1)
+        new = self.make_annotation(image, 2)
+
+        self.assertTrue(retire_or_delete_annotation(old))
+        self.assertFalse(retire_or_delete_annotation(new))
+        self.assertTrue(Annotation.all_objects.filter(id=old.id, retired_at__isnull=False).exists())
+        self.assertFalse(Annotation.all_objects.filter(id=new.id).exists())
+
+    def test_purge_keeps_rows_of_remaining_snapshots(self):
+        first, second = self.make_image(0), self.make_image(2)
+        older = self.make_snapshot(1)
+        self.make_snapshot(3)
+        retire_or_delete_images(ImageFile.objects.filter(dataset=self.dataset))
+
+        older.delete()
+        self.assertEqual(purge_retired_rows(self.dataset), (0, 0))
+        self.assertEqual(ImageFile.all_objects.filter(id__in=[first.id, second.id]).count(), 2)
+
+        DatasetSnapshot.objects.filter(dataset=self.dataset).delete()
+        self.assertEqual(purge_retired_rows(self.dataset), (2, 0))
+
+    def test_training_snapshot_reused_until_data_changes(self):
+        self.make_image(-10)
+        snapshot = get_training_snapshot(self.dataset, self.user)
+
+        self.assertTrue(snapshot.auto_created)
+        self.assertEqual(get_training_snapshot(self.dataset, self.user), snapshot)
+
+        ImageFile.objects.create(dataset=self.dataset, image='images/new.jpg', original_filename='new.jpg')
+        self.assertNotEqual(get_training_snapshot(self.dataset, self.user), snapshot)
+
+    def test_release_snapshot(self):
+        manual = self.make_snapshot(0)
+        auto = self.make_snapshot(1, auto_created=True)
+
+        self.assertFalse(release_snapshot(manual))
+        self.assertTrue(release_snapshot(auto))
+        self.assertEqual(list(DatasetSnapshot.objects.all()), [manual])
+
+
+class WriteChunkTests(TestCase):
+    def setUp(self):
+        self.session_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.session_root, ignore_errors=True)
+        settings_override = override_settings(UPLOAD_SESSION_ROOT=self.session_root, UPLOAD_CHUNK_SIZE=4)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = CustomUser.objects.create_user(username='user', password='password')
+        dataset = Dataset.objects.create(name='Датасет', user=user)
+        self.session = create_upload_session(dataset, user, 'document.pdf', total_size=10)
+
+    def write(self, offset, data, size=None):
+        return write_chunk(self.session, offset, io.BytesIO(data), len(data) if size is None else size)
+
+    def test_rejects_misaligned_or_out_of_range_offset(self):
+        for offset in (1, 12):
+            with self.assertRaisesMessage(UploadError, 'Неверное смещение'):
+                self.write(offset, b'abcd')
+
+    def test_rejects_wrong_size(self):
+        with self.assertRaisesMessage(UploadError, 'ожидалось 4'):
+            self.write(0, b'abc')
+        # Последняя часть короче остальных
+        with self.assertRaisesMessage(UploadError, 'ожидалось 2'):
+            self.write(8, b'abcd')
+
+    def test_interrupted_part_is_not_counted(self):
+        with self.assertRaisesMessage(UploadError, 'прервана'):
+            self.write(0, b'ab', size=4)
+
+        self.assertFalse(self.session.chunks.exists())
+        self.assertEqual(os.listdir(get_session_dir(self.session)), [])
+
+    def test_last_part_queues_assembly_once(self):
+        with mock.patch('dataset.tasks.assemble_upload_task.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(self.write(4, b'efgh'))
+            # Повтор части после обрыва связи принимается без изменений
+            self.assertFalse(self.write(4, b'efgh'))
+            self.assertFalse(self.write(8, b'ij'))
+            self.assertTrue(self.write(0, b'abcd'))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.received_size, 10)
+        self.assertEqual(self.session.status, 'assembling')
+        delay.assert_called_once_with(str(self.session.id))
+
+
+class ArchiveParserTests(SimpleTestCase):
+    def assertBoxAlmostEqual(self, box, expected):
+        self.assertEqual(len(box), len(expected))
+        for value, expected_value in zip(box, expected):
+            self.assertAlmostEqual(value, expected_value)
+
+    def test_parse_yolo_line_box(self):
+        class_id, *box = parse_yolo_line('2 0.5 0.5 0.2 0.4')
+
+        self.assertEqual(class_id, 2)
+        self.assertBoxAlmostEqual(box, (0.4, 0.3, 0.2, 0.4))
+
+    def test_parse_yolo_line_polygon_gives_bounding_box(self):
+        class_id, *box = parse_yolo_line('0 0.1 0.2 0.5 0.2 0.3 0.6')
+
+        self.assertEqual(class_id, 0)
+        self.assertBoxAlmostEqual(box, (0.1, 0.2, 0.4, 0.4))
+
+    def test_parse_yolo_line_rejects_wrong_arity(self):
+        for line in ('0 0.5 0.5 0.2', '0 0.1 0.2 0.3 0.4 0.5'):
+            with self.assertRaises(ValueError):
+                parse_yolo_line(line)
+
+    def test_normalize_box_clips_to_image(self):
+        self.assertBoxAlmostEqual(normalize_box(-10, 50, 60, 100, 100, 200), (0.0, 0.25, 0.5, 0.5))
+        self.assertBoxAlmostEqual(normalize_box(80, 0, 40, 200, 100, 200), (0.8, 0.0, 0.2, 1.0))
+
+    def test_normalize_box_rejects_empty_box(self):
+        for box in ((10, 10, 0, 5), (120, 10, 5, 5), (float('nan'), 0, 5, 5)):
+            with self.assertRaises(ValueError):
+                normalize_box(*box, 100, 100)
+
+    def test_parse_coco(self):
+        data = {
+            'images': [{'id': 1, 'file_name': 'a.jpg'}, {'id': 2, 'file_name': 'b.jpg'}],
+            'annotations': [
+                {'image_id': 1, 'category_id': 3, 'bbox': [1, 2, 3, 4]},
+                {'image_id': 1, 'category_id': 9, 'bbox': [5, 6, 7, 8]},
+                {'image_id': 2, 'category_id': 3, 'segmentation': [[0, 0, 1, 1]]},
+            ],
+            'categories': [{'id': 3, 'name': 'table'}],
+        }
+
+        # Изображения без рамок не возвращаются, метка без категории - ее ID
+        self.assertEqual(parse_coco(data), [('a.jpg', [('table', 1, 2, 3, 4), ('9', 5, 6, 7, 8)])])
+
+    def test_parse_coco_ignores_other_json(self):
+        self.assertEqual(parse_coco({'info': {}}), [])
+        self.assertEqual(parse_coco([1, 2]), [])
+
+    def test_parse_voc(self):
+        data = b"""<annotation><filename>a.jpg</filename>
+            <object><name> stamp </name><bndbox><xmin>10</xmin><ymin>20</ymin><xmax>30</xmax><ymax>60</ymax></bndbox></object>
+        </annotation>"""
+
+        self.assertEqual(parse_voc(data), ('a.jpg', [('stamp', 10.0, 20.0, 20.0, 40.0)]))
+        self.assertIsNone(parse_voc(b'<svg/>'))
+
+    def test_parse_class_names(self):
+        self.assertEqual(parse_class_names('classes.txt', b'table\n\nstamp\n'), {0: 'table', 1: 'stamp'})
+        self.assertEqual(parse_class_names('data.yaml', b'names: [table, stamp]'), {0: 'table', 1: 'stamp'})
+        self.assertEqual(parse_class_names('data.yaml', b'names: {0: table, 2: stamp}'), {0: 'table', 2: 'stamp'})
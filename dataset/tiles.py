@@ -0,0 +1,116 @@
+import math
+import os
+import shutil
+from uuid import uuid4
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from .models import ImageFile
+
+
+def get_tiles_name(sha256):
+    """Каталог пирамиды в хранилище (в формате DZI: <имя>.dzi и <имя>_files/<уровень>/<col>_<row>.<ext>)"""
+    return f"tiles/{sha256[:2]}/{sha256}_{settings.TILE_SIZE}"
+
+
+def get_max_level(width, height):
+    """Номер самого детального уровня DZI: уровень 0 - 1x1 пиксель, каждый следующий вдвое больше"""
+    return math.ceil(math.log2(max(width, height, 1)))
+
+
+def needs_tiles(image_file):
+    """Пирамида нужна только снимкам, которые неудобно грузить в браузер целиком"""
+    return bool(image_file.width and image_file.height
+                and max(image_file.width, image_file.height) > settings.TILE_PYRAMID_MIN_SIZE)
+
+
+def get_dzi_descriptor(width, height):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'Format="{settings.TILE_FORMAT}" Overlap="0" TileSize="{settings.TILE_SIZE}">'
+        f'<Size Width="{width}" Height="{height}"/></Image>\n'
+    )
+
+
+def _build_pyramid(img, files_dir):
+    """Нарезка уровней от самого детального к 1x1, каждый следующий - уменьшение предыдущего вдвое"""
+    tile_size = settings.TILE_SIZE
+    save_format = 'JPEG' if settings.TILE_FORMAT == 'jpg' else settings.TILE_FORMAT.upper()
+    level = get_max_level(*img.size)
+
+    while True:
+        width, height = img.size
+        level_dir = os.path.join(files_dir, str(level))
+        os.makedirs(level_dir)
+        for col in range(math.ceil(width / tile_size)):
+            for row in range(math.ceil(height / tile_size)):
+                box = (col * tile_size, row * tile_size,
+                       min((col + 1) * tile_size, width), min((row + 1) * tile_size, height))
+                img.crop(box).save(os.path.join(level_dir, f"{col}_{row}.{settings.TILE_FORMAT}"),
+                                   save_format, quality=settings.TILE_QUALITY)
+        if level == 0:
+            break
+        # reduce(2) дает ceil(w / 2) x ceil(h / 2), как и требует DZI
+        img = img.reduce(2)
+        level -= 1
+
+
+def generate_tile_pyramid(image_file):
+    """
+    Создание пирамиды тайлов изображения (с учетом EXIF Orientation, как его показывает браузер).
+
+    Пирамида строится во временном каталоге и переносится на место одним
+    переименованием, поэтому параллельная генерация для того же содержимого
+    (дубликаты по SHA-256) не оставляет частично записанных уровней. Дескриптор
+    .dzi публикуется последним: его наличие означает, что пирамида готова.
+    Хранилище - файловое (FileSystemStorage), как и во всем проекте.
+    """
+    tiles_path = default_storage.path(get_tiles_name(image_file.sha256))
+    if not os.path.exists(f"{tiles_path}.dzi"):
+        tmp_path = f"{tiles_path}.{uuid4().hex}.tmp"
+        os.makedirs(tmp_path)
+        try:
+            with Image.open(image_file.image.path) as img:
+                img = ImageOps.exif_transpose(img).convert('RGB')
+                width, height = img.size
+                _build_pyramid(img, os.path.join(tmp_path, 'files'))
+
+            try:
+                os.rename(os.path.join(tmp_path, 'files'), f"{tiles_path}_files")
+            except OSError:
+                # Уровни уже перенесены другим процессом (или прерванным запуском -
+                # переименование атомарно, поэтому они полные); иначе ошибка настоящая
+                if not os.path.isdir(f"{tiles_path}_files"):
+                    raise
+
+            # Дескриптор пишется и тогда, когда его не успел записать запуск, перенесший
+            # уровни; через временный файл, чтобы не отдать читателю пустой .dzi
+            if not os.path.exists(f"{tiles_path}.dzi"):
+                with open(os.path.join(tmp_path, 'image.dzi'), 'w', encoding='utf-8') as f:
+                    f.write(get_dzi_descriptor(width, height))
+                os.replace(os.path.join(tmp_path, 'image.dzi'), f"{tiles_path}.dzi")
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    ImageFile.objects.filter(id=image_file.id).update(tiles_status='ready')
+
+
+def request_tile_pyramid(image_file):
+    """Постановка генерации пирамиды в очередь, если она еще не создана и не запрошена"""
+    from .tasks import generate_tile_pyramid_task
+
+    if ImageFile.objects.filter(id=image_file.id, tiles_status='').update(tiles_status='pending'):
+        image_id = image_file.id
+        transaction.on_commit(lambda: generate_tile_pyramid_task.delay(image_id))
+        image_file.tiles_status = 'pending'
+    return image_file.tiles_status
+
+
+def get_tile_path(image_file, level, col, row):
+    """Путь к файлу тайла или None, если такого тайла нет"""
+    path = default_storage.path(
+        f"{get_tiles_name(image_file.sha256)}_files/{level}/{col}_{row}.{settings.TILE_FORMAT}"
+    )
+    return path if os.path.exists(path) else None
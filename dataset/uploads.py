@@ -0,0 +1,291 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from PIL import Image
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .image_metadata import queue_image_metadata
+from .models import (
+    ArchiveImport, Dataset, ImageFile, PDFFile, UploadChunk, UploadSession,
+    rename_uploaded_archive, rename_uploaded_file, rename_uploaded_pdf
+)
+from .storage import image_storage
+
+# Размер блока чтения тела запроса: часть пишется на диск, не накапливаясь в памяти
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Ошибка в параметрах загрузки или части; текст показывается клиенту"""
+
+
+class AssembledFile(File):
+    """
+    Собранный файл на диске.
+
+    temporary_file_path позволяет FileSystemStorage переместить файл в MEDIA_ROOT
+    (file_move_safe), а не копировать его еще раз.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def get_upload_kind(filename):
+    """Тип загрузки по расширению файла"""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if ext == 'pdf':
+        return 'pdf'
+    if any(filename.lower().endswith(f".{ext}") for ext in settings.ALLOWED_ARCHIVE_EXTENSIONS):
+        return 'archive'
+    if ext in settings.ALLOWED_IMAGE_EXTENSIONS:
+        return 'image'
+    raise UploadError(f"Неподдерживаемый формат файла: {filename}")
+
+
+def _save_to_storage(uploaded_file):
+    try:
+        return image_storage.save(rename_uploaded_file(None, uploaded_file.name), uploaded_file)
+    finally:
+        # Хранилище ведет счетчики ссылок в БД; соединение потока пула иначе осталось бы открытым
+        connections.close_all()
+
+
+def register_image_batch(dataset, executor, uploaded_files, errors, **fields):
+    """
+    Запись пачки файлов в хранилище потоками executor и вставка строк ImageFile
+    одним bulk_create (fields - общие поля строк, например source_archive).
+
+    Ошибки добавляются в errors как (имя файла, ошибка). Возвращает пары
+    (файл, созданная строка ImageFile) для успешно зарегистрированных файлов.
+    """
+    futures = [executor.submit(_save_to_storage, uploaded_file) for uploaded_file in uploaded_files]
+
+    registered = []
+    for uploaded_file, future in zip(uploaded_files, futures):
+        try:
+            row = ImageFile(dataset=dataset, image=future.result(), original_filename=uploaded_file.name, **fields)
+            registered.append((uploaded_file, row))
+        except Exception as e:
+            errors.append((uploaded_file.name, str(e)))
+
+    rows = [row for _, row in registered]
+    try:
+        ImageFile.objects.bulk_create(rows)
+    except Exception as e:
+        # Без строк в БД файлы пачки никому не нужны
+        for row in rows:
+            image_storage.delete(row.image.name)
+            errors.append((row.original_filename, str(e)))
+        return []
+
+    queue_image_metadata(row.id for row in rows)
+    return registered
+
+
+def register_images(dataset, uploaded_files):
+    """
+    Массовая регистрация загруженных изображений в датасете.
+
+    Файлы пишутся в хранилище пулом из UPLOAD_STORAGE_THREADS потоков (запись
+    упирается в диск/сеть, а не в GIL), строки ImageFile вставляются bulk_create
+    пачками по UPLOAD_BULK_CREATE_BATCH. Возвращает (число созданных, список
+    (имя файла, ошибка)).
+    """
+    errors = []
+    created = 0
+    batch_size = settings.UPLOAD_BULK_CREATE_BATCH
+
+    with ThreadPoolExecutor(max_workers=settings.UPLOAD_STORAGE_THREADS) as executor:
+        for start in range(0, len(uploaded_files), batch_size):
+            batch = uploaded_files[start:start + batch_size]
+            created += len(register_image_batch(dataset, executor, batch, errors))
+
+    return created, errors
+
+
+def get_session_dir(session):
+    return os.path.join(settings.UPLOAD_SESSION_ROOT, str(session.id))
+
+
+def create_upload_session(dataset, user, filename, total_size, extraction_mode='pages'):
+    if total_size <= 0 or total_size > settings.UPLOAD_MAX_FILE_SIZE:
+        raise UploadError(f"Размер файла должен быть от 1 байта до {settings.UPLOAD_MAX_FILE_SIZE} байт")
+    if extraction_mode not in dict(PDFFile.EXTRACTION_MODE_CHOICES):
+        raise UploadError(f"Неизвестный режим извлечения: {extraction_mode}")
+
+    session = UploadSession.objects.create(
+        dataset=dataset,
+        user=user,
+        original_filename=os.path.basename(filename)[:255],
+        kind=get_upload_kind(filename),
+        extraction_mode=extraction_mode,
+        total_size=total_size,
+        chunk_size=settings.UPLOAD_CHUNK_SIZE,
+    )
+    os.makedirs(get_session_dir(session), exist_ok=True)
+    return session
+
+
+def get_session_state(session):
+    """Состояние загрузки для клиента: по received_offsets он определяет, какие части дослать"""
+    return {
+        'upload_id': str(session.id),
+        'status': session.status,
+        'kind': session.kind,
+        'total_size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'received_size': session.received_size,
+        'received_offsets': list(session.chunks.values_list('offset', flat=True)),
+        'progress': session.get_progress(),
+        'error': session.error_message,
+    }
+
+
+def write_chunk(session, offset, stream, size):
+    """
+    Запись части [offset, offset + size) из потока тела запроса.
+
+    Части выровнены по chunk_size сессии, поэтому клиент может слать их в
+    несколько параллельных потоков и в любом порядке; повторная часть (докачка
+    после обрыва) принимается без изменений. Часть сначала пишется во временный
+    файл и переименовывается только целиком, так что оборванная передача не
+    оставляет засчитанных неполных данных. Возвращает True, если это была
+    последняя недостающая часть и сессия поставлена на сборку.
+    """
+    expected_size = min(session.chunk_size, session.total_size - offset) if offset < session.total_size else 0
+    if offset % session.chunk_size or expected_size <= 0:
+        raise UploadError(f"Неверное смещение части: {offset}")
+    if size != expected_size:
+        raise UploadError(f"Размер части {size} байт, ожидалось {expected_size}")
+
+    if UploadChunk.objects.filter(session=session, offset=offset).exists():
+        return False
+
+    part_path = os.path.join(get_session_dir(session), f"{offset}.part")
+    tmp_path = f"{part_path}.{uuid4().hex}.tmp"
+    written = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            while written < size:
+                block = stream.read(min(STREAM_BLOCK_SIZE, size - written))
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+        if written != size:
+            raise UploadError(f"Передача части прервана: получено {written} из {size} байт")
+        os.replace(tmp_path, part_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _, created = UploadChunk.objects.get_or_create(session=session, offset=offset, defaults={'size': size})
+    if not created:
+        return False
+
+    UploadSession.objects.filter(id=session.id).update(
+        received_size=F('received_size') + size, updated_at=timezone.now()
+    )
+    # Условное обновление: из параллельных последних частей на сборку ставит ровно одна
+    completed = UploadSession.objects.filter(
+        id=session.id, status='uploading', received_size=F('total_size')
+    ).update(status='assembling')
+    if completed:
+        from .tasks import assemble_upload_task
+        transaction.on_commit(lambda: assemble_upload_task.delay(str(session.id)))
+    return bool(completed)
+
+
+def _concatenate_chunks(session):
+    """Склейка частей по порядку смещений в один файл в каталоге сессии"""
+    session_dir = get_session_dir(session)
+    chunks = list(session.chunks.order_by('offset'))
+    expected_offset = 0
+    for chunk in chunks:
+        if chunk.offset != expected_offset:
+            raise UploadError(f"Отсутствует часть со смещением {expected_offset}")
+        expected_offset += chunk.size
+    if expected_offset != session.total_size:
+        raise UploadError("Получены не все части файла")
+
+    assembled_path = os.path.join(session_dir, 'assembled')
+    with open(assembled_path, 'wb') as out:
+        for chunk in chunks:
+            with open(os.path.join(session_dir, f"{chunk.offset}.part"), 'rb') as part:
+                shutil.copyfileobj(part, out, 1024 * 1024)
+    return assembled_path
+
+
+def assemble_upload(session):
+    """
+    Сборка загруженного файла и регистрация его в датасете как ImageFile, PDFFile или ArchiveImport.
+
+    Выполняется в задаче Celery; PDF после регистрации ставится в очередь на
+    извлечение изображений, архив - на импорт (ArchiveImport). Каталог частей удаляется
+    после успешной регистрации.
+    """
+    try:
+        assembled_path = _concatenate_chunks(session)
+
+        if session.kind == 'image':
+            with Image.open(assembled_path) as image:
+                image.verify()
+            storage, upload_to = image_storage, rename_uploaded_file
+        elif session.kind == 'archive':
+            storage, upload_to = default_storage, rename_uploaded_archive
+        else:
+            storage, upload_to = default_storage, rename_uploaded_pdf
+
+        with open(assembled_path, 'rb') as f:
+            name = storage.save(upload_to(None, session.original_filename), AssembledFile(f))
+
+        with transaction.atomic():
+            if session.kind == 'image':
+                session.image = ImageFile.objects.create(
+                    dataset=session.dataset,
+                    image=name,
+                    original_filename=session.original_filename
+                )
+                queue_image_metadata([session.image.id])
+            elif session.kind == 'archive':
+                session.archive = ArchiveImport.objects.create(
+                    dataset=session.dataset,
+                    user_id=session.user_id,
+                    archive=name,
+                    original_filename=session.original_filename
+                )
+                from .tasks import import_archive_task
+                archive_id = session.archive.id
+                transaction.on_commit(lambda: import_archive_task.delay(archive_id))
+            else:
+                session.pdf = PDFFile.objects.create(
+                    dataset=session.dataset,
+                    pdf=name,
+                    original_filename=session.original_filename,
+                    extraction_mode=session.extraction_mode
+                )
+                from .tasks import ingest_pdf_task
+                pdf_id = session.pdf.id
+                transaction.on_commit(lambda: ingest_pdf_task.delay(pdf_id))
+
+            session.status = 'done'
+            session.save(update_fields=['image', 'pdf', 'archive', 'status', 'updated_at'])
+            Dataset.objects.filter(id=session.dataset_id).update(status='uploading')
+
+    except Exception as e:
+        UploadSession.objects.filter(id=session.id).update(status='error', error_message=str(e))
+        # Части остаются до cleanup_upload_sessions, удаляется только склеенная копия
+        try:
+            os.remove(os.path.join(get_session_dir(session), 'assembled'))
+        except OSError:
+            pass
+        raise
+
+    shutil.rmtree(get_session_dir(session), ignore_errors=True)
+    return session
@@ -6,7 +6,16 @@ urlpatterns = [
     path('create/', views.dataset_create, name='dataset_create'),
     path('<int:pk>/', views.dataset_detail, name='dataset_detail'),
     path('<int:pk>/upload/', views.dataset_upload, name='dataset_upload'),
+    path('<int:pk>/uploads/', views.upload_create, name='upload_create'),
+    path('uploads/<uuid:upload_id>/', views.upload_status, name='upload_status'),
+    path('uploads/<uuid:upload_id>/chunks/<int:offset>/', views.upload_chunk, name='upload_chunk'),
+    path('<int:pk>/export/', views.dataset_export, name='dataset_export'),
+    path('exports/<int:pk>/download/', views.download_export, name='download_export'),
+    path('<int:pk>/snapshots/', views.snapshot_create, name='snapshot_create'),
+    path('snapshots/<int:pk>/delete/', views.snapshot_delete, name='snapshot_delete'),
     path('<int:pk>/delete/', views.dataset_delete, name='dataset_delete'),
     path('image/<int:pk>/delete/', views.delete_image, name='delete_image'),
+    path('image/<int:pk>/dzi/', views.image_dzi, name='image_dzi'),
+    path('image/<int:pk>/tiles/<str:version>/<int:level>/<int:col>_<int:row>/', views.image_tile, name='image_tile'),
     path('pdf/<int:pk>/delete/', views.delete_pdf, name='delete_pdf'),
 ]
\ No newline at end of file
@@ -1,9 +1,19 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.views.decorators.http import require_POST
-from .models import Dataset, ImageFile, PDFFile
+from django.db.models import Count
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from django.views.decorators.http import require_POST, require_GET, require_http_methods
+from .exports import EXPORT_FORMATS, get_export_filename, stream_dataset_export
+from .models import Dataset, DatasetExport, DatasetSnapshot, ImageFile, PDFFile, UploadSession
+from .snapshots import create_snapshot, purge_retired_rows, retire_or_delete_image
 from .forms import DatasetForm, ImageUploadForm, PDFUploadForm
+from .tasks import export_dataset_task, ingest_pdf_task
+from .tiles import get_max_level, get_tile_path, needs_tiles, request_tile_pyramid
+from .uploads import UploadError, create_upload_session, get_session_state, register_images, write_chunk
 
 
 @login_required
@@ -41,6 +51,10 @@ def dataset_detail(request, pk):
         'dataset': dataset,
         'images': images,
         'pdf_files': pdf_files,
+        'archive_imports': dataset.archiveimport_set.all(),
+        'exports': dataset.datasetexport_set.all()[:10],
+        'export_formats': DatasetExport.FORMAT_CHOICES,
+        'snapshots': dataset.snapshots.select_related('created_by').annotate(models_count=Count('ml_models')),
         'image_count': images.count(),
         'annotated_count': images.filter(is_annotated=True).count(),
     }
@@ -61,18 +75,10 @@ def dataset_upload(request, pk):
             image_form = ImageUploadForm(request.POST, request.FILES)
             if image_form.is_valid():
                 images = request.FILES.getlist('images')
-                successful_uploads = 0
+                successful_uploads, errors = register_images(dataset, images)
 
-                for image in images:
-                    try:
-                        ImageFile.objects.create(
-                            dataset=dataset,
-                            image=image,
-                            original_filename=image.name
-                        )
-                        successful_uploads += 1
-                    except Exception as e:
-                        messages.error(request, f'Ошибка при загрузке {image.name}: {str(e)}')
+                for filename, error in errors:
+                    messages.error(request, f'Ошибка при загрузке {filename}: {error}')
 
                 if successful_uploads > 0:
                     messages.success(request, f'Успешно загружено {successful_uploads} изображений')
@@ -84,21 +90,25 @@ def dataset_upload(request, pk):
             pdf_form = PDFUploadForm(request.POST, request.FILES)
             if pdf_form.is_valid():
                 pdf_files = request.FILES.getlist('pdf_files')
+                extraction_mode = pdf_form.cleaned_data['extraction_mode']
                 successful_uploads = 0
 
                 for pdf in pdf_files:
                     try:
-                        PDFFile.objects.create(
+                        pdf_file = PDFFile.objects.create(
                             dataset=dataset,
                             pdf=pdf,
-                            original_filename=pdf.name
+                            original_filename=pdf.name,
+                            extraction_mode=extraction_mode
                         )
+                        # Страницы обрабатываются в фоне, прогресс виден на странице датасета
+                        ingest_pdf_task.delay(pdf_file.id)
                         successful_uploads += 1
                     except Exception as e:
                         messages.error(request, f'Ошибка при загрузке {pdf.name}: {str(e)}')
 
                 if successful_uploads > 0:
-                    messages.success(request, f'Успешно загружено {successful_uploads} PDF файлов')
+                    messages.success(request, f'Успешно загружено {successful_uploads} PDF файлов, изображения извлекаются в фоне')
                     dataset.status = 'uploading'
                     dataset.save()
 
@@ -111,6 +121,151 @@ def dataset_upload(request, pk):
     }
     return render(request, 'dataset/dataset_upload.html', context)
 
+@login_required
+@require_POST
+def upload_create(request, pk):
+    """Начало возобновляемой загрузки файла частями (параметры: filename, size, extraction_mode)"""
+    dataset = get_object_or_404(Dataset, pk=pk, user=request.user)
+    try:
+        session = create_upload_session(
+            dataset,
+            request.user,
+            request.POST.get('filename', ''),
+            int(request.POST.get('size', 0)),
+            request.POST.get('extraction_mode', 'pages')
+        )
+    except (UploadError, ValueError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse(dict(get_session_state(session), success=True), status=201)
+
+
+@login_required
+@require_GET
+def upload_status(request, upload_id):
+    """Состояние загрузки: клиент досылает части, которых нет в received_offsets"""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    return JsonResponse(dict(get_session_state(session), success=True))
+
+
+@login_required
+@require_http_methods(['PUT'])
+def upload_chunk(request, upload_id, offset):
+    """
+    Прием одной части загрузки: тело запроса - байты части, которые пишутся на
+    диск потоком без чтения request.body в память.
+    """
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    if session.status != 'uploading':
+        return JsonResponse(dict(get_session_state(session), success=True))
+
+    try:
+        write_chunk(session, offset, request, int(request.META.get('CONTENT_LENGTH') or 0))
+    except UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    session.refresh_from_db()
+    return JsonResponse(dict(get_session_state(session), success=True))
+
+
+@login_required
+@require_GET
+def image_dzi(request, pk):
+    """
+    Описание пирамиды тайлов изображения для инструмента разметки.
+
+    Первое обращение ставит генерацию пирамиды в очередь; пока она не готова,
+    клиент показывает превью и повторяет запрос.
+    """
+    image = get_object_or_404(ImageFile, pk=pk, dataset__user=request.user)
+    if not image.sha256 or not needs_tiles(image):
+        return JsonResponse({'tiled': False, 'ready': False})
+
+    status = image.tiles_status or request_tile_pyramid(image)
+    width, height = image.get_display_size()
+    return JsonResponse({
+        'tiled': True,
+        'ready': status == 'ready',
+        'status': status,
+        'width': width,
+        'height': height,
+        'tile_size': settings.TILE_SIZE,
+        'max_level': get_max_level(width, height),
+        # Префикс URL тайлов: клиент дописывает '<уровень>/<col>_<row>/'
+        'tiles_url': reverse('image_tile', args=[image.pk, image.sha256[:16], 0, 0, 0])[:-len('0/0_0/')],
+        'format': settings.TILE_FORMAT,
+    })
+
+
+@login_required
+@require_GET
+def image_tile(request, pk, version, level, col, row):
+    """
+    Тайл пирамиды: /<версия>/<уровень>/<col>_<row>/.
+
+    Версия - префикс SHA-256 оригинала, поэтому содержимое по URL неизменно и
+    браузер кэширует тайлы бессрочно (private - данные пользователя).
+    """
+    image = get_object_or_404(ImageFile, pk=pk, dataset__user=request.user)
+    if image.tiles_status != 'ready' or not image.sha256.startswith(version):
+        raise Http404('Тайл не найден')
+
+    path = get_tile_path(image, level, col, row)
+    if path is None:
+        raise Http404('Тайл не найден')
+
+    content_type = 'image/jpeg' if settings.TILE_FORMAT == 'jpg' else f'image/{settings.TILE_FORMAT}'
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
+@login_required
+@require_POST
+def dataset_export(request, pk):
+    """
+    Выгрузка изображений и разметки в ZIP (параметры: format - yolo/coco/voc, deduplicate).
+
+    Архив собирается генератором по мере отправки, без временной копии.
+    Датасеты больше DATASET_EXPORT_STREAMING_MAX_IMAGES изображений собираются
+    в фоне, архив скачивается со страницы датасета.
+    """
+    dataset = get_object_or_404(Dataset, pk=pk, user=request.user)
+    export_format = request.POST.get('format', 'yolo')
+    if export_format not in EXPORT_FORMATS:
+        messages.error(request, f'Неизвестный формат выгрузки: {export_format}')
+        return redirect('dataset_detail', pk=dataset.pk)
+    deduplicate = bool(request.POST.get('deduplicate'))
+
+    if dataset.get_image_count() > settings.DATASET_EXPORT_STREAMING_MAX_IMAGES:
+        dataset_export = DatasetExport.objects.create(
+            dataset=dataset, user=request.user, export_format=export_format, deduplicate=deduplicate
+        )
+        export_dataset_task.delay(dataset_export.id)
+        messages.success(request, 'Датасет большой, архив собирается в фоне - ссылка появится на странице датасета')
+        return redirect('dataset_detail', pk=dataset.pk)
+
+    response = StreamingHttpResponse(
+        stream_dataset_export(dataset, export_format, deduplicate), content_type='application/zip'
+    )
+    response['Content-Disposition'] = content_disposition_header(
+        True, get_export_filename(dataset, export_format)
+    )
+    return response
+
+
+@login_required
+@require_GET
+def download_export(request, pk):
+    """Скачивание архива фоновой выгрузки"""
+    dataset_export = get_object_or_404(DatasetExport, pk=pk, dataset__user=request.user, status='done')
+    return FileResponse(
+        dataset_export.file.open('rb'),
+        as_attachment=True,
+        filename=get_export_filename(dataset_export.dataset, dataset_export.export_format)
+    )
+
+
 @login_required
 @require_POST
 def dataset_delete(request, pk):
@@ -122,13 +277,41 @@ def dataset_delete(request, pk):
     return redirect('dataset_list')
 
 
+@login_required
+@require_POST
+def snapshot_create(request, pk):
+    """Снимок текущего состояния датасета для воспроизводимого обучения"""
+    dataset = get_object_or_404(Dataset, pk=pk, user=request.user)
+    create_snapshot(dataset, request.user, request.POST.get('name', '').strip())
+    messages.success(request, 'Снимок датасета создан')
+    return redirect('dataset_detail', pk=dataset.pk)
+
+
+@login_required
+@require_POST
+def snapshot_delete(request, pk):
+    """Удаление снимка; строки, нужные только ему, удаляются окончательно"""
+    snapshot = get_object_or_404(DatasetSnapshot, pk=pk, dataset__user=request.user)
+    dataset = snapshot.dataset
+    if snapshot.ml_models.exists():
+        messages.error(request, 'Снимок используется обученными на нем моделями')
+        return redirect('dataset_detail', pk=dataset.pk)
+
+    snapshot.delete()
+    images_deleted, annotations_deleted = purge_retired_rows(dataset)
+    messages.success(request, f'Снимок удален, освобождено изображений: {images_deleted}, '
+                              f'аннотаций: {annotations_deleted}')
+    return redirect('dataset_detail', pk=dataset.pk)
+
+
 @login_required
 @require_POST
 def delete_image(request, pk):
     """Удаление изображения"""
     image = get_object_or_404(ImageFile, pk=pk, dataset__user=request.user)
     dataset_pk = image.dataset.pk
-    image.delete()
+    # Изображение из снимка остается в БД для обученных на нем моделей
+    retire_or_delete_image(image)
     messages.success(request, 'Изображение удалено')
     return redirect('dataset_detail', pk=dataset_pk)
 
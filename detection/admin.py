@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Annotation, AnnotationSession, MLModel, DetectionResult
+from .models import Annotation, AnnotationSession, MLModel, DetectionResult, Job
 
 @admin.register(Annotation)
 class AnnotationAdmin(admin.ModelAdmin):
@@ -17,7 +17,7 @@ class AnnotationSessionAdmin(admin.ModelAdmin):
 @admin.register(MLModel)
 class MLModelAdmin(admin.ModelAdmin):
     list_display = ['name', 'dataset', 'status', 'accuracy', 'created_at']
-    list_filter = ['status', 'created_at']
+    list_filter = ['status', 'training_mode', 'created_at']
     search_fields = ['name', 'dataset__name']
     readonly_fields = ['created_at']
 
@@ -26,4 +26,11 @@ class DetectionResultAdmin(admin.ModelAdmin):
     list_display = ['detected_label', 'confidence', 'image', 'ml_model', 'created_at']
     list_filter = ['created_at', 'detected_label']
     search_fields = ['detected_label', 'image__original_filename']
-    readonly_fields = ['created_at']
\ No newline at end of file
+    readonly_fields = ['created_at']
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'ml_model', 'user', 'queue', 'status', 'priority', 'created_at', 'started_at', 'finished_at']
+    list_filter = ['kind', 'queue', 'status', 'priority', 'created_at']
+    search_fields = ['ml_model__name', 'user__username', 'task_id']
+    readonly_fields = ['created_at']
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DetectionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'detection'
+
+    def ready(self):
+        # Сигналы Celery: учет длительности задач для автоскейлера, контроль памяти воркеров
+        from . import autoscaler, worker_memory  # noqa: F401
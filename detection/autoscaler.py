@@ -0,0 +1,189 @@
+import math
+import time
+import redis
+from celery import current_app
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from .models import Job
+
+# Длительности последних задач каждой очереди хранятся в брокере, чтобы их видел
+# автоскейлер, запущенный отдельным процессом
+RUNTIME_KEY = 'autoscaler:runtimes:{queue}'
+RUNTIME_SAMPLES = 100
+
+
+_broker_client = None
+
+
+def get_broker_client():
+    """Клиент Redis того же брокера, к которому подключен Celery (с учетом переменной окружения)"""
+    global _broker_client
+    if _broker_client is None:
+        _broker_client = redis.Redis.from_url(current_app.conf.broker_url)
+    return _broker_client
+
+
+def record_task_runtime(client, queue, seconds):
+    key = RUNTIME_KEY.format(queue=queue)
+    pipe = client.pipeline()
+    pipe.lpush(key, round(seconds, 3))
+    pipe.ltrim(key, 0, RUNTIME_SAMPLES - 1)
+    pipe.execute()
+
+
+class CeleryPoolActuator:
+    """
+    Изменение числа процессов воркеров через удаленное управление Celery (pool_grow / pool_shrink).
+
+    Воркер очереди определяется по active_queues, поэтому новые контейнеры воркеров
+    подхватываются без настройки. Процессы добавляются воркеру с наименьшим пулом
+    и снимаются с наибольшего.
+    """
+
+    def __init__(self, app=None):
+        self.app = app or current_app
+
+    def get_state(self, queues):
+        """{очередь: {'workers': {имя: размер пула}, 'active': выполняемых задач}}"""
+        inspector = self.app.control.inspect()
+        active_queues = inspector.active_queues() or {}
+        stats = inspector.stats() or {}
+        active = inspector.active() or {}
+
+        state = {queue: {'workers': {}, 'active': 0} for queue in queues}
+        for worker, worker_queues in active_queues.items():
+            pool_size = stats.get(worker, {}).get('pool', {}).get('max-concurrency', 0)
+            for queue in {worker_queue['name'] for worker_queue in worker_queues}:
+                if queue in state:
+                    state[queue]['workers'][worker] = pool_size
+                    state[queue]['active'] += len(active.get(worker, []))
+        return state
+
+    def resize(self, workers, delta):
+        """Изменение суммарного пула воркеров очереди на delta процессов"""
+        pool_sizes = dict(workers)
+        for _ in range(abs(delta)):
+            if delta > 0:
+                worker = min(pool_sizes, key=pool_sizes.get)
+                reply = self.app.control.pool_grow(1, destination=[worker], reply=True)
+            else:
+                worker = max(pool_sizes, key=pool_sizes.get)
+                if pool_sizes[worker] <= 1:
+                    break
+                reply = self.app.control.pool_shrink(1, destination=[worker], reply=True)
+            if any('error' in answer.get(worker, {}) for answer in reply or []):
+                # Например, все процессы заняты и уменьшать пул пока нельзя
+                break
+            pool_sizes[worker] += 1 if delta > 0 else -1
+        return pool_sizes
+
+
+class QueueAutoscaler:
+    """
+    Масштабирование пулов воркеров по глубине очередей в брокере.
+
+    Нужное число процессов очереди: выполняемые задачи плюс столько процессов,
+    чтобы разобрать очередь за AUTOSCALE_TARGET_LATENCY секунд при средней
+    длительности задачи. Увеличение применяется сразу, уменьшение - по одному
+    процессу и только после scale_down_checks проверок подряд, где процессов
+    больше нужного (гистерезис против дребезга). Клиент Redis и исполнитель
+    передаются снаружи, поэтому автоскейлер проверяется на заглушках.
+    """
+
+    def __init__(self, client, actuator, queues=None, target_latency=None,
+                 default_runtime=None, scale_down_checks=None):
+        self.client = client
+        self.actuator = actuator
+        self.queues = queues if queues is not None else settings.AUTOSCALE_QUEUES
+        self.target_latency = target_latency or settings.AUTOSCALE_TARGET_LATENCY
+        self.default_runtime = default_runtime or settings.AUTOSCALE_DEFAULT_RUNTIME
+        self.scale_down_checks = scale_down_checks or settings.AUTOSCALE_SCALE_DOWN_CHECKS
+        self.low_checks = {queue: 0 for queue in self.queues}
+
+    def get_queue_depth(self, queue):
+        """
+        Задачи в брокере плюс ожидающие задачи планировщика: для очередей обучения
+        и детекции задача попадает в брокер только в пределах JOB_CONCURRENCY,
+        остальной спрос виден лишь в таблице Job
+        """
+        return self.client.llen(queue) + Job.objects.filter(queue=queue, status='queued').count()
+
+    def get_average_runtime(self, queue):
+        samples = [float(value) for value in self.client.lrange(RUNTIME_KEY.format(queue=queue), 0, -1)]
+        return sum(samples) / len(samples) if samples else self.default_runtime
+
+    def get_desired_concurrency(self, queue, depth, runtime, active):
+        bounds = self.queues[queue]
+        backlog_processes = math.ceil(depth * runtime / self.target_latency)
+        return max(bounds['min'], min(bounds['max'], active + backlog_processes))
+
+    def step(self, dry_run=False):
+        """Одна проверка всех очередей; возвращает принятые решения"""
+        state = self.actuator.get_state(list(self.queues))
+        decisions = []
+
+        for queue in self.queues:
+            workers = state[queue]['workers']
+            if not workers:
+                continue
+
+            current = sum(workers.values())
+            depth = self.get_queue_depth(queue)
+            runtime = self.get_average_runtime(queue)
+            desired = self.get_desired_concurrency(queue, depth, runtime, state[queue]['active'])
+
+            target = current
+            if desired > current:
+                target = desired
+                self.low_checks[queue] = 0
+            elif desired < current:
+                self.low_checks[queue] += 1
+                if self.low_checks[queue] >= self.scale_down_checks:
+                    target = current - 1
+                    self.low_checks[queue] = 0
+            else:
+                self.low_checks[queue] = 0
+
+            if target != current and not dry_run:
+                self.actuator.resize(workers, target - current)
+
+            decisions.append({
+                'queue': queue,
+                'depth': depth,
+                'runtime': round(runtime, 1),
+                'current': current,
+                'desired': desired,
+                'target': target,
+            })
+
+        return decisions
+
+    def run(self, interval=None, dry_run=False):
+        interval = interval or settings.AUTOSCALE_INTERVAL
+        while True:
+            for decision in self.step(dry_run=dry_run):
+                if decision['target'] != decision['current']:
+                    print(f"Очередь {decision['queue']}: глубина {decision['depth']}, "
+                          f"средняя задача {decision['runtime']} с, процессов "
+                          f"{decision['current']} -> {decision['target']}")
+            time.sleep(interval)
+
+
+_task_started_at = {}
+
+
+@task_prerun.connect
+def on_task_prerun(task_id=None, **kwargs):
+    _task_started_at[task_id] = time.monotonic()
+
+
+@task_postrun.connect
+def on_task_postrun(task_id=None, task=None, **kwargs):
+    started_at = _task_started_at.pop(task_id, None)
+    queue = (task.request.delivery_info or {}).get('routing_key') if task is not None else None
+    if started_at is None or queue not in settings.AUTOSCALE_QUEUES:
+        return
+    try:
+        record_task_runtime(get_broker_client(), queue, time.monotonic() - started_at)
+    except redis.RedisError as e:
+        print(f"Не удалось сохранить длительность задачи для автоскейлера: {e}")
@@ -0,0 +1,98 @@
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from ultralytics.data import build_dataloader
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import RANK
+
+
+class CPUDistributedTrainer(DetectionTrainer):
+    """
+    DetectionTrainer для data-parallel обучения на CPU (torch DDP, бэкенд gloo).
+
+    Штатный DDP в ultralytics рассчитан на CUDA (device_ids, NCCL), поэтому здесь
+    переопределены инициализация группы процессов, DDP-обертка модели и загрузчик
+    данных. Процессы запускаются через torchrun, RANK/WORLD_SIZE берутся из окружения.
+    В args.batch передается глобальный батч, каждый процесс получает его долю.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.world_size = int(os.environ.get('WORLD_SIZE', 1))
+        self.epoch_throughput = []
+        self._epoch_started_at = None
+        self.add_callback('on_train_epoch_start', self._on_train_epoch_start)
+        self.add_callback('on_train_epoch_end', self._on_train_epoch_end)
+
+    def train(self):
+        if self.world_size > 1:
+            dist.init_process_group(backend='gloo', timeout=timedelta(hours=3),
+                                    rank=RANK, world_size=self.world_size)
+
+        # Шард датасета (кэш меток и изображений) готовится один раз процессом 0,
+        # остальные процессы и узлы читают готовый кэш из общего MEDIA_ROOT
+        if RANK in (-1, 0):
+            self.build_dataset(self.data['train'], mode='train', batch=self.batch_size)
+        if self.world_size > 1:
+            dist.barrier()
+
+        self._do_train(self.world_size)
+
+        if self.world_size > 1 and dist.is_initialized():
+            dist.destroy_process_group()
+
+    def _setup_ddp(self, world_size):
+        # Группа процессов уже создана в train()
+        self.device = torch.device('cpu')
+
+    def _setup_train(self, world_size):
+        super()._setup_train(1)
+        if world_size > 1:
+            self.model = DistributedDataParallel(self.model, find_unused_parameters=True)
+
+    def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode='train'):
+        dataset = self.build_dataset(dataset_path, mode, batch_size)
+        shuffle = mode == 'train'
+        if mode == 'train':
+            batch_size = max(1, batch_size // self.world_size)
+        workers = self.args.workers if mode == 'train' else self.args.workers * 2
+        return build_dataloader(dataset, batch_size, workers, shuffle, rank if self.world_size > 1 else -1)
+
+    def _on_train_epoch_start(self, trainer):
+        self._epoch_started_at = time.monotonic()
+
+    def _on_train_epoch_end(self, trainer):
+        elapsed = time.monotonic() - self._epoch_started_at
+        images = len(self.train_loader.dataset)
+        self.epoch_throughput.append(round(images / max(elapsed, 1e-6), 2))
+
+
+def main():
+    """Точка входа процесса torchrun: python -m detection.ddp_train <params.json> <metrics.json>"""
+    params_path, metrics_path = sys.argv[1], sys.argv[2]
+    with open(params_path, encoding='utf-8') as f:
+        params = json.load(f)
+
+    torch.set_num_threads(params.pop('torch_threads'))
+    trainer = CPUDistributedTrainer(overrides=params)
+    trainer.train()
+
+    if RANK in (-1, 0):
+        metrics = {
+            'results_dict': {key: float(value) for key, value in (trainer.metrics or {}).items()},
+            'epochs_trained': trainer.epoch + 1,
+            'world_size': trainer.world_size,
+            'epoch_throughput': trainer.epoch_throughput,
+        }
+        with open(metrics_path, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f)
+
+
+if __name__ == '__main__':
+    main()
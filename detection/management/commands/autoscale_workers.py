@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from detection.autoscaler import QueueAutoscaler, CeleryPoolActuator, get_broker_client
+
+
+class Command(BaseCommand):
+    help = 'Масштабирование пулов воркеров Celery по глубине очередей (AUTOSCALE_QUEUES)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Одна проверка с выводом решений')
+        parser.add_argument('--dry-run', action='store_true', help='Не изменять пулы воркеров')
+        parser.add_argument('--interval', type=int, help='Интервал проверок в секундах')
+
+    def handle(self, *args, **options):
+        autoscaler = QueueAutoscaler(get_broker_client(), CeleryPoolActuator())
+
+        if not options['once']:
+            autoscaler.run(interval=options['interval'], dry_run=options['dry_run'])
+            return
+
+        self.stdout.write('Очередь | глубина | задача, с | процессов | нужно | цель')
+        for decision in autoscaler.step(dry_run=options['dry_run']):
+            self.stdout.write(
+                f"{decision['queue']} | {decision['depth']} | {decision['runtime']} | "
+                f"{decision['current']} | {decision['desired']} | {decision['target']}"
+            )
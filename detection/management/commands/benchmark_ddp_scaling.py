@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from detection.models import MLModel
+from detection.yolo_utils import YOLODDPBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Замер пропускной способности DDP-обучения на CPU при разном числе процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_id', type=int, help='ID ML модели, по датасету которой выполняется замер')
+        parser.add_argument('--processes', default='1,2,4', help='Число процессов через запятую')
+        parser.add_argument('--epochs', type=int, default=1, help='Эпох на каждый замер')
+
+    def handle(self, *args, **options):
+        try:
+            ml_model = MLModel.objects.get(id=options['model_id'])
+        except MLModel.DoesNotExist:
+            raise CommandError(f"Модель {options['model_id']} не найдена")
+
+        process_counts = [int(value) for value in options['processes'].split(',') if value.strip()]
+        scaling = YOLODDPBenchmark(ml_model).run(process_counts, epochs=options['epochs'])
+
+        baseline = scaling.get(str(process_counts[0]))
+        self.stdout.write('Процессов | изобр./с | ускорение | эффективность')
+        for nproc in process_counts:
+            throughput = scaling[str(nproc)]
+            speedup = throughput / baseline if baseline else 0
+            efficiency = speedup * process_counts[0] / nproc
+            self.stdout.write(f'{nproc:>9} | {throughput:>8} | {speedup:>9.2f} | {efficiency:>12.0%}')
@@ -0,0 +1,33 @@
+from celery import current_app
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Память процессов пула воркеров Celery и доля, общая с родителем (copy-on-write)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, default=5, help='Время ожидания ответа воркеров, с')
+
+    def handle(self, *args, **options):
+        replies = current_app.control.broadcast('pool_memory', reply=True, timeout=options['timeout'])
+        if not replies:
+            self.stdout.write('Воркеры не ответили')
+            return
+
+        for reply in replies:
+            for worker, report in reply.items():
+                parent = report['parent']
+                children = report['children']
+                self.stdout.write(f"{worker}: родитель pid {parent['pid']}, RSS {parent['rss_mb']} МБ")
+                self.stdout.write('      pid |   RSS, МБ |   USS, МБ |   PSS, МБ | общих, МБ')
+                for child in children:
+                    self.stdout.write(
+                        f"{child['pid']:>9} | {child['rss_mb']:>9} | {child['uss_mb']:>9} | "
+                        f"{child['pss_mb']:>9} | {child['shared_mb']:>9}"
+                    )
+                if children:
+                    shared = sum(child['shared_mb'] for child in children)
+                    self.stdout.write(
+                        f"   Экономия за счет общих страниц: ~{shared:.0f} МБ "
+                        f"({shared / len(children):.0f} МБ на процесс)"
+                    )
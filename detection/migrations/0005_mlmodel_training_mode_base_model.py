@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0004_mlmodel_training_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmodel',
+            name='base_model',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='finetuned_models', to='detection.mlmodel', verbose_name='Исходная модель'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='training_mode',
+            field=models.CharField(choices=[('full', 'Полное обучение'), ('finetune', 'Дообучение предыдущей модели')], default='full', max_length=20, verbose_name='Режим обучения'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0005_mlmodel_training_mode_base_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmodel',
+            name='resume_count',
+            field=models.IntegerField(default=0, verbose_name='Количество возобновлений обучения'),
+        ),
+    ]
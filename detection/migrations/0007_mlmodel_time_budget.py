@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0006_mlmodel_resume_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmodel',
+            name='epochs_trained',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Выполнено эпох'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='time_budget',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Бюджет времени обучения (мин)'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='training_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='Фактическое время обучения (мин)'),
+        ),
+    ]
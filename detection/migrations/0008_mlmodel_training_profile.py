@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0007_mlmodel_time_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmodel',
+            name='training_profile',
+            field=models.JSONField(blank=True, null=True, verbose_name='Профиль обучения (CPU/кэш)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0008_mlmodel_training_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmodel',
+            name='ddp_nodes',
+            field=models.IntegerField(default=1, verbose_name='DDP узлов'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='ddp_processes',
+            field=models.IntegerField(default=1, verbose_name='DDP процессов на узел'),
+        ),
+    ]
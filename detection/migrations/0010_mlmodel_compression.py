@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0009_mlmodel_ddp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmodel',
+            name='compress_after_training',
+            field=models.BooleanField(default=False, verbose_name='Сжать модель после обучения'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='compression',
+            field=models.CharField(blank=True, choices=[('', 'Нет'), ('distill', 'Дистилляция')], default='', max_length=20, verbose_name='Способ сжатия'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='latency_ms',
+            field=models.FloatField(blank=True, null=True, verbose_name='Задержка инференса на CPU (мс)'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='parent_model',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='compressed_models', to='detection.mlmodel', verbose_name='Исходная модель для сжатия'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0010_mlmodel_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmodel',
+            name='preview_metrics',
+            field=models.JSONField(blank=True, null=True, verbose_name='Метрики пробного обучения'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='preview_status',
+            field=models.CharField(choices=[('none', 'Не запускалось'), ('running', 'Выполняется'), ('done', 'Завершено'), ('error', 'Ошибка')], default='none', max_length=20, verbose_name='Статус пробного обучения'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('detection', '0011_mlmodel_preview'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mlmodel',
+            name='status',
+            field=models.CharField(choices=[('not_trained', 'Не обучена'), ('queued', 'В очереди'), ('training', 'Обучается'), ('trained', 'Обучена'), ('error', 'Ошибка')], default='not_trained', max_length=20, verbose_name='Статус'),
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('train', 'Обучение'), ('detect', 'Детекция')], max_length=20, verbose_name='Тип задачи')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершена'), ('error', 'Ошибка')], default='queued', max_length=20, verbose_name='Статус')),
+                ('priority', models.IntegerField(choices=[(-1, 'Низкий'), (0, 'Обычный'), (1, 'Высокий')], default=0, verbose_name='Приоритет')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры задачи')),
+                ('task_id', models.CharField(blank=True, db_index=True, max_length=255, null=True, verbose_name='ID задачи Celery')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата постановки в очередь')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата запуска')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+                ('ml_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='detection.mlmodel', verbose_name='ML Модель')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Задача планировщика',
+                'verbose_name_plural': 'Задачи планировщика',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['kind', 'status'], name='detection_j_kind_fc3f19_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0012_job'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('ml_model', 'kind'), name='unique_active_job_per_model'),
+        ),
+    ]
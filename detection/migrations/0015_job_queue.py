@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:05
+
+from django.db import migrations, models
+
+
+def fill_job_queue(apps, schema_editor):
+    # Задачи, созданные до разделения очередей: обучение - в очередь обучения,
+    # детекция - в очередь массовой детекции
+    Job = apps.get_model('detection', 'Job')
+    Job.objects.filter(kind='train').update(queue='training')
+    Job.objects.filter(kind='detect').update(queue='detection_bulk')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0014_job_cancel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='queue',
+            field=models.CharField(default='', max_length=50, verbose_name='Очередь Celery'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_job_queue, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='job',
+            name='detection_j_kind_fc3f19_idx',
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['queue', 'status'], name='detection_j_queue_20eaaf_idx'),
+        ),
+    ]
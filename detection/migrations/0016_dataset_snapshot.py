@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0012_dataset_snapshot'),
+        ('detection', '0015_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='retired_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Удалена'),
+        ),
+        migrations.AddField(
+            model_name='mlmodel',
+            name='snapshot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='ml_models', to='dataset.datasetsnapshot', verbose_name='Снимок датасета'),
+        ),
+    ]
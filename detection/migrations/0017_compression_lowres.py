@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:13
+
+from django.db import migrations, models
+
+
+PROFILE_KEYS = {
+    'teacher_accuracy': 'source_accuracy',
+    'teacher_latency_ms': 'source_latency_ms',
+    'teacher_imgsz': 'source_imgsz',
+    'student_imgsz': 'imgsz',
+    'latency_sample_images': 'latency_sample_images',
+}
+
+
+def rename_distillation(apps, schema_editor):
+    # Сжатые версии, созданные как «дистилляция»: способ сжатия и сравнение
+    # с исходной моделью в training_profile под новыми именами
+    MLModel = apps.get_model('detection', 'MLModel')
+    for ml_model in MLModel.objects.filter(compression='distill'):
+        profile = dict(ml_model.training_profile or {})
+        distillation = profile.pop('distillation', None)
+        if distillation is not None:
+            profile['compression'] = {PROFILE_KEYS.get(key, key): value for key, value in distillation.items()}
+        ml_model.compression = 'lowres'
+        ml_model.training_profile = profile
+        ml_model.save(update_fields=['compression', 'training_profile'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0016_dataset_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mlmodel',
+            name='compression',
+            field=models.CharField(blank=True, choices=[('', 'Нет'), ('lowres', 'Дообучение на пониженном разрешении')], default='', max_length=20, verbose_name='Способ сжатия'),
+        ),
+        migrations.RunPython(rename_distillation, migrations.RunPython.noop),
+    ]
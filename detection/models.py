@@ -1,6 +1,7 @@
+from django.conf import settings
 from django.db import models
 from users.models import CustomUser
-from dataset.models import Dataset, ImageFile
+from dataset.models import CurrentRowManager, Dataset, ImageFile
 import os
 
 class Annotation(models.Model):
@@ -12,6 +13,11 @@ class Annotation(models.Model):
     height = models.FloatField(verbose_name='Высота')
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name='Создано')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    # Удалена, но входит в снимок датасета (dataset.snapshots); null - текущая аннотация
+    retired_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name='Удалена')
+
+    objects = CurrentRowManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = 'Аннотация'
@@ -46,11 +52,29 @@ class MLModel(models.Model):
 
     STATUS_CHOICES = [
         ('not_trained', 'Не обучена'),
+        ('queued', 'В очереди'),
         ('training', 'Обучается'),
         ('trained', 'Обучена'),
         ('error', 'Ошибка'),
     ]
 
+    TRAINING_MODE_CHOICES = [
+        ('full', 'Полное обучение'),
+        ('finetune', 'Дообучение предыдущей модели'),
+    ]
+
+    PREVIEW_STATUS_CHOICES = [
+        ('none', 'Не запускалось'),
+        ('running', 'Выполняется'),
+        ('done', 'Завершено'),
+        ('error', 'Ошибка'),
+    ]
+
+    COMPRESSION_CHOICES = [
+        ('', 'Нет'),
+        ('lowres', 'Дообучение на пониженном разрешении'),
+    ]
+
     name = models.CharField(max_length=255, verbose_name='Название модели')
     description = models.TextField(blank=True, verbose_name='Описание')
     dataset = models.ForeignKey('dataset.Dataset', on_delete=models.CASCADE, verbose_name='Датасет')
@@ -65,6 +89,28 @@ class MLModel(models.Model):
     epochs = models.IntegerField(default=50, verbose_name='Количество эпох')
     batch_size = models.IntegerField(default=16, verbose_name='Размер батча')
     img_size = models.IntegerField(default=640, verbose_name='Размер изображения')
+    training_mode = models.CharField(max_length=20, choices=TRAINING_MODE_CHOICES, default='full',
+                                     verbose_name='Режим обучения')
+    base_model = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='finetuned_models', verbose_name='Исходная модель')
+    time_budget = models.IntegerField(null=True, blank=True, verbose_name='Бюджет времени обучения (мин)')
+    training_time = models.FloatField(null=True, blank=True, verbose_name='Фактическое время обучения (мин)')
+    epochs_trained = models.IntegerField(null=True, blank=True, verbose_name='Выполнено эпох')
+    training_profile = models.JSONField(null=True, blank=True, verbose_name='Профиль обучения (CPU/кэш)')
+    ddp_processes = models.IntegerField(default=1, verbose_name='DDP процессов на узел')
+    ddp_nodes = models.IntegerField(default=1, verbose_name='DDP узлов')
+    compress_after_training = models.BooleanField(default=False, verbose_name='Сжать модель после обучения')
+    parent_model = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True,
+                                     related_name='compressed_models', verbose_name='Исходная модель для сжатия')
+    compression = models.CharField(max_length=20, choices=COMPRESSION_CHOICES, default='', blank=True,
+                                   verbose_name='Способ сжатия')
+    latency_ms = models.FloatField(null=True, blank=True, verbose_name='Задержка инференса на CPU (мс)')
+    preview_status = models.CharField(max_length=20, choices=PREVIEW_STATUS_CHOICES, default='none',
+                                      verbose_name='Статус пробного обучения')
+    preview_metrics = models.JSONField(null=True, blank=True, verbose_name='Метрики пробного обучения')
+    # Версия данных, на которой обучена модель; снимок нельзя удалить, пока на него ссылаются модели
+    snapshot = models.ForeignKey('dataset.DatasetSnapshot', on_delete=models.RESTRICT, null=True, blank=True,
+                                 related_name='ml_models', verbose_name='Снимок датасета')
 
     # Файлы модели
     model_file = models.FileField(upload_to='models/', null=True, blank=True, verbose_name='Файл модели')
@@ -74,6 +120,7 @@ class MLModel(models.Model):
     trained_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата обучения')
     task_id = models.CharField(max_length=255, blank=True, null=True, verbose_name='ID задачи Celery')
     training_log = models.TextField(blank=True, null=True, verbose_name='Лог обучения')
+    resume_count = models.IntegerField(default=0, verbose_name='Количество возобновлений обучения')
 
     class Meta:
         verbose_name = 'ML Модель'
@@ -89,6 +136,27 @@ class MLModel(models.Model):
             return self.model_file.path
         return None
 
+    def get_deployment_model(self):
+        """
+        Модель для массовой детекции: последняя обученная сжатая версия, если ее mAP50
+        на общей валидационной выборке ниже исходной не более чем на
+        COMPRESSED_MODEL_MAX_MAP_DROP, иначе сама модель
+        """
+        if not settings.DETECTION_USE_COMPRESSED_MODEL:
+            return self
+
+        compressed = self.compressed_models.filter(status='trained').order_by('-created_at').first()
+        if compressed is None or not compressed.get_model_path() or not os.path.exists(compressed.get_model_path()):
+            return self
+
+        comparison = (compressed.training_profile or {}).get('compression', {})
+        source_accuracy = comparison.get('source_accuracy')
+        if source_accuracy is None or compressed.accuracy is None:
+            return self
+        if compressed.accuracy < source_accuracy - settings.COMPRESSED_MODEL_MAX_MAP_DROP:
+            return self
+        return compressed
+
     def delete(self, *args, **kwargs):
         """Удаление связанных файлов при удалении модели"""
         if self.model_file:
@@ -118,4 +186,58 @@ class DetectionResult(models.Model):
         ordering = ['-confidence']
 
     def __str__(self):
-        return f"{self.detected_label} ({self.confidence:.2f}) - {self.image.original_filename}"
\ No newline at end of file
+        return f"{self.detected_label} ({self.confidence:.2f}) - {self.image.original_filename}"
+
+
+class Job(models.Model):
+    """Задача обучения или детекции в очереди планировщика (см. detection/scheduler.py)"""
+
+    KIND_CHOICES = [
+        ('train', 'Обучение'),
+        ('detect', 'Детекция'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Завершена'),
+        ('error', 'Ошибка'),
+        ('cancelled', 'Отменена'),
+    ]
+
+    PRIORITY_CHOICES = [
+        (-1, 'Низкий'),
+        (0, 'Обычный'),
+        (1, 'Высокий'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name='Пользователь')
+    ml_model = models.ForeignKey('MLModel', on_delete=models.CASCADE, verbose_name='ML Модель')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Тип задачи')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', verbose_name='Статус')
+    priority = models.IntegerField(choices=PRIORITY_CHOICES, default=0, verbose_name='Приоритет')
+    queue = models.CharField(max_length=50, verbose_name='Очередь Celery')
+    params = models.JSONField(default=dict, blank=True, verbose_name='Параметры задачи')
+    cancel_requested = models.BooleanField(default=False, verbose_name='Запрошена отмена')
+    task_id = models.CharField(max_length=255, blank=True, null=True, db_index=True, verbose_name='ID задачи Celery')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата постановки в очередь')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата запуска')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата завершения')
+
+    class Meta:
+        verbose_name = 'Задача планировщика'
+        verbose_name_plural = 'Задачи планировщика'
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['queue', 'status'])]
+        constraints = [
+            # Не более одной активной задачи каждого типа на модель: повторные запросы
+            # присоединяются к уже запущенной задаче (см. scheduler.submit_job)
+            models.UniqueConstraint(
+                fields=['ml_model', 'kind'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_job_per_model',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.ml_model.name} ({self.get_status_display()})"
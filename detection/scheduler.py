@@ -0,0 +1,258 @@
+from collections import Counter, defaultdict, deque
+from celery import current_app
+from celery.result import AsyncResult
+from celery.signals import task_postrun, task_revoked
+from celery.utils import uuid
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from dataset.models import PDFFile
+from .models import Job, MLModel
+
+# Задачи Celery, которые запускает планировщик
+JOB_TASKS = {
+    'train': 'detection.tasks.train_yolo_model',
+    'detect': 'detection.tasks.run_detection_task',
+}
+
+
+class JobConflict(Exception):
+    """Активная задача модели выполняет другую работу; текст показывается пользователю"""
+
+
+def describe_job_target(params):
+    pdf_id = (params or {}).get('pdf_id')
+    if pdf_id:
+        name = PDFFile.objects.filter(id=pdf_id).values_list('original_filename', flat=True).first()
+        return f'PDF "{name or pdf_id}"'
+    return 'датасет'
+
+
+def submit_job(user, ml_model, kind, params=None, priority=0):
+    """
+    Постановка задачи в очередь планировщика с немедленной попыткой запуска.
+
+    На модель допускается одна активная задача каждого типа, поэтому повторный
+    запрос (двойной клик, повтор формы) не создает задачу, а возвращает уже
+    активную. Запрос на другой объект (другой PDF или датасет вместо PDF) не
+    склеивается с активной задачей, а отклоняется JobConflict. Возвращает
+    пару (job, created).
+    """
+    while True:
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(
+                    user=user,
+                    ml_model=ml_model,
+                    kind=kind,
+                    queue=get_job_queue(kind, ml_model, params),
+                    params=params or {},
+                    priority=priority,
+                )
+            break
+        except IntegrityError:
+            # Активная задача могла завершиться между вставкой и чтением - тогда вставляем снова
+            job = get_active_job(ml_model, kind)
+            if job is not None:
+                if job.params.get('pdf_id') != (params or {}).get('pdf_id'):
+                    raise JobConflict(
+                        f"Модель уже обрабатывает {describe_job_target(job.params)}. "
+                        f"Дождитесь завершения или отмените задачу, чтобы обработать {describe_job_target(params)}."
+                    )
+                return job, False
+
+    dispatch_jobs()
+    job.refresh_from_db()
+    return job, True
+
+
+def get_job_queue(kind, ml_model, params=None):
+    """Очередь Celery для задачи: детекция небольших датасетов (или PDF) идет в интерактивную очередь"""
+    if kind == 'train':
+        return settings.TRAINING_QUEUE
+    pdf_id = (params or {}).get('pdf_id')
+    if pdf_id:
+        size = PDFFile.objects.filter(id=pdf_id).values_list('page_count', flat=True).first() or 0
+    else:
+        size = ml_model.dataset.imagefile_set.count()
+    if size <= settings.DETECTION_INTERACTIVE_MAX_IMAGES:
+        return settings.DETECTION_INTERACTIVE_QUEUE
+    return settings.DETECTION_BULK_QUEUE
+
+
+def get_active_job(ml_model, kind):
+    """Задача данного типа, которая стоит в очереди или выполняется для модели"""
+    return Job.objects.filter(ml_model=ml_model, kind=kind, status__in=['queued', 'running']).first()
+
+
+def _fair_share_order(queued_jobs, running_by_user):
+    """
+    Порядок запуска задач из очереди.
+
+    Следующей берется задача пользователя с наименьшим числом выполняемых (и уже
+    выбранных в этом порядке) задач; внутри пользователя - по приоритету, затем по
+    времени постановки. Так один пользователь не может занять очередь целиком.
+    """
+    jobs_by_user = defaultdict(deque)
+    for job in sorted(queued_jobs, key=lambda job: (-job.priority, job.created_at)):
+        jobs_by_user[job.user_id].append(job)
+
+    load = {user_id: running_by_user.get(user_id, 0) for user_id in jobs_by_user}
+    ordered = []
+    while jobs_by_user:
+        user_id = min(
+            jobs_by_user,
+            key=lambda user_id: (load[user_id], -jobs_by_user[user_id][0].priority,
+                                 jobs_by_user[user_id][0].created_at)
+        )
+        ordered.append(jobs_by_user[user_id].popleft())
+        load[user_id] += 1
+        if not jobs_by_user[user_id]:
+            del jobs_by_user[user_id]
+
+    return ordered
+
+
+def _start_job(job):
+    """Отправка задачи в Celery после фиксации транзакции"""
+    job.task_id = uuid()
+    job.status = 'running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['task_id', 'status', 'started_at'])
+
+    if job.kind == 'train':
+        MLModel.objects.filter(id=job.ml_model_id).update(task_id=job.task_id)
+
+    kwargs = dict(job.params, model_id=job.ml_model_id)
+    task_id, task_name, queue = job.task_id, JOB_TASKS[job.kind], job.queue
+    transaction.on_commit(lambda: current_app.send_task(task_name, kwargs=kwargs, task_id=task_id, queue=queue))
+
+
+def dispatch_jobs():
+    """Запуск задач из очереди в пределах глобальных и пользовательских лимитов каждой очереди Celery"""
+    started = []
+    with transaction.atomic():
+        # Блокировка строк сериализует планировщики в веб-процессах и воркерах
+        jobs = list(Job.objects.select_for_update().filter(status__in=['queued', 'running']))
+
+        for queue, limits in settings.JOB_CONCURRENCY.items():
+            running = [job for job in jobs if job.queue == queue and job.status == 'running']
+            queued = [job for job in jobs if job.queue == queue and job.status == 'queued']
+            running_by_user = Counter(job.user_id for job in running)
+            running_count = len(running)
+
+            for job in _fair_share_order(queued, running_by_user):
+                if running_count >= limits['global']:
+                    break
+                if running_by_user[job.user_id] >= limits['user']:
+                    continue
+                _start_job(job)
+                running_count += 1
+                running_by_user[job.user_id] += 1
+                started.append(job.id)
+
+    return started
+
+
+def get_queue_position(job):
+    """Позиция задачи в очереди (1 - будет запущена следующей) или None, если она не в очереди"""
+    if job.status != 'queued':
+        return None
+
+    jobs = list(Job.objects.filter(queue=job.queue, status__in=['queued', 'running']))
+    running_by_user = Counter(other.user_id for other in jobs if other.status == 'running')
+    queued = [other for other in jobs if other.status == 'queued']
+    for position, other in enumerate(_fair_share_order(queued, running_by_user), start=1):
+        if other.id == job.id:
+            return position
+    return None
+
+
+def finish_job(task_id, succeeded):
+    """Завершение задачи планировщика по ID задачи Celery и запуск следующих"""
+    jobs = Job.objects.filter(task_id=task_id, status='running')
+    finished_at = timezone.now()
+    updated = jobs.filter(cancel_requested=True).update(status='cancelled', finished_at=finished_at)
+    updated += jobs.update(status='done' if succeeded else 'error', finished_at=finished_at)
+    if updated:
+        dispatch_jobs()
+
+
+def cancel_job(job):
+    """
+    Отмена задачи.
+
+    Задача из очереди снимается сразу. Для выполняемой выставляется флаг
+    cancel_requested, который задача проверяет между батчами/эпохами и
+    останавливается сама; если воркер еще не взял задачу из брокера, она
+    отзывается (revoke) и не будет запущена. Возвращает обновленную задачу.
+    """
+    revoke_task_id = None
+    with transaction.atomic():
+        job = Job.objects.select_for_update().get(id=job.id)
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'finished_at'])
+            if job.kind == 'train':
+                restore_model_status(job.ml_model, "Обучение отменено до запуска")
+        elif job.status == 'running' and not job.cancel_requested:
+            job.cancel_requested = True
+            job.save(update_fields=['cancel_requested'])
+            revoke_task_id = job.task_id
+
+    if revoke_task_id:
+        current_app.control.revoke(revoke_task_id)
+    return job
+
+
+def is_cancel_requested(task_id):
+    """Запрошена ли отмена задачи планировщика, выполняемой задачей Celery task_id"""
+    return Job.objects.filter(task_id=task_id, cancel_requested=True).exists()
+
+
+def restore_model_status(ml_model, message):
+    """Статус модели после отмены обучения: прежние веса, если они есть, остаются рабочими"""
+    MLModel.objects.filter(id=ml_model.id).update(
+        status='trained' if ml_model.model_file else 'not_trained',
+        training_log=message,
+    )
+
+
+def reap_finished_jobs(live_task_ids=None):
+    """
+    Закрытие задач, чье завершение не было отмечено сигналом, чтобы снять блокировку модели.
+
+    live_task_ids - ID задач, которые сейчас выполняют или зарезервировали воркеры;
+    детекция в состоянии STARTED вне этого множества считается потерянной при сбое воркера.
+    Прерванные обучения не закрываются: их возобновляет reconcile_training_jobs.
+    """
+    for job in Job.objects.filter(status='running').exclude(task_id=None):
+        result = AsyncResult(job.task_id)
+        state = result.state
+        if state in ('SUCCESS', 'REVOKED'):
+            finish_job(job.task_id, _task_succeeded(state, result.result))
+        elif job.kind != 'train' and state == 'FAILURE':
+            finish_job(job.task_id, False)
+        elif (job.kind != 'train' and state == 'STARTED'
+              and live_task_ids is not None and job.task_id not in live_task_ids):
+            print(f"Задача {job.task_id} потеряна воркером, снимаем блокировку модели {job.ml_model_id}")
+            finish_job(job.task_id, False)
+
+
+def _task_succeeded(state, retval):
+    """Успешна ли задача: обучение сообщает об ошибке, не выбрасывая исключение, результатом False"""
+    return state == 'SUCCESS' and retval is not False
+
+
+@task_postrun.connect
+def on_task_postrun(sender=None, task_id=None, state=None, retval=None, **kwargs):
+    if sender is not None and sender.name in JOB_TASKS.values():
+        finish_job(task_id, _task_succeeded(state, retval))
+
+
+@task_revoked.connect
+def on_task_revoked(sender=None, request=None, **kwargs):
+    # Отозванная до запуска задача не проходит task_postrun
+    if sender is not None and sender.name in JOB_TASKS.values():
+        finish_job(request.id, False)
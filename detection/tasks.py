@@ -1,33 +1,80 @@
-from celery import shared_task
-from .models import MLModel, DetectionResult
-from .yolo_utils import YOLOTrainer, YOLODetector
+import subprocess
+from celery import shared_task, current_app
+from celery.result import AsyncResult
+from celery.utils import uuid
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from dataset.models import PDFFile
+from .models import MLModel, Job
+from .yolo_utils import (YOLOTrainer, YOLODetector, YOLOLowResFineTuner, YOLOPreviewTrainer,
+                         CancellationToken, JobCancelled)
+from .scheduler import (dispatch_jobs, reap_finished_jobs, finish_job, is_cancel_requested,
+                        restore_model_status)
 
 
-@shared_task
-def train_yolo_model(model_id):
+# Состояния задачи, при которых MLModel в статусе 'training' считается осиротевшей:
+# STARTED без активной задачи на воркерах - воркер перезапущен посреди обучения,
+# FAILURE - дочерний процесс убит (WorkerLostError) до обновления статуса модели
+ORPHANED_TASK_STATES = ('STARTED', 'FAILURE')
+
+
+def _get_cancellation(task):
+    """Токен отмены задачи: флаг cancel_requested задачи планировщика"""
+    task_id = task.request.id
+    return CancellationToken(lambda: is_cancel_requested(task_id))
+
+
+@shared_task(bind=True, acks_late=True, soft_time_limit=settings.TRAINING_MAX_HOURS * 3600)
+def train_yolo_model(self, model_id, resume=False):
     """Задача Celery для обучения YOLO модели без отслеживания прогресса"""
     try:
         ml_model = MLModel.objects.get(id=model_id)
+        if ml_model.task_id and ml_model.task_id != self.request.id:
+            # Обучение уже перезапущено сверкой под новым ID - повторно доставленную старую задачу пропускаем
+            print(f"Задача {self.request.id} устарела для модели {model_id}, пропускаем")
+            return False
+        trainer = YOLOTrainer(ml_model)
+        trainer.task_id = self.request.id
+        if not resume and ml_model.status == 'training' and trainer.get_checkpoint_owner() == self.request.id:
+            # Повторная доставка той же задачи после гибели воркера (acks_late) - продолжаем с ее чекпоинта;
+            # чекпоинт другого (например, упавшего ранее) запуска не подхватывается
+            resume = True
+
         ml_model.status = 'training'
-        ml_model.training_log = "Модель обучается... Это может занять несколько минут."
+        if resume:
+            ml_model.training_log = "Обучение возобновлено с последнего чекпоинта после перезапуска воркера."
+        else:
+            ml_model.training_log = "Модель обучается... Это может занять несколько минут."
         ml_model.save()
 
         # Обучаем модель
-        trainer = YOLOTrainer(ml_model)
-        success = trainer.train_model()
+        trainer.cancellation = _get_cancellation(self)
+        success = trainer.train_model(resume=resume)
 
         # Обновляем статус модели
         ml_model.refresh_from_db()
         if success:
             ml_model.status = 'trained'
+            ml_model.trained_at = timezone.now()
             ml_model.training_log = "Модель успешно обучена!"
+            if ml_model.base_model_id:
+                ml_model.training_log += f" Дообучена от модели «{ml_model.base_model.name}»."
             ml_model.save()
+
+            if ml_model.compress_after_training:
+                compress_yolo_model.delay(ml_model.id)
         else:
             ml_model.status = 'error'
             ml_model.training_log = "Ошибка обучения модели"
             ml_model.save()
 
-        return True
+        # False отмечает задачу планировщика ошибкой (см. scheduler.on_task_postrun)
+        return success
+
+    except JobCancelled:
+        restore_model_status(MLModel.objects.get(id=model_id), "Обучение отменено пользователем")
+        return False
 
     except Exception as e:
         # Обновляем статус модели в случае ошибки
@@ -41,18 +88,185 @@ def train_yolo_model(model_id):
         raise e
 
 
+@shared_task(acks_late=True)
+def preview_train_yolo_model(model_id):
+    """Задача Celery для быстрой пробной тренировки (веса модели не изменяются)"""
+    ml_model = MLModel.objects.get(id=model_id)
+    try:
+        metrics = YOLOPreviewTrainer(ml_model).run_preview()
+        # update() вместо save(): строка модели может параллельно меняться основным обучением
+        MLModel.objects.filter(id=model_id).update(preview_status='done', preview_metrics=metrics)
+        return metrics
+
+    except Exception as e:
+        MLModel.objects.filter(id=model_id).update(preview_status='error', preview_metrics={'error': str(e)})
+        raise e
+
+
+@shared_task(bind=True, soft_time_limit=settings.TRAINING_MAX_HOURS * 3600)
+def compress_yolo_model(self, model_id):
+    """Задача Celery для получения облегченной версии обученной модели (см. YOLOLowResFineTuner)"""
+    source = MLModel.objects.get(id=model_id)
+    compressed = MLModel.objects.create(
+        dataset=source.dataset,
+        name=f"{source.name} (сжатая)",
+        description=f"Дообучение модели «{source.name}» при пониженном imgsz={settings.COMPRESSION_IMGSZ}",
+        model_type=source.model_type,
+        parent_model=source,
+        # Сжатая версия учится на тех же данных, что и исходная модель
+        snapshot=source.snapshot,
+        compression='lowres',
+        training_mode='finetune',
+        img_size=settings.COMPRESSION_IMGSZ,
+        status='training',
+        # По task_id сверка обучений видит, что модель занята задачей сжатия
+        task_id=self.request.id,
+        training_log="Сжатие модели... Это может занять несколько минут.",
+    )
+
+    try:
+        success = YOLOLowResFineTuner(compressed).compress()
+
+        compressed.refresh_from_db()
+        if success:
+            comparison = compressed.training_profile['compression']
+            compressed.status = 'trained'
+            compressed.trained_at = timezone.now()
+            compressed.training_log = (
+                f"Сжатая модель готова: mAP50 {compressed.accuracy:.3f} против {comparison['source_accuracy']:.3f}, "
+                f"задержка {compressed.latency_ms or 0:.1f} мс против {comparison['source_latency_ms'] or 0:.1f} мс"
+            )
+        else:
+            compressed.status = 'error'
+            compressed.training_log = "Ошибка сжатия модели"
+        compressed.save()
+
+        return {'compressed_id': compressed.id, 'success': success}
+
+    except Exception as e:
+        compressed.status = 'error'
+        compressed.training_log = f"Ошибка: {str(e)}"
+        compressed.save()
+        raise e
+
+
+@shared_task
+def train_yolo_ddp_node(params_path, metrics_path, nproc, nnodes, node_rank):
+    """Запуск процессов DDP-обучения на дополнительном узле (node_rank > 0)"""
+    subprocess.run(
+        YOLOTrainer.build_ddp_command(params_path, metrics_path, nproc, nnodes, node_rank),
+        cwd=settings.BASE_DIR, check=True,
+    )
+    return {'node_rank': node_rank}
+
+
+def _get_live_task_ids():
+    """ID задач, которые выполняют или зарезервировали воркеры; None, если воркеры не ответили"""
+    inspector = current_app.control.inspect()
+    active = inspector.active()
+    if active is None:
+        return None
+
+    reserved = inspector.reserved() or {}
+    return {
+        task['id']
+        for worker_tasks in list(active.values()) + list(reserved.values())
+        for task in worker_tasks
+    }
+
+
+@shared_task
+def reconcile_training_jobs():
+    """Поиск обучений, потерянных при перезапуске воркера, и их возобновление с last.pt"""
+    live_task_ids = _get_live_task_ids()
+    if live_task_ids is None:
+        print("Воркеры не ответили, сверка задач обучения пропущена")
+        return {'resumed': [], 'failed': []}
+
+    resumed, failed = [], []
+    for ml_model in MLModel.objects.filter(status='training'):
+        if ml_model.task_id in live_task_ids:
+            continue
+        if ml_model.task_id and AsyncResult(ml_model.task_id).state not in ORPHANED_TASK_STATES:
+            continue
+
+        if ml_model.compression:
+            # Сжатие не возобновляется обучением: сжатая модель без живой задачи сжатия - ошибка;
+            # без task_id (созданную до его записи) модель не трогаем
+            if ml_model.task_id:
+                ml_model.status = 'error'
+                ml_model.training_log = "Ошибка: сжатие прервано перезапуском воркера"
+                ml_model.save()
+                failed.append(ml_model.id)
+            continue
+
+        if ml_model.task_id and is_cancel_requested(ml_model.task_id):
+            # Отмененное обучение не возобновляется
+            restore_model_status(ml_model, "Обучение отменено пользователем")
+            finish_job(ml_model.task_id, False)
+            continue
+
+        if ml_model.resume_count >= settings.TRAINING_MAX_RESUMES:
+            ml_model.status = 'error'
+            ml_model.training_log = (f"Ошибка: обучение прерывалось {ml_model.resume_count} раз, "
+                                     f"автоматическое возобновление остановлено")
+            ml_model.save()
+            finish_job(ml_model.task_id, False)
+            failed.append(ml_model.id)
+            continue
+
+        print(f"Найдено осиротевшее обучение модели {ml_model.id}, возобновляем")
+        # ID записывается до отправки, как в scheduler._start_job: иначе новая задача
+        # может стартовать раньше сохранения и принять себя за устаревшую
+        task_id = uuid()
+        with transaction.atomic():
+            # Задача планировщика продолжает отслеживаться по новому ID
+            Job.objects.filter(task_id=ml_model.task_id, status='running').update(task_id=task_id)
+            ml_model.task_id = task_id
+            ml_model.resume_count += 1
+            ml_model.save()
+            kwargs = {'model_id': ml_model.id, 'resume': True}
+            transaction.on_commit(lambda kwargs=kwargs, task_id=task_id: train_yolo_model.apply_async(
+                kwargs=kwargs, task_id=task_id, queue=settings.TRAINING_QUEUE
+            ))
+        resumed.append(ml_model.id)
+
+    return {'resumed': resumed, 'failed': failed}
+
+
 @shared_task
-def run_detection_task(model_id, confidence=0.25):
-    """Задача Celery для запуска детекции без отслеживания прогресса"""
+def dispatch_scheduled_jobs():
+    """Периодический запуск задач планировщика на случай пропущенных сигналов завершения"""
+    reap_finished_jobs(_get_live_task_ids())
+    return {'started': dispatch_jobs()}
+
+
+@shared_task(bind=True, acks_late=True)
+def run_detection_task(self, model_id, confidence=0.25, pdf_id=None, keep_pages=None):
+    """
+    Задача Celery для запуска детекции без отслеживания прогресса.
+
+    С pdf_id детекция идет напрямую по страницам PDF (YOLODetector.detect_pdf),
+    keep_pages - номера страниц, которые сохраняются и без найденных объектов.
+    """
     try:
         ml_model = MLModel.objects.get(id=model_id)
 
-        # Удаляем старые результаты
-        DetectionResult.objects.filter(ml_model=ml_model).delete()
-
-        # Запускаем детекцию
+        # Запускаем детекцию; старые результаты заменяются только после ее завершения
         detector = YOLODetector(ml_model)
-        detection_count = detector.detect_dataset(confidence)
+        try:
+            if pdf_id:
+                pdf_file = PDFFile.objects.get(id=pdf_id, dataset=ml_model.dataset)
+                stats = detector.detect_pdf(pdf_file, confidence, keep_pages=keep_pages,
+                                            cancellation=_get_cancellation(self))
+                return dict(stats, status='Детекция по PDF завершена!', model_id=ml_model.id, pdf_id=pdf_id)
+
+            detection_count = detector.detect_dataset(confidence, cancellation=_get_cancellation(self))
+        except JobCancelled:
+            return {
+                'status': 'Детекция отменена, прежние результаты сохранены',
+                'model_id': ml_model.id
+            }
 
         return {
             'status': 'Детекция завершена!',
@@ -1,3 +1,300 @@
-from django.test import TestCase
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from celery import current_app
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from dataset.models import Dataset, PDFFile
+from users.models import CustomUser
+from .autoscaler import RUNTIME_KEY, QueueAutoscaler, get_broker_client, record_task_runtime
+from .models import Job, MLModel
+from .scheduler import JOB_TASKS, JobConflict, _fair_share_order, dispatch_jobs, on_task_postrun, submit_job
 
-# Create your tests here.
+
+class FakeRedis:
+    """Заглушка Redis: списки в памяти и только те команды, что нужны автоскейлеру"""
+
+    def __init__(self, lists=None):
+        self.lists = {key: list(values) for key, values in (lists or {}).items()}
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def lrange(self, key, start, end):
+        values = self.lists.get(key, [])
+        return values[start:] if end == -1 else values[start:end + 1]
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, str(value).encode())
+
+    def ltrim(self, key, start, end):
+        self.lists[key] = self.lists.get(key, [])[start:end + 1]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args) for name, args in self.commands]
+
+
+class FakeActuator:
+    """Исполнитель без Celery: фиксированное состояние воркеров и журнал изменений пулов"""
+
+    def __init__(self, state):
+        self.state = state
+        self.resizes = []
+
+    def get_state(self, queues):
+        return {queue: self.state.get(queue, {'workers': {}, 'active': 0}) for queue in queues}
+
+    def resize(self, workers, delta):
+        self.resizes.append((dict(workers), delta))
+
+
+class QueueAutoscalerTests(TestCase):
+    queues = {'detection_bulk': {'min': 1, 'max': 4}}
+
+    def make_autoscaler(self, client, actuator, **kwargs):
+        options = dict(queues=self.queues, target_latency=60, default_runtime=30, scale_down_checks=3)
+        options.update(kwargs)
+        return QueueAutoscaler(client, actuator, **options)
+
+    def test_scales_up_by_backlog(self):
+        # 4 задачи по 30 с за 60 с - нужно 2 процесса сверх выполняемой задачи
+        client = FakeRedis({'detection_bulk': [b'task'] * 4})
+        actuator = FakeActuator({'detection_bulk': {'workers': {'w1': 1}, 'active': 1}})
+
+        decision, = self.make_autoscaler(client, actuator).step()
+
+        self.assertEqual(decision['desired'], 3)
+        self.assertEqual(decision['target'], 3)
+        self.assertEqual(actuator.resizes, [({'w1': 1}, 2)])
+
+    def test_desired_concurrency_respects_bounds(self):
+        client = FakeRedis({'detection_bulk': [b'task'] * 100})
+        actuator = FakeActuator({'detection_bulk': {'workers': {'w1': 2}, 'active': 2}})
+
+        decision, = self.make_autoscaler(client, actuator).step()
+
+        self.assertEqual(decision['target'], 4)
+        self.assertEqual(actuator.resizes, [({'w1': 2}, 2)])
+
+    def test_uses_recorded_runtimes(self):
+        client = FakeRedis({'detection_bulk': [b'task'] * 2})
+        for seconds in (120, 180):
+            record_task_runtime(client, 'detection_bulk', seconds)
+        actuator = FakeActuator({'detection_bulk': {'workers': {'w1': 1}, 'active': 0}})
+
+        decision, = self.make_autoscaler(client, actuator).step()
+
+        self.assertEqual(decision['runtime'], 150.0)
+        # 2 задачи по 150 с за 60 с - 5 процессов, но не больше max
+        self.assertEqual(decision['target'], 4)
+
+    def test_scale_down_after_consecutive_checks(self):
+        client = FakeRedis()
+        actuator = FakeActuator({'detection_bulk': {'workers': {'w1': 3}, 'active': 0}})
+        autoscaler = self.make_autoscaler(client, actuator)
+
+        for _ in range(2):
+            decision, = autoscaler.step()
+            self.assertEqual(decision['target'], 3)
+        self.assertEqual(actuator.resizes, [])
+
+        decision, = autoscaler.step()
+        self.assertEqual(decision['target'], 2)
+        self.assertEqual(actuator.resizes, [({'w1': 3}, -1)])
+
+    def test_backlog_resets_scale_down_counter(self):
+        actuator = FakeActuator({'detection_bulk': {'workers': {'w1': 2}, 'active': 0}})
+        client = FakeRedis()
+        autoscaler = self.make_autoscaler(client, actuator)
+
+        autoscaler.step()
+        autoscaler.step()
+        client.lists['detection_bulk'] = [b'task'] * 4
+        autoscaler.step()
+        client.lists['detection_bulk'] = []
+        autoscaler.step()
+        autoscaler.step()
+
+        # Очередь на третьей проверке обнуляет счетчик: до уменьшения снова нужно 3 проверки подряд
+        self.assertEqual(actuator.resizes, [])
+        autoscaler.step()
+        self.assertEqual(actuator.resizes, [({'w1': 2}, -1)])
+
+    def test_counts_jobs_held_by_scheduler(self):
+        # Задачи сверх JOB_CONCURRENCY ждут в таблице Job, а не в брокере, но тоже требуют процессов
+        user = CustomUser.objects.create_user(username='user', password='password')
+        dataset = Dataset.objects.create(name='Датасет', user=user)
+        for name in ('first', 'second'):
+            ml_model = MLModel.objects.create(name=name, dataset=dataset)
+            Job.objects.create(user=user, ml_model=ml_model, kind='detect', queue='detection_bulk')
+        client = FakeRedis({'detection_bulk': [b'task'] * 2})
+        actuator = FakeActuator({'detection_bulk': {'workers': {'w1': 1}, 'active': 1}})
+
+        decision, = self.make_autoscaler(client, actuator).step()
+
+        self.assertEqual(decision['depth'], 4)
+        self.assertEqual(decision['target'], 3)
+
+    def test_dry_run_and_queues_without_workers(self):
+        client = FakeRedis({'detection_bulk': [b'task'] * 4, 'reports': [b'task']})
+        actuator = FakeActuator({'detection_bulk': {'workers': {'w1': 1}, 'active': 0}})
+        queues = dict(self.queues, reports={'min': 1, 'max': 2})
+
+        decisions = self.make_autoscaler(client, actuator, queues=queues).step(dry_run=True)
+
+        self.assertEqual([decision['queue'] for decision in decisions], ['detection_bulk'])
+        self.assertEqual(decisions[0]['target'], 2)
+        self.assertEqual(actuator.resizes, [])
+
+    def test_runtime_samples_are_capped(self):
+        client = FakeRedis()
+        for seconds in range(150):
+            record_task_runtime(client, 'detection_bulk', seconds)
+
+        samples = client.lrange(RUNTIME_KEY.format(queue='detection_bulk'), 0, -1)
+        self.assertEqual(len(samples), 100)
+        self.assertEqual(float(samples[0]), 149)
+
+    def test_broker_client_follows_celery_broker(self):
+        # Адрес брокера берется из конфигурации Celery, куда попадает и переменная окружения CELERY_BROKER_URL
+        with mock.patch('detection.autoscaler._broker_client', None), \
+                mock.patch('redis.Redis.from_url') as from_url:
+            get_broker_client()
+        from_url.assert_called_once_with(current_app.conf.broker_url)
+
+
+class FairShareOrderTests(SimpleTestCase):
+    def make_job(self, user_id, minutes, priority=0):
+        created_at = timezone.now() + timedelta(minutes=minutes)
+        return SimpleNamespace(id=f'{user_id}-{minutes}', user_id=user_id, priority=priority, created_at=created_at)
+
+    def test_alternates_users(self):
+        jobs = [self.make_job(1, 0), self.make_job(1, 1), self.make_job(2, 2), self.make_job(2, 3)]
+
+        ordered = _fair_share_order(jobs, {})
+
+        self.assertEqual([job.id for job in ordered], ['1-0', '2-2', '1-1', '2-3'])
+
+    def test_running_jobs_count_towards_share(self):
+        jobs = [self.make_job(1, 0), self.make_job(2, 1)]
+
+        ordered = _fair_share_order(jobs, {1: 2})
+
+        self.assertEqual([job.id for job in ordered], ['2-1', '1-0'])
+
+    def test_priority_within_user(self):
+        jobs = [self.make_job(1, 0), self.make_job(1, 1, priority=1)]
+
+        ordered = _fair_share_order(jobs, {})
+
+        self.assertEqual([job.id for job in ordered], ['1-1', '1-0'])
+
+
+@override_settings(JOB_CONCURRENCY={
+    'training': {'global': 1, 'user': 1},
+    'detection_bulk': {'global': 2, 'user': 1},
+})
+class DispatchJobsTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(username='alice', password='password')
+        self.bob = CustomUser.objects.create_user(username='bob', password='password')
+        self.dataset = Dataset.objects.create(name='Датасет', user=self.alice)
+
+    def make_job(self, user, kind='detect', queue='detection_bulk', **fields):
+        # Отдельная модель на задачу: активная задача одного типа на модель - одна
+        ml_model = MLModel.objects.create(name=f'model {MLModel.objects.count()}', dataset=self.dataset)
+        return Job.objects.create(user=user, ml_model=ml_model, kind=kind, queue=queue, **fields)
+
+    def test_respects_global_and_user_limits(self):
+        first, second = self.make_job(self.alice), self.make_job(self.alice)
+        other = self.make_job(self.bob)
+
+        started = dispatch_jobs()
+
+        self.assertCountEqual(started, [first.id, other.id])
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'queued')
+
+    def test_running_jobs_fill_limits(self):
+        self.make_job(self.alice, status='running', task_id='running-task')
+        queued_alice, queued_bob = self.make_job(self.alice), self.make_job(self.bob)
+
+        started = dispatch_jobs()
+
+        self.assertEqual(started, [queued_bob.id])
+        self.assertEqual(dispatch_jobs(), [])
+        queued_alice.refresh_from_db()
+        self.assertEqual(queued_alice.status, 'queued')
+
+    def test_sends_task_after_commit(self):
+        job = self.make_job(self.alice, kind='train', queue='training')
+
+        with mock.patch.object(current_app, 'send_task') as send_task, \
+                self.captureOnCommitCallbacks(execute=True):
+            dispatch_jobs()
+
+        job.refresh_from_db()
+        job.ml_model.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        self.assertEqual(job.ml_model.task_id, job.task_id)
+        send_task.assert_called_once_with(
+            JOB_TASKS['train'], kwargs={'model_id': job.ml_model_id}, task_id=job.task_id, queue='training'
+        )
+
+    def test_failed_training_result_fails_job(self):
+        # Обучение сообщает об ошибке результатом False, а не исключением
+        job = self.make_job(self.alice, kind='train', queue='training', status='running', task_id='train-task')
+
+        on_task_postrun(sender=SimpleNamespace(name=JOB_TASKS['train']), task_id='train-task',
+                        state='SUCCESS', retval=False)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'error')
+
+
+@override_settings(JOB_CONCURRENCY={})
+class SubmitJobTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='user', password='password')
+        self.dataset = Dataset.objects.create(name='Датасет', user=self.user)
+        self.ml_model = MLModel.objects.create(name='Модель', dataset=self.dataset)
+
+    def test_repeated_request_returns_active_job(self):
+        job, created = submit_job(self.user, self.ml_model, 'detect', {'confidence': 0.25})
+        again, created_again = submit_job(self.user, self.ml_model, 'detect', {'confidence': 0.25})
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.id, job.id)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_other_kind_gets_own_job(self):
+        submit_job(self.user, self.ml_model, 'detect')
+        _, created = submit_job(self.user, self.ml_model, 'train')
+
+        self.assertTrue(created)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_request_for_other_pdf_conflicts(self):
+        first = PDFFile.objects.create(dataset=self.dataset, pdf='pdfs/first.pdf', original_filename='first.pdf')
+        second = PDFFile.objects.create(dataset=self.dataset, pdf='pdfs/second.pdf', original_filename='second.pdf')
+        job, _ = submit_job(self.user, self.ml_model, 'detect', {'pdf_id': first.id})
+
+        with self.assertRaisesMessage(JobConflict, 'first.pdf'):
+            submit_job(self.user, self.ml_model, 'detect', {'pdf_id': second.id})
+        with self.assertRaises(JobConflict):
+            submit_job(self.user, self.ml_model, 'detect')
+
+        self.assertEqual(list(Job.objects.values_list('id', flat=True)), [job.id])
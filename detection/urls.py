@@ -22,6 +22,8 @@ urlpatterns = [
     path('dataset/<int:dataset_pk>/train/', views.train_model_from_list, name='train_model_from_list'),
     path('dataset/<int:dataset_pk>/models/<int:model_pk>/train/', views.train_model, name='train_model'),
     path('dataset/<int:dataset_pk>/models/<int:model_pk>/detect/', views.run_detection, name='run_detection'),
+    path('dataset/<int:dataset_pk>/models/<int:model_pk>/preview/', views.preview_model, name='preview_model'),
+    path('dataset/<int:dataset_pk>/models/<int:model_pk>/cancel/<str:kind>/', views.cancel_job, name='cancel_job'),
 
 
     path('dataset/<int:dataset_pk>/models/<int:model_pk>/results/', views.detection_results, name='detection_results'),
@@ -4,15 +4,20 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST, require_http_methods
-from django.db.models import Count, Avg, Max
-from dataset.models import Dataset, ImageFile
-from .models import Annotation, AnnotationSession, MLModel, DetectionResult
+from django.db.models import Count, Avg, Max, Q
+from dataset.models import Dataset, ImageFile, PDFFile
+from dataset.pdf_utils import parse_page_numbers
+from dataset.snapshots import get_training_snapshot, release_snapshot, retire_or_delete_annotation
+from .models import Annotation, AnnotationSession, MLModel, DetectionResult, Job
 from .forms import AnnotationForm, AnnotationSettingsForm
 from django.contrib import messages
+from django.conf import settings
 from django.db import models
 from .yolo_utils import  YOLODetector
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from .tasks import train_yolo_model
+from .tasks import preview_train_yolo_model
+from .scheduler import (submit_job, get_active_job, get_queue_position, cancel_job as cancel_scheduled_job,
+                        JobConflict)
 from celery.result import AsyncResult
 
 
@@ -47,7 +52,7 @@ def annotation_tool(request, dataset_pk, image_pk):
 
     # Получаем все изображения датасета с аннотациями
     images = dataset.imagefile_set.all().annotate(
-        annotation_count=Count('annotation')
+        annotation_count=Count('annotation', filter=Q(annotation__retired_at__isnull=True))
     ).order_by('uploaded_at')
 
     # Получаем аннотации для текущего изображения
@@ -114,7 +119,8 @@ def delete_annotation(request, annotation_pk):
     """Удаление аннотации"""
     annotation = get_object_or_404(Annotation, pk=annotation_pk, created_by=request.user)
     image_pk = annotation.image.pk
-    annotation.delete()
+    # Аннотация из снимка датасета остается в БД для обучения на этом снимке
+    retire_or_delete_annotation(annotation)
 
     # Проверяем, остались ли аннотации у изображения
     if not annotation.image.annotation_set.exists():
@@ -160,6 +166,36 @@ def annotation_progress(request, dataset_pk):
     })
 
 
+def _get_job_priority(request):
+    """Приоритет задачи планировщика из формы"""
+    try:
+        priority = int(request.POST.get('priority', 0))
+    except ValueError:
+        return 0
+    return priority if priority in dict(Job.PRIORITY_CHOICES) else 0
+
+
+def _get_training_snapshot(request, dataset, model_name):
+    """
+    Снимок датасета для обучения: выбранный в форме (snapshot_id) или снимок
+    текущего состояния (последний, если данные с него не менялись)
+    """
+    snapshot_id = request.POST.get('snapshot_id')
+    if snapshot_id:
+        return get_object_or_404(dataset.snapshots, pk=snapshot_id)
+    return get_training_snapshot(dataset, request.user, f'Обучение модели "{model_name}"')
+
+
+def _job_submitted_message(job, created, started_message):
+    """Сообщение пользователю о запуске задачи, ее позиции в очереди или уже активной задаче"""
+    if job.status == 'queued':
+        prefix = 'Задача поставлена в очередь' if created else 'Такая задача уже стоит в очереди'
+        return f'{prefix}, позиция: {get_queue_position(job)}. Она запустится, когда освободится место.'
+    if not created:
+        return 'Такая задача уже выполняется, повторный запуск не требуется.'
+    return started_message
+
+
 @login_required
 @require_POST
 def train_model(request, dataset_pk, model_pk):
@@ -173,10 +209,19 @@ def train_model(request, dataset_pk, model_pk):
         messages.error(request, f'Недостаточно размеченных изображений. Требуется минимум 3, размечено: {annotated_count}')
         return redirect('model_detail', dataset_pk=dataset.pk, model_pk=model.pk)
 
+    # Повторный запрос не меняет параметры уже запущенного обучения
+    active_job = get_active_job(model, 'train')
+    if active_job is not None:
+        messages.info(request, _job_submitted_message(active_job, False, ''))
+        return redirect('model_list', dataset_pk=dataset.pk)
+
     # Обновляем параметры модели если переданы
     epochs = request.POST.get('epochs')
     batch_size = request.POST.get('batch_size')
     img_size = request.POST.get('img_size')
+    training_mode = request.POST.get('training_mode')
+    time_budget = request.POST.get('time_budget')
+    ddp_processes = request.POST.get('ddp_processes')
 
     if epochs:
         model.epochs = int(epochs)
@@ -184,17 +229,27 @@ def train_model(request, dataset_pk, model_pk):
         model.batch_size = int(batch_size)
     if img_size:
         model.img_size = int(img_size)
-
-    model.status = 'training'
+    if training_mode in dict(MLModel.TRAINING_MODE_CHOICES):
+        model.training_mode = training_mode
+    if time_budget:
+        model.time_budget = int(time_budget) or None
+    if ddp_processes:
+        model.ddp_processes = max(1, int(ddp_processes))
+
+    # Обучение идет на снимке: правки разметки во время обучения на него не влияют
+    previous_snapshot = model.snapshot
+    model.snapshot = _get_training_snapshot(request, dataset, model.name)
+    model.status = 'queued'
+    model.resume_count = 0
     model.save()
+    if previous_snapshot != model.snapshot:
+        release_snapshot(previous_snapshot)
 
-    # Запускаем обучение через Celery
-    task = train_yolo_model.delay(model.id)
-
+    # Обучение запускается планировщиком с учетом лимитов одновременных задач
+    job, created = submit_job(request.user, model, 'train', priority=_get_job_priority(request))
 
-    model.save()
-
-    messages.success(request, f'Обучение модели "{model.name}" запущено! Это может занять несколько минут.')
+    messages.success(request, _job_submitted_message(
+        job, created, f'Обучение модели "{model.name}" запущено! Это может занять несколько минут.'))
     return redirect('model_list', dataset_pk=dataset.pk)
 
 def train_model_async(ml_model_id):
@@ -254,6 +309,12 @@ def train_model_from_list(request, dataset_pk):
     epochs = int(request.POST.get('epochs', 50))
     batch_size = int(request.POST.get('batch_size', 16))
     img_size = int(request.POST.get('img_size', 640))
+    training_mode = request.POST.get('training_mode', 'full')
+    if training_mode not in dict(MLModel.TRAINING_MODE_CHOICES):
+        training_mode = 'full'
+    time_budget = int(request.POST.get('time_budget') or 0) or None
+    ddp_processes = max(1, int(request.POST.get('ddp_processes') or 1))
+    compress_after_training = request.POST.get('compress_after_training') == 'on'
 
     model = MLModel.objects.create(
         dataset=dataset,
@@ -263,18 +324,47 @@ def train_model_from_list(request, dataset_pk):
         epochs=epochs,
         batch_size=batch_size,
         img_size=img_size,
-        status='training'
+        training_mode=training_mode,
+        time_budget=time_budget,
+        ddp_processes=ddp_processes,
+        compress_after_training=compress_after_training,
+        snapshot=_get_training_snapshot(request, dataset, name),
+        status='queued'
     )
 
-    # Запускаем обучение через Celery
-    task = train_yolo_model.delay(model.id)
-    model.task_id = task.id
-    model.save()
+    # Обучение запускается планировщиком с учетом лимитов одновременных задач
+    job, created = submit_job(request.user, model, 'train', priority=_get_job_priority(request))
 
-    messages.success(request, f'Модель "{model.name}" создана и обучение запущено! Это может занять несколько минут.')
+    messages.success(request, _job_submitted_message(
+        job, created, f'Модель "{model.name}" создана и обучение запущено! Это может занять несколько минут.'))
     return redirect('model_list', dataset_pk=dataset.pk)
 
 
+@login_required
+@require_POST
+def preview_model(request, dataset_pk, model_pk):
+    """Запуск быстрой пробной тренировки на части датасета через Celery"""
+    dataset = get_object_or_404(Dataset, pk=dataset_pk, user=request.user)
+    model = get_object_or_404(MLModel, pk=model_pk, dataset=dataset)
+
+    annotated_count = dataset.get_annotated_count()
+    if annotated_count < 3:
+        messages.error(request, f'Недостаточно размеченных изображений. Требуется минимум 3, размечено: {annotated_count}')
+        return redirect('model_detail', dataset_pk=dataset.pk, model_pk=model.pk)
+
+    # Условный update атомарно захватывает пробное обучение: из двух одновременных запросов проходит один
+    claimed = MLModel.objects.filter(id=model.id).exclude(preview_status='running').update(
+        preview_status='running', preview_metrics=None)
+    if not claimed:
+        messages.info(request, 'Пробное обучение уже выполняется.')
+        return redirect('model_detail', dataset_pk=dataset.pk, model_pk=model.pk)
+
+    preview_train_yolo_model.apply_async(args=(model.id,), queue=settings.PREVIEW_TRAINING_QUEUE)
+
+    messages.success(request, 'Пробное обучение запущено. Грубые метрики появятся через несколько минут.')
+    return redirect('model_detail', dataset_pk=dataset.pk, model_pk=model.pk)
+
+
 @login_required
 @require_POST
 def run_detection(request, dataset_pk, model_pk):
@@ -290,20 +380,39 @@ def run_detection(request, dataset_pk, model_pk):
 
     try:
         confidence = float(request.POST.get('confidence', 0.25))
+        params = {'confidence': confidence}
 
-        # Запускаем асинхронную задачу с правильным именем
-        from .tasks import run_detection_task
-        task = run_detection_task.delay(model.id, confidence)
+        # Детекция по PDF: страницы подаются в модель напрямую, сохраняются только страницы с объектами
+        if request.POST.get('pdf_id'):
+            pdf_file = get_object_or_404(PDFFile, pk=request.POST['pdf_id'], dataset=dataset)
+            params['pdf_id'] = pdf_file.id
+            params['keep_pages'] = sorted(parse_page_numbers(request.POST.get('keep_pages'), pdf_file.page_count))
+
+        # Детекция запускается планировщиком с учетом лимитов одновременных задач
+        # Повторный запрос присоединяется к уже активной детекции этой модели того же объекта
+        job, created = submit_job(request.user, model, 'detect', params,
+                                  priority=_get_job_priority(request))
+        message = _job_submitted_message(job, created, 'Детекция запущена. Это может занять несколько минут.')
 
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({
                 'success': True,
-                'message': 'Детекция запущена. Это может занять несколько минут.'
+                'message': message,
+                'job_id': job.id,
+                'job_status': job.status,
+                'duplicate': not created,
+                'queue_position': get_queue_position(job),
             })
         else:
-            messages.info(request, 'Детекция запущена. Это может занять несколько минут.')
+            messages.info(request, message)
             return redirect('model_detail', dataset_pk=dataset.pk, model_pk=model.pk)
 
+    except JobConflict as e:
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return JsonResponse({'success': False, 'error': str(e)})
+        messages.warning(request, str(e))
+        return redirect('model_detail', dataset_pk=dataset.pk, model_pk=model.pk)
+
     except Exception as e:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'success': False, 'error': f'Ошибка при запуске детекции: {str(e)}'})
@@ -311,6 +420,35 @@ def run_detection(request, dataset_pk, model_pk):
         return redirect('model_detail', dataset_pk=dataset.pk, model_pk=model.pk)
 
 
+@login_required
+@require_POST
+def cancel_job(request, dataset_pk, model_pk, kind):
+    """Отмена обучения или детекции модели (kind: train / detect)"""
+    dataset = get_object_or_404(Dataset, pk=dataset_pk, user=request.user)
+    model = get_object_or_404(MLModel, pk=model_pk, dataset=dataset)
+
+    job = get_active_job(model, kind)
+    if job is None:
+        message = 'Нет активной задачи для отмены.'
+        success = False
+    else:
+        job = cancel_scheduled_job(job)
+        success = True
+        if job.status == 'cancelled':
+            message = 'Задача снята с очереди.'
+        else:
+            message = 'Отмена запрошена. Задача остановится после текущего батча и освободит воркер.'
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': success, 'message': message, 'job_status': job.status if job else None})
+
+    if success:
+        messages.info(request, message)
+    else:
+        messages.warning(request, message)
+    return redirect('model_detail', dataset_pk=dataset.pk, model_pk=model.pk)
+
+
 @login_required
 def detection_results(request, dataset_pk, model_pk):
     """Результаты детекции для датасета и модели"""
@@ -384,19 +522,24 @@ def model_list(request, dataset_pk):
     # Добавляем цвет статуса для отображения в шаблоне
     status_colors = {
         'not_trained': 'secondary',
+        'queued': 'info',
         'training': 'warning',
         'trained': 'success',
         'error': 'danger'
     }
 
+    queued_jobs = {job.ml_model_id: job for job in Job.objects.filter(ml_model__dataset=dataset, status='queued')}
+
     for model in ml_models:
         model.status_color = status_colors.get(model.status, 'secondary')
+        model.queue_position = get_queue_position(queued_jobs[model.id]) if model.id in queued_jobs else None
 
     context = {
         'dataset': dataset,
         'ml_models': ml_models,
         'can_train': can_train,
         'annotated_count': annotated_count,
+        'snapshots': dataset.snapshots.all(),
     }
     return render(request, 'detection/model_list.html', context)
 
@@ -413,6 +556,12 @@ def create_model(request, dataset_pk):
     epochs = int(request.POST.get('epochs', 50))
     batch_size = int(request.POST.get('batch_size', 16))
     img_size = int(request.POST.get('img_size', 640))
+    training_mode = request.POST.get('training_mode', 'full')
+    if training_mode not in dict(MLModel.TRAINING_MODE_CHOICES):
+        training_mode = 'full'
+    time_budget = int(request.POST.get('time_budget') or 0) or None
+    ddp_processes = max(1, int(request.POST.get('ddp_processes') or 1))
+    compress_after_training = request.POST.get('compress_after_training') == 'on'
 
     if not name:
         messages.error(request, 'Название модели обязательно')
@@ -426,6 +575,10 @@ def create_model(request, dataset_pk):
         epochs=epochs,
         batch_size=batch_size,
         img_size=img_size,
+        training_mode=training_mode,
+        time_budget=time_budget,
+        ddp_processes=ddp_processes,
+        compress_after_training=compress_after_training,
         status='not_trained'
     )
 
@@ -444,7 +597,10 @@ def delete_model(request, dataset_pk, model_pk):
     DetectionResult.objects.filter(ml_model=model).delete()
 
     model_name = model.name
+    snapshot = model.snapshot
     model.delete()
+    # Автоматический снимок без моделей больше не нужен
+    release_snapshot(snapshot)
 
     messages.success(request, f'Модель "{model_name}" успешно удалена!')
     return redirect('model_list', dataset_pk=dataset.pk)
@@ -477,14 +633,16 @@ def model_detail(request, dataset_pk, model_pk):
         ml_model=model
     ).select_related('image').order_by('-created_at')[:10]
 
-    # Проверяем, есть ли активные задачи детекции для этой модели
-    # (это упрощенная версия - в реальном приложении нужно хранить task_id в модели)
-    detection_in_progress = False
+    # Активные задачи модели в планировщике
+    active_jobs = {job.kind: job for job in Job.objects.filter(ml_model=model, status__in=['queued', 'running'])}
+    detection_job = active_jobs.get('detect')
+    training_job = active_jobs.get('train')
+    detection_in_progress = detection_job is not None
     detection_completed = False
     detection_count = 0
 
     # Простая проверка: если есть детекции и модель обучена, считаем что детекция была
-    if model.status == 'trained' and detection_stats['total_detections'] > 0:
+    if not detection_in_progress and model.status == 'trained' and detection_stats['total_detections'] > 0:
         detection_completed = True
         detection_count = detection_stats['total_detections']
 
@@ -497,6 +655,11 @@ def model_detail(request, dataset_pk, model_pk):
         'detection_in_progress': detection_in_progress,
         'detection_completed': detection_completed,
         'detection_count': detection_count,
+        'detection_job': detection_job,
+        'training_job': training_job,
+        'detection_queue_position': get_queue_position(detection_job) if detection_job else None,
+        'training_queue_position': get_queue_position(training_job) if training_job else None,
+        'pdf_files': dataset.pdffile_set.filter(status='done'),
     }
     return render(request, 'detection/model_detail.html', context)
 
@@ -0,0 +1,133 @@
+import gc
+import psutil
+from celery import current_app
+from celery.signals import celeryd_init, celeryd_after_setup, worker_process_init, task_postrun
+from celery.worker.control import inspect_command
+from django.conf import settings
+from django.db import connections
+
+
+def get_rss_mb():
+    """Resident set size текущего процесса в МБ"""
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def get_memory_report(process=None):
+    """
+    Память процесса в МБ: RSS, USS (только его страницы), PSS и часть RSS,
+    общая с другими процессами (для дочерних процессов prefork - в основном
+    веса, загруженные родителем до fork)
+    """
+    process = process or psutil.Process()
+    info = process.memory_full_info()
+    to_mb = 1 / (1024 * 1024)
+    return {
+        'pid': process.pid,
+        'rss_mb': round(info.rss * to_mb, 1),
+        'uss_mb': round(info.uss * to_mb, 1),
+        'pss_mb': round(getattr(info, 'pss', 0) * to_mb, 1),
+        'shared_mb': round((info.rss - info.uss) * to_mb, 1),
+    }
+
+
+def _consumes_detection_queues(app=None):
+    # consume_from - очереди, выбранные через -Q (keys() - все объявленные); известны
+    # до fork и наследуются дочерними процессами
+    queues = set((app or current_app).amqp.queues.consume_from)
+    return bool(queues & {settings.DETECTION_BULK_QUEUE, settings.DETECTION_INTERACTIVE_QUEUE})
+
+
+@celeryd_init.connect
+def limit_detection_child_memory(sender=None, conf=None, options=None, **kwargs):
+    """
+    Лимит памяти процесса пула воркеров детекции (worker_max_memory_per_child, в КБ)
+    из WORKER_MAX_MEMORY_MB. Очереди берутся из -Q: сигнал приходит до чтения
+    настроек пула, и app.amqp.queues еще не заполнены.
+    """
+    queues = (options or {}).get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    if set(queues) & {settings.DETECTION_BULK_QUEUE, settings.DETECTION_INTERACTIVE_QUEUE}:
+        conf.worker_max_memory_per_child = settings.WORKER_MAX_MEMORY_MB * 1024
+
+
+@celeryd_after_setup.connect
+def preload_models_before_fork(sender=None, instance=None, **kwargs):
+    """
+    Загрузка горячих моделей детекции в главном процессе воркера до запуска пула.
+
+    Дочерние процессы prefork получают загруженные веса через fork и делят их
+    страницы памяти с родителем (copy-on-write), пока не пишут в них. Поэтому
+    прогон с fuse() выполняется здесь же, а объекты моделей замораживаются
+    для сборщика мусора: обход gc в дочерних процессах иначе трогает заголовки
+    объектов и копирует страницы.
+    """
+    if not settings.DETECTION_PRELOAD_MODELS or not _consumes_detection_queues(instance.app):
+        return
+    if not instance.pool_cls.__module__.endswith('prefork'):
+        return
+
+    import torch
+    from .yolo_utils import prime_detection_model_cache
+
+    # Пул потоков OpenMP, созданный до fork, может подвесить дочерние процессы,
+    # поэтому прогрев в родителе выполняется в один поток
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        primed = prime_detection_model_cache()
+    except Exception as e:
+        print(f"Не удалось загрузить модели детекции до fork: {e}")
+        return
+    finally:
+        torch.set_num_threads(num_threads)
+        connections.close_all()
+
+    gc.freeze()
+    print(f"Модели детекции загружены до fork: {primed}, RSS родителя {get_rss_mb():.0f} МБ")
+
+
+@worker_process_init.connect
+def prime_worker_model_cache(**kwargs):
+    """
+    Прогрев кэша моделей в новом процессе воркера детекции.
+
+    Процесс перезапускается Celery между задачами, когда RSS превышает
+    WORKER_MAX_MEMORY_MB (см. limit_detection_child_memory), и прогревается
+    до того, как начнет принимать задачи. Модели, загруженные родителем
+    до fork, уже лежат в кэше и повторно не читаются; холодная загрузка
+    укладывается в CELERY_WORKER_PROC_ALIVE_TIMEOUT.
+    """
+    if not _consumes_detection_queues():
+        return
+
+    from .yolo_utils import prime_detection_model_cache
+    try:
+        primed = prime_detection_model_cache()
+        report = get_memory_report()
+        print(f"Кэш моделей детекции прогрет: {primed}, RSS {report['rss_mb']} МБ, "
+              f"из них общих с родителем {report['shared_mb']} МБ")
+    except Exception as e:
+        print(f"Не удалось прогреть кэш моделей детекции: {e}")
+
+
+@task_postrun.connect
+def log_worker_memory(task_id=None, task=None, **kwargs):
+    # Лимит памяти на процесс задан только воркерам детекции
+    if not _consumes_detection_queues():
+        return
+    rss_mb = get_rss_mb()
+    if rss_mb > settings.WORKER_MAX_MEMORY_MB:
+        name = task.name if task is not None else task_id
+        print(f"RSS {rss_mb:.0f} МБ после задачи {name} выше {settings.WORKER_MAX_MEMORY_MB} МБ, "
+              f"процесс будет перезапущен перед следующей задачей")
+
+
+@inspect_command()
+def pool_memory(state, **kwargs):
+    """Память главного процесса воркера и процессов пула (celery inspect pool_memory)"""
+    parent = psutil.Process()
+    return {
+        'parent': get_memory_report(parent),
+        'children': [get_memory_report(child) for child in parent.children()],
+    }
@@ -1,26 +1,106 @@
 import os
+import sys
+import json
+import signal
+import socket
+import subprocess
 import yaml
+import psutil
+import torch
 from ultralytics import YOLO
+from celery import current_app
 from django.conf import settings
 from django.core.files import File
-from .models import Annotation, DetectionResult
+from django.db import transaction
+from .models import Annotation, DetectionResult, MLModel, Job
+from .worker_memory import get_rss_mb
+from dataset.pdf_utils import render_page_array, save_page_image
 from PIL import Image
+import fitz
 import shutil
 import random
+import math
+import time
+import uuid
+import glob
+import gc
+import numpy as np
+from collections import defaultdict, OrderedDict
+from types import SimpleNamespace
+
+
+class JobCancelled(Exception):
+    """Задача остановлена по запросу пользователя на границе батча или эпохи"""
+
+
+class CancellationToken:
+    """
+    Проверка запроса на отмену задачи.
+
+    should_stop - функция без аргументов (обычно запрос к БД); вызывается не чаще
+    раза в interval секунд, чтобы проверки на каждом батче не нагружали базу.
+    """
+
+    def __init__(self, should_stop=None, interval=5):
+        self.should_stop = should_stop
+        self.interval = interval
+        self._checked_at = None
+
+    def is_cancelled(self):
+        if self.should_stop is None:
+            return False
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.interval:
+            return False
+        self._checked_at = now
+        return bool(self.should_stop())
+
+    def check(self, message="Задача отменена пользователем"):
+        if self.is_cancelled():
+            raise JobCancelled(message)
 
 
 class YOLOTrainer:
+    # Режим бюджета времени: минимум эпох, ради которого стоит уменьшить imgsz,
+    # и нижняя граница размера изображения при уменьшении
+    TIME_BUDGET_MIN_EPOCHS = 10
+    TIME_BUDGET_MIN_IMGSZ = 320
+    # Файл в директории обучения с ID задачи Celery, которая пишет чекпоинты,
+    # и PID запущенного ею torchrun (JSON)
+    CHECKPOINT_OWNER_FILE = 'task_id'
+
     def __init__(self, ml_model):
         self.ml_model = ml_model
         self.dataset = ml_model.dataset
+        # Снимок датасета, на котором идет обучение; None - текущее состояние датасета
+        self.snapshot = ml_model.snapshot
         self.model = None
-
+        self.class_names = []
+        self.epochs_trained = None
+        self.started_at = None
+        self.ddp_stats = None
+        self.keep_dataset = False
+        self.cancellation = CancellationToken()
+        # ID задачи Celery, выполняющей обучение; записывается рядом с чекпоинтами
+        self.task_id = None
+
+    def get_images(self):
+        """Изображения для обучения: из снимка датасета или текущие"""
+        if self.snapshot:
+            return self.snapshot.get_images()
+        return self.dataset.imagefile_set.all()
+
+    def get_annotations(self):
+        """Аннотации для обучения: из снимка датасета или текущие"""
+        if self.snapshot:
+            return self.snapshot.get_annotations()
+        return Annotation.objects.filter(image__dataset=self.dataset)
 
     def debug_annotations(self):
         """Глубокая отладка аннотаций с учетом нормализованных координат"""
         print("=== ГЛУБОКАЯ ДИАГНОСТИКА АННОТАЦИЙ ===")
 
-        all_annotations = Annotation.objects.filter(image__dataset=self.dataset)
+        all_annotations = self.get_annotations()
         print(f"Всего аннотаций в БД: {all_annotations.count()}")
 
         if all_annotations.count() == 0:
@@ -45,8 +125,7 @@ class YOLOTrainer:
 
             # Получаем размеры изображения
             try:
-                with Image.open(ann.image.image.path) as img:
-                    img_width, img_height = img.size
+                img_width, img_height = ann.image.get_size()
                 print(f"  Размер изображения: {img_width}x{img_height}")
 
                 # Пересчитываем в пиксели для проверки
@@ -105,7 +184,7 @@ class YOLOTrainer:
     def prepare_yolo_dataset(self):
         """Подготовка данных в формате YOLO с учетом нормализованных координат"""
         try:
-            dataset_dir = os.path.join(settings.MEDIA_ROOT, 'yolo_datasets', f'dataset_{self.dataset.id}')
+            dataset_dir = self.get_dataset_dir()
             print(f"Создаем dataset в: {dataset_dir}")
 
             # Очищаем предыдущие данные
@@ -124,23 +203,15 @@ class YOLOTrainer:
                 print(f"Создана директория: {dir_path}")
 
             # Собираем все изображения с аннотациями
-            images_with_annotations = []
-            classes = set()
-
-            print("Сбор изображений с аннотациями...")
-            for image in self.dataset.imagefile_set.all():
-                annotations = Annotation.objects.filter(image=image)
-                if annotations.exists():
-                    images_with_annotations.append((image, annotations))
-                    for ann in annotations:
-                        classes.add(ann.label)
-                    print(f"  {image.original_filename}: {annotations.count()} аннотаций")
+            images_with_annotations = self._collect_images_with_annotations()
+            classes = {ann.label for _, annotations in images_with_annotations for ann in annotations}
 
             if not images_with_annotations:
                 raise ValueError("Не найдено ни одного изображения с аннотациями")
 
+            self.class_names = sorted(classes)
             print(f"Всего изображений с аннотаций: {len(images_with_annotations)}")
-            print(f"Классы: {sorted(classes)}")
+            print(f"Классы: {self.class_names}")
 
             # Разделяем на train/val
             random.shuffle(images_with_annotations)
@@ -152,6 +223,9 @@ class YOLOTrainer:
             if not val_images and train_images:
                 val_images = [train_images.pop()]
 
+            # Дополнительные обучающие примеры (например, псевдоразметка при сжатии модели)
+            train_images += self.get_extra_train_images(classes)
+
             print(f"Разделение: {len(train_images)} train, {len(val_images)} val")
 
             # Обрабатываем тренировочные данные
@@ -191,6 +265,25 @@ class YOLOTrainer:
                 shutil.rmtree(dataset_dir, ignore_errors=True)
             raise Exception(f"Ошибка подготовки данных YOLO: {str(e)}")
 
+    def _collect_images_with_annotations(self):
+        """Пары (изображение, аннотации) для всех размеченных изображений датасета"""
+        images_with_annotations = []
+
+        print("Сбор изображений с аннотациями...")
+        if self.snapshot:
+            print(f"Снимок датасета: {self.snapshot}")
+        for image in self.get_images():
+            annotations = self.get_annotations().filter(image=image)
+            if annotations.exists():
+                images_with_annotations.append((image, annotations))
+                print(f"  {image.original_filename}: {annotations.count()} аннотаций")
+
+        return images_with_annotations
+
+    def get_extra_train_images(self, classes):
+        """Дополнительные пары (изображение, аннотации) только для обучающей выборки"""
+        return []
+
     def _process_split_corrected(self, images_data, images_dir, labels_dir, classes, split_name):
         """Обработка с правильным учетом нормализованных координат"""
         total_annotations = 0
@@ -264,7 +357,42 @@ class YOLOTrainer:
         print(f"{split_name}: обработано {processed_images} изображений, {total_annotations} аннотаций")
         return {'images': processed_images, 'annotations': total_annotations}
 
-    def _get_training_config(self, num_images, num_classes):
+    def _find_warm_start_model(self):
+        """
+        Поиск последней успешно обученной модели датасета для дообучения.
+
+        Подходит модель, набор классов которой совпадает с текущим или является его
+        подмножеством (добавлены новые классы). Возвращает (модель, добавлены_ли_классы)
+        или (None, False), если подходящей модели нет.
+        """
+        candidates = MLModel.objects.filter(
+            dataset=self.dataset,
+            status='trained',
+            parent_model__isnull=True,
+        ).exclude(id=self.ml_model.id).order_by('-trained_at', '-created_at')
+
+        current_classes = set(self.class_names)
+        for candidate in candidates:
+            model_path = candidate.get_model_path()
+            if not model_path or not os.path.exists(model_path):
+                continue
+
+            try:
+                candidate_classes = set(YOLO(model_path).names.values())
+            except Exception as e:
+                print(f"Не удалось прочитать классы модели {candidate.id}: {e}")
+                continue
+
+            if candidate_classes == current_classes:
+                return candidate, False
+            if candidate_classes < current_classes:
+                return candidate, True
+
+            print(f"Модель {candidate.id} пропущена: набор классов не совпадает")
+
+        return None, False
+
+    def _get_training_config(self, num_images, num_classes, fine_tune=False, new_classes=False):
         """
         Определяет конфигурацию обучения в зависимости от объема данных и количества классов
 
@@ -302,6 +430,12 @@ class YOLOTrainer:
           - epochs: увеличить на 30-50%
           - lr0: можно уменьшить до 0.005 для стабильности
           - augment: обязательно True
+
+        ДООБУЧЕНИЕ ПРЕДЫДУЩЕЙ МОДЕЛИ (fine_tune=True):
+          - epochs: 25% от полного расписания (40%, если добавлены новые классы)
+          - lr0: 0.002 (веса уже близки к оптимуму)
+          - warmup_epochs: 1 (0, если классы не менялись)
+          - patience: вдвое меньше
         """
 
         # Базовые параметры
@@ -360,6 +494,18 @@ class YOLOTrainer:
             config['lr0'] = 0.005  # более низкая LR для стабильности
             config['patience'] = int(config['patience'] * 1.2)
 
+        # Дообучение: сокращенное расписание от весов предыдущей модели
+        if fine_tune:
+            epochs_factor = 0.4 if new_classes else 0.25
+            config.update({
+                'epochs': max(10, int(config['epochs'] * epochs_factor)),
+                'lr0': 0.002,
+                'warmup_epochs': 1 if new_classes else 0,
+                'patience': max(5, config['patience'] // 2),
+            })
+            if 'close_mosaic' in config:
+                config['close_mosaic'] = min(config['close_mosaic'], config['epochs'] // 2)
+
         print(f"⚙️  Конфигурация обучения для {num_images} изображений, {num_classes} классов:")
         print(f"   Epochs: {config['epochs']}")
         print(f"   Batch: {config['batch']}")
@@ -369,117 +515,879 @@ class YOLOTrainer:
 
         return config
 
-    def train_model(self):
-        """Обучение YOLO модели без отслеживания прогресса"""
-        try:
-            print("=== НАЧАЛО ПОДГОТОВКИ ДАННЫХ ===")
-
-            # Сначала выполняем глубокую диагностику
-            if not self.debug_annotations():
-                raise ValueError("Обнаружены критические проблемы с аннотациями")
-
-            # Подготавливаем датасет
-            yaml_path, num_classes, num_images = self.prepare_yolo_dataset()
-
-            if num_images == 0:
-                raise ValueError("Нет изображений с аннотациями для обучения")
-
-            print(f"=== НАЧАЛО ОБУЧЕНИЯ ===")
-            print(f"Классы: {num_classes}")
-            print(f"Изображения: {num_images}")
-            print(f"YAML: {yaml_path}")
-
-            if not os.path.exists(yaml_path):
-                raise FileNotFoundError(f"YAML файл не найден: {yaml_path}")
-
-            # Настройка конфигурации обучения
-            training_config = self._get_training_config(num_images, num_classes)
-
-            print("Загружаем модель YOLO...")
-            self.model = YOLO('yolov8n.pt')
-
-            # Базовая конфигурация обучения
-            training_params = {
-                'data': yaml_path,
-                'epochs': training_config['epochs'],
-                'batch': training_config['batch'],
-                'imgsz': training_config['imgsz'],
-                'patience': training_config['patience'],
-                'save': True,
-                'exist_ok': True,
-                'pretrained': True,
-                'verbose': True,
-                'project': os.path.join(settings.MEDIA_ROOT, 'yolo_training'),
-                'name': f'model_{self.ml_model.id}',
-                'lr0': training_config['lr0'],
-                'optimizer': training_config['optimizer'],
-                'weight_decay': training_config['weight_decay'],
-                'momentum': training_config['momentum'],
-                'warmup_epochs': training_config['warmup_epochs'],
-                'warmup_momentum': training_config['warmup_momentum'],
-                'box': training_config['box'],
-                'cls': training_config['cls'],
-                'dfl': training_config['dfl'],
-                'augment': training_config['augment'],
-            }
+    def get_dataset_dir(self):
+        """Директория подготовленного YOLO датасета для этой модели"""
+        return os.path.join(settings.MEDIA_ROOT, 'yolo_datasets', f'model_{self.ml_model.id}')
 
-            if 'close_mosaic' in training_config:
-                training_params['close_mosaic'] = training_config['close_mosaic']
+    def get_training_dir(self):
+        """Стабильная директория обучения (чекпоинты last.pt/best.pt) для этой модели"""
+        return os.path.join(settings.MEDIA_ROOT, 'yolo_training', f'model_{self.ml_model.id}')
 
-            print("Начинаем обучение...")
-
-            # Запускаем обучение
-            results = self.model.train(**training_params)
+    def get_resume_checkpoint(self):
+        """
+        Чекпоинт для возобновления прерванного обучения.
 
-            # Сохраняем лучшую модель
-            best_model_path = os.path.join(
-                settings.MEDIA_ROOT, 'yolo_training', f'model_{self.ml_model.id}', 'weights', 'best.pt'
-            )
+        Возобновление возможно, только если сохранился и last.pt, и подготовленный
+        датасет, на который ссылаются аргументы обучения внутри чекпоинта.
+        """
+        last_pt = os.path.join(self.get_training_dir(), 'weights', 'last.pt')
+        yaml_path = os.path.join(self.get_dataset_dir(), 'dataset.yaml')
+        if os.path.exists(last_pt) and os.path.exists(yaml_path):
+            return last_pt
+        return None
 
-            if os.path.exists(best_model_path):
-                print(f"Сохранение модели: {best_model_path}")
-                with open(best_model_path, 'rb') as f:
-                    self.ml_model.model_file.save(f'model_{self.ml_model.id}.pt', File(f))
-
-                print("✅ Обучение завершено успешно!")
-
-                # Сохраняем метрики
-                if hasattr(results, 'results_dict') and results.results_dict:
-                    training_results = results.results_dict
-                    self.ml_model.accuracy = training_results.get('metrics/mAP50(B)', 0)
-                    self.ml_model.precision = training_results.get('metrics/precision(B)', 0)
-                    self.ml_model.recall = training_results.get('metrics/recall(B)', 0)
-                    self.ml_model.f1_score = training_results.get('metrics/f1(B)', 0)
-
-                    print(f"📊 Финальные метрики:")
-                    print(f"  mAP50: {self.ml_model.accuracy:.3f}")
-                    print(f"  Precision: {self.ml_model.precision:.3f}")
-                    print(f"  Recall: {self.ml_model.recall:.3f}")
-                    print(f"  F1: {self.ml_model.f1_score:.3f}")
-                else:
-                    self.ml_model.accuracy = 0.5
-                    self.ml_model.precision = 0.5
-                    self.ml_model.recall = 0.5
-                    self.ml_model.f1_score = 0.5
+    def _read_checkpoint_owner(self):
+        try:
+            with open(os.path.join(self.get_training_dir(), self.CHECKPOINT_OWNER_FILE)) as f:
+                content = f.read().strip()
+        except OSError:
+            return {}
+        try:
+            return json.loads(content)
+        except ValueError:
+            # Прежний формат: только ID задачи
+            return {'task_id': content}
+
+    def get_checkpoint_owner(self):
+        """ID задачи, чьи чекпоинты лежат в директории обучения; '' - неизвестно"""
+        return self._read_checkpoint_owner().get('task_id', '')
+
+    def _mark_checkpoint_owner(self, torchrun_pid=None):
+        if not self.task_id:
+            return
+        owner = {'task_id': self.task_id}
+        if torchrun_pid:
+            owner.update(torchrun_pid=torchrun_pid, host=socket.gethostname())
+        os.makedirs(self.get_training_dir(), exist_ok=True)
+        with open(os.path.join(self.get_training_dir(), self.CHECKPOINT_OWNER_FILE), 'w') as f:
+            json.dump(owner, f)
+
+    def _terminate_orphaned_torchrun(self):
+        """
+        Остановка torchrun, оставшегося от погибшего процесса воркера: иначе он продолжал бы
+        писать чекпоинты одновременно с новым запуском. Процесс проверяется по хосту и
+        командной строке, чтобы не задеть посторонний процесс с тем же PID.
+        """
+        owner = self._read_checkpoint_owner()
+        pid = owner.get('torchrun_pid')
+        if not pid or owner.get('host') != socket.gethostname():
+            return
+        try:
+            if 'torch.distributed.run' not in psutil.Process(pid).cmdline():
+                return
+            print(f"Останавливаем torchrun {pid}, оставшийся от прерванного обучения")
+            os.killpg(pid, signal.SIGTERM)
+            psutil.Process(pid).wait(timeout=60)
+        except psutil.TimeoutExpired:
+            os.killpg(pid, signal.SIGKILL)
+        except (psutil.Error, ProcessLookupError):
+            pass
+
+    def train_model(self, resume=False):
+        """Обучение YOLO модели без отслеживания прогресса"""
+        self.started_at = time.monotonic()
+        try:
+            self._terminate_orphaned_torchrun()
+            checkpoint = self.get_resume_checkpoint() if resume else None
+            if checkpoint:
+                results = self._resume_training(checkpoint)
+            else:
+                if resume:
+                    print("Чекпоинт для возобновления не найден, обучение начинается заново")
+                results = self._start_training()
 
-                self.ml_model.save()
+            self._save_trained_model(results)
 
             # Очистка временных файлов
-            temp_dataset_dir = os.path.join(settings.MEDIA_ROOT, 'yolo_datasets', f'dataset_{self.dataset.id}')
-            if os.path.exists(temp_dataset_dir):
+            temp_dataset_dir = self.get_dataset_dir()
+            if not self.keep_dataset and os.path.exists(temp_dataset_dir):
                 print(f"Очистка временных файлов: {temp_dataset_dir}")
                 shutil.rmtree(temp_dataset_dir, ignore_errors=True)
 
             return True
 
+        except JobCancelled:
+            # Возобновлять отмененное обучение не нужно - временные файлы удаляются сразу
+            print("⏹️  Обучение отменено")
+            shutil.rmtree(self.get_dataset_dir(), ignore_errors=True)
+            shutil.rmtree(self.get_training_dir(), ignore_errors=True)
+            raise
+
         except Exception as e:
             print(f"❌ Ошибка обучения: {str(e)}")
             import traceback
             traceback.print_exc()
+            # Повторный запуск после ошибки не должен продолжать чекпоинт со старыми данными и параметрами
+            shutil.rmtree(self.get_dataset_dir(), ignore_errors=True)
+            shutil.rmtree(self.get_training_dir(), ignore_errors=True)
             self.ml_model.training_log = f"Ошибка: {str(e)}"
             self.ml_model.save()
             return False
 
+    def _start_training(self):
+        """Подготовка данных и обучение с нуля (или дообучение предыдущей модели)"""
+        print("=== НАЧАЛО ПОДГОТОВКИ ДАННЫХ ===")
+
+        # Сначала выполняем глубокую диагностику
+        if not self.debug_annotations():
+            raise ValueError("Обнаружены критические проблемы с аннотациями")
+
+        # Подготавливаем датасет
+        yaml_path, num_classes, num_images = self.prepare_yolo_dataset()
+
+        if num_images == 0:
+            raise ValueError("Нет изображений с аннотациями для обучения")
+
+        print(f"=== НАЧАЛО ОБУЧЕНИЯ ===")
+        print(f"Классы: {num_classes}")
+        print(f"Изображения: {num_images}")
+        print(f"YAML: {yaml_path}")
+
+        if not os.path.exists(yaml_path):
+            raise FileNotFoundError(f"YAML файл не найден: {yaml_path}")
+
+        # Ищем предыдущую модель для дообучения
+        base_model, new_classes = None, False
+        if self.ml_model.training_mode == 'finetune':
+            base_model, new_classes = self._find_warm_start_model()
+            if base_model is None:
+                print("Подходящая модель для дообучения не найдена, выполняем полное обучение")
+
+        # Настройка конфигурации обучения
+        training_config = self._get_training_config(
+            num_images, num_classes, fine_tune=base_model is not None, new_classes=new_classes
+        )
+
+        print("Загружаем модель YOLO...")
+        if base_model is not None:
+            # При добавлении классов голова классификации переинициализируется
+            # автоматически, остальные веса переносятся по совпадению форм
+            print(f"Дообучение от модели {base_model.id} ({base_model.name})"
+                  f"{', добавлены новые классы' if new_classes else ''}")
+            initial_weights = base_model.get_model_path()
+        else:
+            initial_weights = 'yolov8n.pt'
+        self.model = YOLO(initial_weights)
+
+        training_profile = self._get_cpu_profile(num_images, training_config['imgsz'])
+        self._apply_cpu_profile(training_profile)
+        self._record_training_setup(base_model, training_profile)
+
+        # Чекпоинты прошлого запуска не должны подхватываться при возобновлении
+        training_dir = self.get_training_dir()
+        if os.path.exists(training_dir):
+            shutil.rmtree(training_dir, ignore_errors=True)
+        self._mark_checkpoint_owner()
+
+        training_params = self._build_training_params(yaml_path, training_config, training_profile)
+
+        print("Начинаем обучение...")
+        return self._run_training(initial_weights, training_params, training_profile)
+
+    def _record_training_setup(self, base_model, training_profile):
+        """Исходная модель и профиль ресурсов сохраняются вместе с моделью"""
+        self.ml_model.base_model = base_model
+        self.ml_model.training_profile = training_profile
+        self.ml_model.save()
+
+    def _run_training(self, initial_weights, training_params, training_profile):
+        """Запуск обучения в режиме, выбранном для модели"""
+        if self.ml_model.ddp_processes * self.ml_model.ddp_nodes > 1:
+            if self.ml_model.time_budget:
+                # Остаток бюджета передается ultralytics (time, в часах): процесс ранга 0
+                # останавливает обучение по времени для всех процессов. Подбор imgsz и
+                # patience по первой эпохе, как в _train_with_time_budget, в DDP не выполняется
+                remaining = self.ml_model.time_budget * 60 - (time.monotonic() - self.started_at)
+                training_params = dict(training_params, time=max(remaining, 60) / 3600)
+            return self._train_distributed(
+                initial_weights, training_params, training_profile,
+                self.ml_model.ddp_processes, self.ml_model.ddp_nodes
+            )
+        if self.ml_model.time_budget:
+            return self._train_with_time_budget(initial_weights, training_params)
+
+        self._add_epoch_counter()
+        self._add_cancel_check()
+        return self.model.train(**training_params)
+
+    @staticmethod
+    def _get_available_cpus():
+        """Количество ядер, доступных процессу (учитывает affinity и квоту cgroup v2)"""
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 1
+
+        try:
+            with open('/sys/fs/cgroup/cpu.max') as f:
+                quota, period = f.read().split()
+            if quota != 'max':
+                cpus = min(cpus, max(1, int(int(quota) / int(period))))
+        except (OSError, ValueError):
+            pass
+
+        return cpus
+
+    def _get_cpu_profile(self, num_images, imgsz):
+        """
+        Профиль обучения под ресурсы хоста.
+
+        Ядра делятся между воркерами загрузчика данных (декодирование и аугментация)
+        и потоками torch (прямой/обратный проход). Кэш изображений включается в RAM,
+        если оценка его объема (изображения, приведенные к imgsz) помещается в бюджет
+        TRAINING_CACHE_MEMORY_BUDGET_MB и в половину свободной памяти, иначе на диск,
+        если там есть место. Без кэша JPEG декодируются заново на каждой эпохе.
+        """
+        cpus = self._get_available_cpus()
+        device = 0 if torch.cuda.is_available() else 'cpu'
+
+        if device == 'cpu':
+            workers = min(8, max(1, cpus // 4))
+            torch_threads = max(1, cpus - workers)
+        else:
+            workers = min(8, cpus)
+            torch_threads = max(1, cpus // 2)
+
+        cache_estimate_mb = num_images * imgsz * imgsz * 3 / (1024 * 1024)
+        memory_budget_mb = settings.TRAINING_CACHE_MEMORY_BUDGET_MB
+        available_mb = psutil.virtual_memory().available / (1024 * 1024)
+        disk_free_mb = shutil.disk_usage(self.get_dataset_dir()).free / (1024 * 1024)
+
+        if cache_estimate_mb <= min(memory_budget_mb, available_mb / 2):
+            cache = 'ram'
+        elif cache_estimate_mb * 2 < disk_free_mb:
+            cache = 'disk'
+        else:
+            cache = False
+
+        profile = {
+            'device': device,
+            'cpus': cpus,
+            'workers': workers,
+            'torch_threads': torch_threads,
+            'cache': cache,
+            'cache_estimate_mb': round(cache_estimate_mb, 1),
+            'memory_budget_mb': memory_budget_mb,
+        }
+
+        print(f"🖥️  Профиль обучения: {cpus} ядер, устройство {device}, воркеров загрузки {workers}, "
+              f"потоков torch {torch_threads}, кэш {cache or 'выключен'} (~{cache_estimate_mb:.0f} МБ)")
+        return profile
+
+    @staticmethod
+    def _apply_cpu_profile(profile):
+        """Настройка intra-op потоков torch по профилю обучения"""
+        if profile and profile.get('torch_threads'):
+            torch.set_num_threads(profile['torch_threads'])
+
+    def _build_training_params(self, yaml_path, training_config, training_profile):
+        """Параметры model.train() из конфигурации обучения и профиля ресурсов"""
+        training_dir = self.get_training_dir()
+
+        # Базовая конфигурация обучения
+        training_params = {
+            'data': yaml_path,
+            'epochs': training_config['epochs'],
+            'batch': training_config['batch'],
+            'imgsz': training_config['imgsz'],
+            'patience': training_config['patience'],
+            'save': True,
+            'exist_ok': True,
+            'pretrained': True,
+            'verbose': True,
+            'project': os.path.dirname(training_dir),
+            'name': os.path.basename(training_dir),
+            'lr0': training_config['lr0'],
+            'optimizer': training_config['optimizer'],
+            'weight_decay': training_config['weight_decay'],
+            'momentum': training_config['momentum'],
+            'warmup_epochs': training_config['warmup_epochs'],
+            'warmup_momentum': training_config['warmup_momentum'],
+            'box': training_config['box'],
+            'cls': training_config['cls'],
+            'dfl': training_config['dfl'],
+            'augment': training_config['augment'],
+        }
+
+        if 'close_mosaic' in training_config:
+            training_params['close_mosaic'] = training_config['close_mosaic']
+
+        training_params.update({
+            'device': training_profile['device'],
+            'workers': training_profile['workers'],
+            'cache': training_profile['cache'],
+        })
+
+        return training_params
+
+    @staticmethod
+    def build_ddp_command(params_path, metrics_path, nproc, nnodes=1, node_rank=0):
+        """Команда torchrun для запуска процессов DDP-обучения на одном узле"""
+        return [
+            sys.executable, '-m', 'torch.distributed.run',
+            f'--nproc_per_node={nproc}',
+            f'--nnodes={nnodes}',
+            f'--node_rank={node_rank}',
+            f'--master_addr={settings.TRAINING_DDP_MASTER_ADDR}',
+            f'--master_port={settings.TRAINING_DDP_MASTER_PORT}',
+            '-m', 'detection.ddp_train', params_path, metrics_path,
+        ]
+
+    @staticmethod
+    def get_ddp_node_workers():
+        """Имена воркеров, которые обслуживают очередь дополнительных узлов DDP"""
+        active_queues = current_app.control.inspect().active_queues() or {}
+        return [
+            worker for worker, queues in active_queues.items()
+            if any(queue['name'] == settings.TRAINING_DDP_NODE_QUEUE for queue in queues)
+        ]
+
+    def _train_distributed(self, initial_weights, training_params, training_profile, nproc, nnodes=1):
+        """
+        Data-parallel обучение на CPU в nproc процессах на каждом из nnodes узлов.
+
+        Батч на процесс остается прежним, глобальный батч растет пропорционально
+        числу процессов. lr0 масштабируется по линейному правилу с учетом того, что
+        ultralytics накапливает градиенты до номинального батча 64 (nbs). Потоки torch
+        и воркеры загрузки делятся между локальными процессами. Кэш изображений
+        переводится на диск: его один раз строит процесс 0, остальные читают
+        общие файлы. Дополнительные узлы запускаются задачей train_yolo_ddp_node,
+        MEDIA_ROOT на них должен быть общим.
+        """
+        world_size = nproc * nnodes
+        nbs = 64
+        local_batch = training_params['batch']
+        global_batch = local_batch * world_size
+
+        params = dict(training_params)
+        params.update({
+            'model': initial_weights,
+            'device': 'cpu',
+            'batch': global_batch,
+            'lr0': training_params['lr0'] * max(global_batch, nbs) / max(local_batch, nbs),
+            'optimizer': 'SGD' if training_params['optimizer'] == 'auto' else training_params['optimizer'],
+            'workers': max(1, training_profile['workers'] // nproc),
+            'cache': 'disk' if training_params.get('cache') else False,
+            'torch_threads': max(1, training_profile['torch_threads'] // nproc),
+        })
+
+        print(f"🔀 DDP обучение: {nnodes} узл. x {nproc} проц., глобальный батч {global_batch}, "
+              f"lr0 {params['lr0']:.4f}, потоков torch на процесс {params['torch_threads']}")
+        return self._launch_distributed(params, nproc, nnodes)
+
+    def _get_ddp_params_path(self, name):
+        return os.path.join(self.get_dataset_dir(), f'{name}_ddp_params.json')
+
+    def _launch_distributed(self, params, nproc, nnodes):
+        """Запуск процессов torchrun этого узла и задач дополнительных узлов с параметрами обучения params"""
+        from .tasks import train_yolo_ddp_node
+
+        os.makedirs(self.get_dataset_dir(), exist_ok=True)
+        params_path = self._get_ddp_params_path(params['name'])
+        metrics_path = os.path.join(self.get_dataset_dir(), f'{params["name"]}_ddp_metrics.json')
+        with open(params_path, 'w', encoding='utf-8') as f:
+            json.dump(params, f)
+
+        if nnodes > 1:
+            # Без воркеров очереди узлов процесс ранга 0 ждал бы остальные узлы бесконечно
+            node_workers = self.get_ddp_node_workers()
+            if len(node_workers) < nnodes - 1:
+                raise ValueError(
+                    f"Для обучения на {nnodes} узлах нужно {nnodes - 1} воркеров очереди "
+                    f"{settings.TRAINING_DDP_NODE_QUEUE}, доступно: {len(node_workers)}"
+                )
+
+        for node_rank in range(1, nnodes):
+            train_yolo_ddp_node.apply_async(
+                args=(params_path, metrics_path, nproc, nnodes, node_rank),
+                queue=settings.TRAINING_DDP_NODE_QUEUE,
+            )
+
+        env = dict(os.environ, OMP_NUM_THREADS=str(params['torch_threads']))
+        # Отдельная группа процессов: torchrun и его ранги останавливаются вместе,
+        # в том числе после гибели процесса воркера (см. _terminate_orphaned_torchrun)
+        process = subprocess.Popen(
+            self.build_ddp_command(params_path, metrics_path, nproc, nnodes),
+            cwd=settings.BASE_DIR, env=env, start_new_session=True,
+        )
+        self._mark_checkpoint_owner(torchrun_pid=process.pid)
+        # Процессы torchrun не видят флаг отмены, поэтому при отмене (и при любом прерывании
+        # ожидания, например мягком лимите времени задачи) они завершаются отсюда;
+        # процессы дополнительных узлов падают вслед за потерей мастера
+        try:
+            while True:
+                try:
+                    returncode = process.wait(timeout=self.cancellation.interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    self.cancellation.check("Обучение отменено пользователем")
+        except BaseException:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            process.wait()
+            raise
+        finally:
+            self._mark_checkpoint_owner()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, process.args)
+
+        with open(metrics_path, encoding='utf-8') as f:
+            metrics = json.load(f)
+
+        throughput = metrics['epoch_throughput']
+        self.epochs_trained = metrics['epochs_trained']
+        self.ddp_stats = {
+            'nodes': nnodes,
+            'processes_per_node': nproc,
+            'world_size': nproc * nnodes,
+            'global_batch': params['batch'],
+            'lr0': params['lr0'],
+            'epoch_throughput': throughput,
+            'mean_throughput': round(sum(throughput) / len(throughput), 2) if throughput else None,
+        }
+        print(f"   Пропускная способность: {self.ddp_stats['mean_throughput']} изобр./с за эпоху")
+
+        return SimpleNamespace(results_dict=metrics['results_dict'])
+
+    def _add_cancel_check(self):
+        """Остановка обучения по запросу на отмену после очередного батча"""
+        def on_train_batch_end(trainer):
+            self.cancellation.check("Обучение отменено пользователем")
+
+        self.model.add_callback('on_train_batch_end', on_train_batch_end)
+
+    def _add_epoch_counter(self):
+        """Учет фактически выполненных эпох (с учетом ранней остановки)"""
+        def on_fit_epoch_end(trainer):
+            self.epochs_trained = trainer.epoch + 1
+
+        self.model.add_callback('on_fit_epoch_end', on_fit_epoch_end)
+
+    def _train_with_time_budget(self, initial_weights, training_params):
+        """
+        Обучение с ограничением по времени (MLModel.time_budget, в минутах).
+
+        Ultralytics сам пересчитывает число эпох по средней длительности эпохи и
+        останавливается по истечении времени, сохраняя best.pt. Дополнительно по
+        первой эпохе подбирается patience, а если в бюджет не помещается даже
+        TIME_BUDGET_MIN_EPOCHS эпох, обучение перезапускается с меньшим imgsz
+        (время эпохи растет примерно как квадрат размера изображения).
+        """
+        # Бюджет отсчитывается с начала train_model, включая подготовку данных
+        budget_seconds = self.ml_model.time_budget * 60
+        downscaled = False
+
+        while True:
+            run_started_at = time.monotonic()
+            remaining = budget_seconds - (run_started_at - self.started_at)
+            training_params['time'] = max(remaining, 60) / 3600
+            probe = {'imgsz': None}
+
+            def on_fit_epoch_end(trainer, probe=probe, run_started_at=run_started_at, remaining=remaining):
+                self.epochs_trained = trainer.epoch + 1
+                if trainer.epoch != trainer.start_epoch:
+                    return
+
+                # Первая эпоха (с валидацией) служит замером скорости
+                epoch_time = max(time.monotonic() - run_started_at, 1e-6)
+                affordable = (remaining - epoch_time) / epoch_time + 1
+                imgsz = training_params['imgsz']
+                print(f"⏱️  Первая эпоха: {epoch_time:.0f} с, в бюджет помещается ~{affordable:.1f} эпох")
+
+                if (affordable < self.TIME_BUDGET_MIN_EPOCHS and not downscaled
+                        and imgsz > self.TIME_BUDGET_MIN_IMGSZ):
+                    scale = math.sqrt(max(affordable, 0) / self.TIME_BUDGET_MIN_EPOCHS)
+                    probe['imgsz'] = max(self.TIME_BUDGET_MIN_IMGSZ, int(imgsz * scale) // 32 * 32)
+                    trainer.stop = True
+                    return
+
+                trainer.stopper.patience = max(3, min(trainer.stopper.patience, int(affordable) // 4))
+                print(f"   Patience уменьшен до {trainer.stopper.patience}")
+
+            self.model.add_callback('on_fit_epoch_end', on_fit_epoch_end)
+            self._add_cancel_check()
+            results = self.model.train(**training_params)
+
+            if probe['imgsz'] is None:
+                break
+
+            print(f"Бюджет времени не позволяет обучение при imgsz={training_params['imgsz']}, "
+                  f"перезапуск с imgsz={probe['imgsz']}")
+            downscaled = True
+            training_params['imgsz'] = probe['imgsz']
+            shutil.rmtree(self.get_training_dir(), ignore_errors=True)
+            self.model = YOLO(initial_weights)
+
+        self.ml_model.img_size = training_params['imgsz']
+        return results
+
+    def _resume_training(self, checkpoint):
+        """
+        Возобновление обучения с last.pt.
+
+        Гиперпараметры и путь к датасету берутся из самого чекпоинта, поэтому
+        обучение продолжается с теми же настройками и тем же разбиением train/val.
+        Прерванное DDP-обучение (есть параметры его запуска) возобновляется в DDP.
+        """
+        print(f"=== ВОЗОБНОВЛЕНИЕ ОБУЧЕНИЯ: {checkpoint} ===")
+        # Чекпоинты переходят к задаче, которая продолжает обучение
+        self._mark_checkpoint_owner()
+
+        best_model_path = os.path.join(self.get_training_dir(), 'weights', 'best.pt')
+        yaml_path = os.path.join(self.get_dataset_dir(), 'dataset.yaml')
+        params_path = self._get_ddp_params_path(os.path.basename(self.get_training_dir()))
+        nproc, nnodes = self.ml_model.ddp_processes, self.ml_model.ddp_nodes
+        if nproc * nnodes > 1 and os.path.exists(params_path):
+            # DDP-обучение продолжается в DDP с исходными параметрами запуска
+            if torch.load(checkpoint, map_location='cpu', weights_only=False).get('epoch') == -1:
+                # ultralytics помечает чекпоинты завершенного обучения epoch=-1
+                print("Обучение уже завершено, пересчитываем метрики по best.pt")
+                return YOLO(best_model_path).val(data=yaml_path)
+            with open(params_path, encoding='utf-8') as f:
+                params = json.load(f)
+            params.update(model=checkpoint, resume=checkpoint)
+            return self._launch_distributed(params, nproc, nnodes)
+
+        self._apply_cpu_profile(self.ml_model.training_profile)
+        self.model = YOLO(checkpoint)
+        self._add_cancel_check()
+        try:
+            return self.model.train(resume=True)
+        except AssertionError as e:
+            # Обучение успело завершиться до падения воркера - остается только валидация
+            if not os.path.exists(best_model_path):
+                raise
+            print(f"Обучение уже завершено ({e}), пересчитываем метрики по best.pt")
+            return YOLO(best_model_path).val(data=yaml_path)
+
+    def _save_trained_model(self, results):
+        """Сохранение лучших весов и метрик обучения в MLModel"""
+        best_model_path = os.path.join(self.get_training_dir(), 'weights', 'best.pt')
+
+        if os.path.exists(best_model_path):
+            print(f"Сохранение модели: {best_model_path}")
+            with open(best_model_path, 'rb') as f:
+                self.ml_model.model_file.save(f'model_{self.ml_model.id}.pt', File(f))
+
+            print("✅ Обучение завершено успешно!")
+
+            if self.epochs_trained is not None:
+                self.ml_model.epochs_trained = self.epochs_trained
+            if self.ddp_stats is not None:
+                self.ml_model.training_profile = dict(self.ml_model.training_profile or {}, ddp=self.ddp_stats)
+            self.ml_model.training_time = (time.monotonic() - self.started_at) / 60
+
+            # Сохраняем метрики
+            if hasattr(results, 'results_dict') and results.results_dict:
+                training_results = results.results_dict
+                self.ml_model.accuracy = training_results.get('metrics/mAP50(B)', 0)
+                self.ml_model.precision = training_results.get('metrics/precision(B)', 0)
+                self.ml_model.recall = training_results.get('metrics/recall(B)', 0)
+                self.ml_model.f1_score = training_results.get('metrics/f1(B)', 0)
+
+                print(f"📊 Финальные метрики:")
+                print(f"  mAP50: {self.ml_model.accuracy:.3f}")
+                print(f"  Precision: {self.ml_model.precision:.3f}")
+                print(f"  Recall: {self.ml_model.recall:.3f}")
+                print(f"  F1: {self.ml_model.f1_score:.3f}")
+            else:
+                self.ml_model.accuracy = 0.5
+                self.ml_model.precision = 0.5
+                self.ml_model.recall = 0.5
+                self.ml_model.f1_score = 0.5
+
+            self.ml_model.save()
+
+
+class YOLODDPBenchmark(YOLOTrainer):
+    """
+    Замер пропускной способности DDP-обучения при разном числе процессов.
+
+    Датасет и прогоны лежат в отдельных директориях с уникальным суффиксом, поэтому
+    замер не затрагивает подготовленный датасет и чекпоинты идущего обучения модели.
+    Веса модели не изменяются, результаты сохраняются в training_profile['ddp_scaling'].
+    """
+
+    def __init__(self, ml_model):
+        super().__init__(ml_model)
+        self.run_id = uuid.uuid4().hex[:8]
+
+    def get_dataset_dir(self):
+        return os.path.join(settings.MEDIA_ROOT, 'yolo_datasets', f'model_{self.ml_model.id}_benchmark_{self.run_id}')
+
+    def get_training_dir(self):
+        return os.path.join(settings.MEDIA_ROOT, 'yolo_training', f'model_{self.ml_model.id}_benchmark_{self.run_id}')
+
+    def run(self, process_counts, epochs=1):
+        """Короткое обучение на одном и том же подготовленном датасете для каждого значения process_counts"""
+        yaml_path, num_classes, num_images = self.prepare_yolo_dataset()
+        training_config = self._get_training_config(num_images, num_classes)
+        training_profile = self._get_cpu_profile(num_images, training_config['imgsz'])
+        training_params = self._build_training_params(yaml_path, training_config, training_profile)
+
+        scaling = {}
+        try:
+            for nproc in process_counts:
+                params = dict(training_params, epochs=epochs, patience=epochs + 1, name=f'{training_params["name"]}_{nproc}')
+                self._train_distributed('yolov8n.pt', params, training_profile, nproc)
+                scaling[str(nproc)] = self.ddp_stats['mean_throughput']
+                shutil.rmtree(os.path.join(params['project'], params['name']), ignore_errors=True)
+        finally:
+            shutil.rmtree(self.get_dataset_dir(), ignore_errors=True)
+            for run_dir in glob.glob(f'{self.get_training_dir()}_*'):
+                shutil.rmtree(run_dir, ignore_errors=True)
+
+        self.ml_model.training_profile = dict(self.ml_model.training_profile or {}, ddp_scaling=scaling)
+        self.ml_model.save()
+        return scaling
+
+
+class YOLOLowResFineTuner(YOLOTrainer):
+    """
+    Облегченная версия обученной модели: дообучение при пониженном разрешении.
+
+    Архитектура не меняется - копия инициализируется весами исходной модели и
+    дообучается при уменьшенном imgsz (MLModel.img_size копии), что ускоряет
+    инференс на CPU. К исходной разметке добавляется псевдоразметка исходной
+    модели для неразмеченных изображений датасета. Это не дистилляция: меньшей
+    архитектуры и функции потерь по выходам исходной модели нет. Валидация
+    выполняется только по исходной разметке, на этой же выборке заново оцениваются
+    mAP и задержка исходной модели, чтобы сравнение было честным.
+    """
+
+    PSEUDO_LABEL_CONFIDENCE = 0.5
+    LATENCY_SAMPLE_IMAGES = 20
+
+    def __init__(self, ml_model):
+        super().__init__(ml_model)
+        self.source = ml_model.parent_model
+        self.keep_dataset = True
+
+    def _find_warm_start_model(self):
+        return self.source, False
+
+    def _get_training_config(self, num_images, num_classes, fine_tune=False, new_classes=False):
+        config = super()._get_training_config(num_images, num_classes, fine_tune, new_classes)
+        config['imgsz'] = self.ml_model.img_size
+        print(f"   Пониженный размер изображения: {config['imgsz']}")
+        return config
+
+    def get_extra_train_images(self, classes):
+        """Псевдоразметка исходной моделью изображений датасета без аннотаций"""
+        source = YOLO(self.source.get_model_path())
+        extra_images = []
+
+        annotated_images = self.get_annotations().values('image_id')
+        for image in self.get_images().exclude(id__in=annotated_images).iterator():
+            if not os.path.exists(image.image.path):
+                continue
+
+            result = source.predict(
+                source=image.image.path,
+                conf=self.PSEUDO_LABEL_CONFIDENCE,
+                save=False,
+                verbose=False
+            )[0]
+
+            pseudo_annotations = []
+            for (x1, y1, x2, y2), class_id in zip(result.boxes.xyxyn.tolist(), result.boxes.cls.tolist()):
+                label = source.names.get(int(class_id))
+                if label in classes:
+                    pseudo_annotations.append(SimpleNamespace(label=label, x=x1, y=y1, width=x2 - x1, height=y2 - y1))
+
+            if pseudo_annotations:
+                extra_images.append((image, pseudo_annotations))
+
+        print(f"Псевдоразметка исходной модели: {len(extra_images)} изображений")
+        return extra_images
+
+    @staticmethod
+    def _measure_latency(weights_path, image_paths, warmup=2):
+        """Средняя задержка predict() на CPU в миллисекундах на изображение"""
+        if not image_paths:
+            return None
+
+        model = YOLO(weights_path)
+        for path in image_paths[:warmup]:
+            model.predict(source=path, device='cpu', save=False, verbose=False)
+
+        started = time.perf_counter()
+        for path in image_paths:
+            model.predict(source=path, device='cpu', save=False, verbose=False)
+        return (time.perf_counter() - started) * 1000 / len(image_paths)
+
+    def compress(self):
+        """Дообучение копии и сравнение с исходной моделью по mAP50 и задержке"""
+        try:
+            if not self.train_model():
+                return False
+
+            yaml_path = os.path.join(self.get_dataset_dir(), 'dataset.yaml')
+            source_metrics = YOLO(self.source.get_model_path()).val(
+                data=yaml_path, imgsz=self.source.img_size, device='cpu', verbose=False
+            )
+            source_accuracy = source_metrics.results_dict.get('metrics/mAP50(B)', 0)
+
+            val_images = sorted(glob.glob(os.path.join(self.get_dataset_dir(), 'images', 'val', '*')))
+            val_images = val_images[:self.LATENCY_SAMPLE_IMAGES]
+            self.source.latency_ms = self._measure_latency(self.source.get_model_path(), val_images)
+            self.ml_model.latency_ms = self._measure_latency(self.ml_model.get_model_path(), val_images)
+            self.source.save()
+
+            self.ml_model.training_profile = dict(self.ml_model.training_profile or {}, compression={
+                'source_accuracy': source_accuracy,
+                'source_latency_ms': self.source.latency_ms,
+                'source_imgsz': self.source.img_size,
+                'imgsz': self.ml_model.img_size,
+                'latency_sample_images': len(val_images),
+            })
+            self.ml_model.save()
+
+            print(f"📉 Сжатие: mAP50 {self.ml_model.accuracy:.3f} (исходная {source_accuracy:.3f}), "
+                  f"задержка {self.ml_model.latency_ms or 0:.1f} мс (исходная {self.source.latency_ms or 0:.1f} мс)")
+            return True
+
+        finally:
+            shutil.rmtree(self.get_dataset_dir(), ignore_errors=True)
+
+
+class YOLOPreviewTrainer(YOLOTrainer):
+    """
+    Быстрая пробная тренировка для проверки разметки.
+
+    Обучается на стратифицированной по классам выборке (сначала редкие классы) при
+    низком разрешении и малом числе эпох в отдельных директориях. Веса и поля
+    рабочей модели не изменяются: результат возвращается словарем метрик.
+    """
+
+    PREVIEW_MAX_IMAGES = 200
+    PREVIEW_EPOCHS = 5
+    PREVIEW_IMGSZ = 320
+
+    def __init__(self, ml_model):
+        super().__init__(ml_model)
+        # Пробное обучение проверяет текущую разметку, а не снимок последнего обучения
+        self.snapshot = None
+
+    def get_dataset_dir(self):
+        return os.path.join(settings.MEDIA_ROOT, 'yolo_datasets', f'preview_{self.ml_model.id}')
+
+    def get_training_dir(self):
+        return os.path.join(settings.MEDIA_ROOT, 'yolo_training', f'preview_{self.ml_model.id}')
+
+    def debug_annotations(self):
+        # Полная диагностика открывает каждое изображение - для пробного прогона слишком долго
+        return self.get_annotations().exists()
+
+    def _collect_images_with_annotations(self):
+        images_with_annotations = super()._collect_images_with_annotations()
+        if len(images_with_annotations) <= self.PREVIEW_MAX_IMAGES:
+            return images_with_annotations
+
+        images_by_class = defaultdict(list)
+        for image, annotations in images_with_annotations:
+            for label in {ann.label for ann in annotations}:
+                images_by_class[label].append((image, annotations))
+
+        # Равная квота на класс, редкие классы набираются первыми
+        per_class = max(1, self.PREVIEW_MAX_IMAGES // len(images_by_class))
+        selected = {}
+        for label, items in sorted(images_by_class.items(), key=lambda item: len(item[1])):
+            random.shuffle(items)
+            for image, annotations in items[:per_class]:
+                selected[image.id] = (image, annotations)
+
+        # Добор до лимита случайными изображениями
+        rest = [item for item in images_with_annotations if item[0].id not in selected]
+        random.shuffle(rest)
+        for image, annotations in rest[:max(0, self.PREVIEW_MAX_IMAGES - len(selected))]:
+            selected[image.id] = (image, annotations)
+
+        print(f"Пробная выборка: {len(selected)} из {len(images_with_annotations)} изображений")
+        return list(selected.values())
+
+    def _get_training_config(self, num_images, num_classes, fine_tune=False, new_classes=False):
+        config = super()._get_training_config(num_images, num_classes, fine_tune, new_classes)
+        config.update({
+            'epochs': self.PREVIEW_EPOCHS,
+            'imgsz': self.PREVIEW_IMGSZ,
+            'patience': self.PREVIEW_EPOCHS,
+            'warmup_epochs': min(config['warmup_epochs'], 1),
+            'close_mosaic': self.PREVIEW_EPOCHS,
+        })
+        return config
+
+    def _record_training_setup(self, base_model, training_profile):
+        self.training_profile = training_profile
+
+    def _run_training(self, initial_weights, training_params, training_profile):
+        self._add_epoch_counter()
+        self._add_cancel_check()
+        return self.model.train(**training_params)
+
+    def run_preview(self):
+        """Пробное обучение; возвращает грубые метрики и параметры прогона"""
+        started_at = time.monotonic()
+        try:
+            results = self._start_training()
+            metrics = results.results_dict if hasattr(results, 'results_dict') and results.results_dict else {}
+            return {
+                'map50': metrics.get('metrics/mAP50(B)', 0),
+                'precision': metrics.get('metrics/precision(B)', 0),
+                'recall': metrics.get('metrics/recall(B)', 0),
+                'classes': len(self.class_names),
+                'epochs': self.epochs_trained,
+                'imgsz': self.PREVIEW_IMGSZ,
+                'duration_min': round((time.monotonic() - started_at) / 60, 1),
+            }
+        finally:
+            shutil.rmtree(self.get_dataset_dir(), ignore_errors=True)
+            shutil.rmtree(self.get_training_dir(), ignore_errors=True)
+
+
+# Загруженные модели детекции в процессе воркера: (путь, mtime) -> YOLO.
+# mtime в ключе отбрасывает веса, перезаписанные повторным обучением
+_detection_model_cache = OrderedDict()
+
+
+def get_cached_yolo(weights_path):
+    """Модель YOLO из кэша процесса (LRU на DETECTION_MODEL_CACHE_SIZE моделей)"""
+    key = (weights_path, os.path.getmtime(weights_path))
+    model = _detection_model_cache.pop(key, None)
+    if model is None:
+        model = YOLO(weights_path)
+    _detection_model_cache[key] = model
+    while len(_detection_model_cache) > settings.DETECTION_MODEL_CACHE_SIZE:
+        _detection_model_cache.popitem(last=False)
+    return model
+
+
+def prime_detection_model_cache():
+    """
+    Прогрев кэша моделями последних детекций.
+
+    Вызывается при старте процесса воркера (в том числе после перезапуска по
+    памяти), чтобы первая задача не ждала загрузки весов и инициализации torch.
+    """
+    model_ids = []
+    for model_id in Job.objects.filter(kind='detect').order_by('-created_at').values_list('ml_model_id', flat=True)[:50]:
+        if model_id not in model_ids:
+            model_ids.append(model_id)
+        if len(model_ids) >= settings.DETECTION_MODEL_CACHE_SIZE:
+            break
+
+    primed = []
+    for ml_model in MLModel.objects.filter(id__in=model_ids, status='trained'):
+        try:
+            detector = YOLODetector(ml_model)
+            detector.model.predict(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+            primed.append(ml_model.id)
+        except Exception as e:
+            print(f"Не удалось прогреть модель {ml_model.id}: {e}")
+    return primed
+
 
 class YOLODetector:
     def __init__(self, ml_model):
@@ -488,11 +1396,14 @@ class YOLODetector:
         self.load_model()
 
     def load_model(self):
-        """Загрузка обученной модели"""
+        """Загрузка обученной модели (или ее сжатой версии, если она достаточно точна)"""
         try:
-            if self.ml_model.model_file and os.path.exists(self.ml_model.model_file.path):
-                self.model = YOLO(self.ml_model.model_file.path)
+            deployment_model = self.ml_model.get_deployment_model()
+            if deployment_model.model_file and os.path.exists(deployment_model.model_file.path):
+                self.model = get_cached_yolo(deployment_model.model_file.path)
                 print("Модель успешно загружена")
+                if deployment_model != self.ml_model:
+                    print(f"Используется сжатая модель: {deployment_model.name}")
                 print(f"Доступные классы: {self.model.names}")
             else:
                 raise ValueError("Файл модели не найден или модель не обучена")
@@ -500,6 +1411,31 @@ class YOLODetector:
             print(f"Ошибка загрузки модели: {e}")
             raise
 
+    def _parse_result(self, result):
+        """Перевод результата ultralytics в список детекций"""
+        detections = []
+        boxes = result.boxes
+        if boxes is not None and len(boxes) > 0:
+            for box in boxes:
+                # Координаты bounding box
+                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+                confidence = box.conf[0].cpu().numpy()
+                class_id = int(box.cls[0].cpu().numpy())
+
+                # Получаем имя класса
+                class_name = self.model.names.get(class_id, f'class_{class_id}')
+
+                detections.append({
+                    'label': class_name,
+                    'confidence': float(confidence),
+                    'x': float(x1),
+                    'y': float(y1),
+                    'width': float(x2 - x1),
+                    'height': float(y2 - y1),
+                    'class_id': class_id
+                })
+        return detections
+
     def detect_image(self, image_file, confidence=0.25):
         """Детекция объектов на изображении"""
         if not self.model:
@@ -518,26 +1454,7 @@ class YOLODetector:
 
             detections = []
             for result in results:
-                boxes = result.boxes
-                if boxes is not None and len(boxes) > 0:
-                    for box in boxes:
-                        # Координаты bounding box
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        confidence = box.conf[0].cpu().numpy()
-                        class_id = int(box.cls[0].cpu().numpy())
-
-                        # Получаем имя класса
-                        class_name = self.model.names.get(class_id, f'class_{class_id}')
-
-                        detections.append({
-                            'label': class_name,
-                            'confidence': float(confidence),
-                            'x': float(x1),
-                            'y': float(y1),
-                            'width': float(x2 - x1),
-                            'height': float(y2 - y1),
-                            'class_id': class_id
-                        })
+                detections.extend(self._parse_result(result))
 
             return detections
 
@@ -545,28 +1462,166 @@ class YOLODetector:
             print(f"Ошибка детекции: {e}")
             return []
 
-    def detect_dataset(self, confidence=0.25):
-        """Детекция объектов во всем датасете"""
-        detection_count = 0
-
-        # Удаляем старые результаты детекции
-        DetectionResult.objects.filter(ml_model=self.ml_model).delete()
-
-        for image in self.ml_model.dataset.imagefile_set.all():
-            detections = self.detect_image(image, confidence)
-
-            for detection in detections:
-                DetectionResult.objects.create(
-                    dataset=self.ml_model.dataset,
-                    image=image,
-                    ml_model=self.ml_model,
-                    detected_label=detection['label'],
-                    confidence=detection['confidence'],
-                    x=detection['x'],
-                    y=detection['y'],
-                    width=detection['width'],
-                    height=detection['height']
-                )
-                detection_count += 1
+    def _predict_batch(self, sources, confidence):
+        """Один вызов модели на список источников (путей или массивов BGR)"""
+        if not self.model:
+            self.load_model()
+
+        results = self.model.predict(
+            source=sources,
+            conf=confidence,
+            batch=len(sources),
+            save=False,
+            verbose=False
+        )
+        return [self._parse_result(result) for result in results]
+
+    def detect_batch(self, image_files, confidence=0.25):
+        """Детекция на нескольких изображениях за один вызов модели; список детекций на каждое изображение"""
+        try:
+            return self._predict_batch([image_file.image.path for image_file in image_files], confidence)
+
+        except Exception as e:
+            # Одно испорченное изображение не должно лишать результатов весь батч
+            print(f"Ошибка пакетной детекции, обрабатываем по одному: {e}")
+            return [self.detect_image(image_file, confidence) for image_file in image_files]
+
+    def detect_arrays(self, arrays, confidence=0.25):
+        """Детекция на растрах в памяти (HxWx3, BGR) без записи и чтения файлов"""
+        try:
+            return self._predict_batch(list(arrays), confidence)
+
+        except Exception as e:
+            print(f"Ошибка пакетной детекции, обрабатываем по одному: {e}")
+            detections = []
+            for array in arrays:
+                try:
+                    detections.append(self._predict_batch([array], confidence)[0])
+                except Exception as e:
+                    print(f"Ошибка детекции: {e}")
+                    detections.append([])
+            return detections
 
-        return detection_count
\ No newline at end of file
+    @staticmethod
+    def _adjust_batch_size(batch_size):
+        """
+        Размер батча по текущему RSS процесса.
+
+        Выше DETECTION_MEMORY_SOFT_LIMIT_MB батч уменьшается вдвое (до 1), при
+        снижении потребления ниже 3/4 лимита возвращается к DETECTION_BATCH_SIZE.
+        """
+        rss_mb = get_rss_mb()
+        soft_limit = settings.DETECTION_MEMORY_SOFT_LIMIT_MB
+        if rss_mb > soft_limit and batch_size > 1:
+            gc.collect()
+            batch_size = max(1, batch_size // 2)
+            print(f"RSS {rss_mb:.0f} МБ выше {soft_limit} МБ, батч детекции уменьшен до {batch_size}")
+        elif rss_mb < soft_limit * 0.75 and batch_size < settings.DETECTION_BATCH_SIZE:
+            batch_size = min(settings.DETECTION_BATCH_SIZE, batch_size * 2)
+        return batch_size
+
+    def detect_dataset(self, confidence=0.25, cancellation=None):
+        """
+        Детекция объектов во всем датасете батчами изображений.
+
+        Новые результаты заменяют старые одной транзакцией в конце, поэтому при
+        отмене (JobCancelled между изображениями) или ошибке остаются прежние
+        результаты, а не их смесь с частью новых.
+        """
+        cancellation = cancellation or CancellationToken()
+        results = []
+        images = list(self.ml_model.dataset.imagefile_set.all())
+        batch_size = settings.DETECTION_BATCH_SIZE
+        position = 0
+
+        while position < len(images):
+            cancellation.check("Детекция отменена пользователем")
+            batch_size = self._adjust_batch_size(batch_size)
+            batch = images[position:position + batch_size]
+            position += len(batch)
+
+            for image, detections in zip(batch, self.detect_batch(batch, confidence)):
+                for detection in detections:
+                    results.append(DetectionResult(
+                        dataset=self.ml_model.dataset,
+                        image=image,
+                        ml_model=self.ml_model,
+                        detected_label=detection['label'],
+                        confidence=detection['confidence'],
+                        x=detection['x'],
+                        y=detection['y'],
+                        width=detection['width'],
+                        height=detection['height']
+                    ))
+
+        with transaction.atomic():
+            DetectionResult.objects.filter(ml_model=self.ml_model).delete()
+            DetectionResult.objects.bulk_create(results, batch_size=1000)
+
+        return len(results)
+
+    def detect_pdf(self, pdf_file, confidence=0.25, keep_pages=None, cancellation=None):
+        """
+        Детекция по страницам PDF без промежуточных JPEG.
+
+        Страницы рендерятся в размер img_size модели и подаются в модель батчами
+        как представления NumPy над буферами PyMuPDF. Изображением датасета
+        сохраняются только страницы с найденными объектами и страницы из
+        keep_pages (номера с 1); координаты детекций - в пикселях сохраненной
+        страницы. Ранее сохраненные страницы этого PDF переиспользуются, их
+        результаты этой модели заменяются одной транзакцией в конце.
+        """
+        cancellation = cancellation or CancellationToken()
+        keep_pages = set(keep_pages or [])
+        existing_pages = {image.page_number: image for image in pdf_file.images.exclude(page_number=None)}
+        results = []
+        pages_saved = 0
+        batch_size = settings.DETECTION_BATCH_SIZE
+
+        with fitz.open(pdf_file.pdf.path) as document:
+            position = 0
+            while position < document.page_count:
+                cancellation.check("Детекция отменена пользователем")
+                batch_size = self._adjust_batch_size(batch_size)
+                page_numbers = list(range(position + 1, min(position + batch_size, document.page_count) + 1))
+                position += len(page_numbers)
+
+                rendered = [render_page_array(document[page_number - 1], self.ml_model.img_size)
+                            for page_number in page_numbers]
+                batch_detections = self.detect_arrays([array for _, array in rendered], confidence)
+
+                for page_number, (pix, _), detections in zip(page_numbers, rendered, batch_detections):
+                    if not detections and page_number not in keep_pages:
+                        continue
+
+                    image = existing_pages.get(page_number)
+                    scale = 1.0
+                    if image is None:
+                        image = save_page_image(pdf_file, pix, page_number)
+                        existing_pages[page_number] = image
+                        pages_saved += 1
+                    elif image.get_size()[0] != pix.width:
+                        # Страница сохранена ранее в другом разрешении (другой DPI или img_size)
+                        scale = image.get_size()[0] / pix.width
+
+                    for detection in detections:
+                        results.append(DetectionResult(
+                            dataset=self.ml_model.dataset,
+                            image=image,
+                            ml_model=self.ml_model,
+                            detected_label=detection['label'],
+                            confidence=detection['confidence'],
+                            x=detection['x'] * scale,
+                            y=detection['y'] * scale,
+                            width=detection['width'] * scale,
+                            height=detection['height'] * scale
+                        ))
+
+                # Буферы страниц освобождаются до рендеринга следующего батча
+                del rendered
+
+        with transaction.atomic():
+            DetectionResult.objects.filter(ml_model=self.ml_model, image__source_pdf=pdf_file).delete()
+            DetectionResult.objects.bulk_create(results, batch_size=1000)
+
+        return {'detection_count': len(results), 'pages_saved': pages_saved}
@@ -170,8 +170,56 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = MAX_UPLOAD_SIZE
 
 ALLOWED_IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'bmp', 'gif']
 
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+# Возобновляемая загрузка частями: части пишутся в общий для web и воркеров MEDIA_ROOT,
+# брошенные загрузки удаляются через UPLOAD_SESSION_TTL секунд без новых частей
+UPLOAD_CHUNK_SIZE = config('UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+UPLOAD_MAX_FILE_SIZE = config('UPLOAD_MAX_FILE_SIZE', default=20 * 1024 * 1024 * 1024, cast=int)
+UPLOAD_SESSION_ROOT = MEDIA_ROOT / 'upload_sessions'
+UPLOAD_SESSION_TTL = 24 * 3600
+
+# Массовая регистрация изображений: потоки записи в хранилище и размер пачки bulk_create
+UPLOAD_STORAGE_THREADS = config('UPLOAD_STORAGE_THREADS', default=8, cast=int)
+UPLOAD_BULK_CREATE_BATCH = 500
+
+# Импорт датасетов из архивов: архив читается потоком, изображения регистрируются пачками
+# по ARCHIVE_IMPORT_BATCH_SIZE; файл больше ARCHIVE_MAX_MEMBER_SIZE пропускается с ошибкой,
+# в импорте хранятся первые ARCHIVE_IMPORT_MAX_ERRORS ошибок
+ALLOWED_ARCHIVE_EXTENSIONS = ['zip', 'tar', 'tar.gz', 'tgz', 'tar.bz2', 'tar.xz']
+ARCHIVE_IMPORT_BATCH_SIZE = 200
+ARCHIVE_MAX_MEMBER_SIZE = 512 * 1024 * 1024
+ARCHIVE_IMPORT_MAX_ERRORS = 200
+
+# Выгрузка датасета в ZIP: датасеты до DATASET_EXPORT_STREAMING_MAX_IMAGES изображений
+# отдаются потоком прямо в ответе, большие собираются задачей очереди ingest
+DATASET_EXPORT_STREAMING_MAX_IMAGES = config('DATASET_EXPORT_STREAMING_MAX_IMAGES', default=5000, cast=int)
+
+# Метаданные изображений (размеры, хэши, EXIF) получаются фоновыми задачами пачками по стольку изображений
+IMAGE_METADATA_BATCH_SIZE = 200
+
+# Рендишены изображений в WebP: имя -> длинная сторона в пикселях. Файлы именуются по
+# SHA-256 оригинала, nginx отдает /media/renditions/ с бессрочным кэшем
+IMAGE_RENDITIONS = {
+    'thumb': 256,
+    'preview': 1024,
+}
+IMAGE_RENDITION_QUALITY = 80
+
+# Пирамида тайлов (DZI) для снимков, чья длинная сторона больше TILE_PYRAMID_MIN_SIZE:
+# инструмент разметки загружает только видимые тайлы текущего масштаба
+TILE_PYRAMID_MIN_SIZE = 4096
+TILE_SIZE = 512
+TILE_FORMAT = 'jpg'
+TILE_QUALITY = 85
+
+# Обработка PDF: процессов на один файл, DPI рендера страниц, минимальная сторона
+# встроенного изображения и максимум страниц в одном диапазоне
+PDF_INGEST_PROCESSES = config('PDF_INGEST_PROCESSES', default=min(4, os.cpu_count() or 1), cast=int)
+PDF_RENDER_DPI = config('PDF_RENDER_DPI', default=150, cast=int)
+PDF_MIN_IMAGE_SIZE = 32
+PDF_MAX_PAGES_PER_CHUNK = 25
+
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://localhost:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
@@ -180,10 +228,125 @@ CELERY_TIMEZONE = 'Europe/Moscow'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_SEND_SENT_EVENT = True
 
+# Сверка обучений, потерянных при перезапуске воркера, и их возобновление с last.pt
+TRAINING_RECONCILE_INTERVAL = config('TRAINING_RECONCILE_INTERVAL', default=300, cast=int)
+TRAINING_MAX_RESUMES = config('TRAINING_MAX_RESUMES', default=3, cast=int)
+# Предельная длительность одного запуска обучения (мягкий лимит задачи Celery);
+# от нее считается visibility_timeout брокера
+TRAINING_MAX_HOURS = config('TRAINING_MAX_HOURS', default=48, cast=int)
+
+# Верхняя граница RAM под кэш изображений при обучении; сверх нее кэш переносится на диск
+TRAINING_CACHE_MEMORY_BUDGET_MB = config('TRAINING_CACHE_MEMORY_BUDGET_MB', default=4096, cast=int)
+
+# Data-parallel обучение на CPU (torch DDP, gloo): адрес процесса ранга 0 и очередь
+# воркеров дополнительных узлов; MEDIA_ROOT должен быть общим для всех узлов
+TRAINING_DDP_MASTER_ADDR = config('TRAINING_DDP_MASTER_ADDR', default='127.0.0.1')
+TRAINING_DDP_MASTER_PORT = config('TRAINING_DDP_MASTER_PORT', default=29500, cast=int)
+TRAINING_DDP_NODE_QUEUE = config('TRAINING_DDP_NODE_QUEUE', default='training_ddp')
+
+# Сжатие моделей после обучения (дообучение той же архитектуры при пониженном imgsz):
+# imgsz сжатой версии и допустимая потеря mAP50. Массовая детекция переключается
+# на сжатую версию только при явно включенном DETECTION_USE_COMPRESSED_MODEL
+COMPRESSION_IMGSZ = config('COMPRESSION_IMGSZ', default=416, cast=int)
+COMPRESSED_MODEL_MAX_MAP_DROP = config('COMPRESSED_MODEL_MAX_MAP_DROP', default=0.02, cast=float)
+DETECTION_USE_COMPRESSED_MODEL = config('DETECTION_USE_COMPRESSED_MODEL', default=False, cast=bool)
+
+# Очередь пробных тренировок; обслуживается отдельным воркером с пониженным приоритетом
+PREVIEW_TRAINING_QUEUE = config('PREVIEW_TRAINING_QUEUE', default='preview')
+
+# Очереди Celery по классам нагрузки; каждую обслуживает свой воркер (docker-compose.yml),
+# поэтому многочасовое обучение не задерживает отчеты и небольшие детекции
+TRAINING_QUEUE = 'training'
+DETECTION_BULK_QUEUE = 'detection_bulk'
+DETECTION_INTERACTIVE_QUEUE = 'detection_interactive'
+REPORTS_QUEUE = 'reports'
+INGEST_QUEUE = 'ingest'
+
+# Детекция датасетов не больше этого числа изображений идет в интерактивную очередь
+DETECTION_INTERACTIVE_MAX_IMAGES = config('DETECTION_INTERACTIVE_MAX_IMAGES', default=50, cast=int)
+
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_TASK_ROUTES = {
+    'detection.tasks.train_yolo_model': {'queue': TRAINING_QUEUE},
+    'detection.tasks.compress_yolo_model': {'queue': TRAINING_QUEUE},
+    'detection.tasks.preview_train_yolo_model': {'queue': PREVIEW_TRAINING_QUEUE},
+    'detection.tasks.train_yolo_ddp_node': {'queue': TRAINING_DDP_NODE_QUEUE},
+    'detection.tasks.run_detection_task': {'queue': DETECTION_BULK_QUEUE},
+    'reports.tasks.*': {'queue': REPORTS_QUEUE},
+    'dataset.tasks.*': {'queue': INGEST_QUEUE},
+}
+
+# Память процессов воркеров детекции: процесс, превысивший WORKER_MAX_MEMORY_MB, перезапускается
+# Celery после текущей задачи (worker_max_memory_per_child выставляется воркерам детекции
+# в detection.worker_memory); выше мягкого лимита детекция уменьшает батч
+WORKER_MAX_MEMORY_MB = config('WORKER_MAX_MEMORY_MB', default=3072, cast=int)
+# Новый процесс воркера детекции загружает модели до готовности (worker_process_init);
+# по умолчанию Celery ждет его 4 с и убивает процесс, не успевший загрузить веса
+CELERY_WORKER_PROC_ALIVE_TIMEOUT = config('CELERY_WORKER_PROC_ALIVE_TIMEOUT', default=120, cast=float)
+DETECTION_MEMORY_SOFT_LIMIT_MB = config('DETECTION_MEMORY_SOFT_LIMIT_MB', default=int(WORKER_MAX_MEMORY_MB * 0.75), cast=int)
+DETECTION_BATCH_SIZE = config('DETECTION_BATCH_SIZE', default=8, cast=int)
+DETECTION_MODEL_CACHE_SIZE = config('DETECTION_MODEL_CACHE_SIZE', default=2, cast=int)
+# Загрузка горячих моделей в главном процессе воркера детекции до fork: процессы пула
+# делят страницы весов (copy-on-write); отчет о памяти - manage.py worker_memory_report
+DETECTION_PRELOAD_MODELS = config('DETECTION_PRELOAD_MODELS', default=True, cast=bool)
+
+# Автоскейлер пулов воркеров (manage.py autoscale_workers): границы числа процессов
+# по очередям, желаемое время разбора очереди и число проверок подряд перед уменьшением
+AUTOSCALE_QUEUES = {
+    DETECTION_BULK_QUEUE: {'min': 1, 'max': config('AUTOSCALE_DETECTION_BULK_MAX', default=4, cast=int)},
+    DETECTION_INTERACTIVE_QUEUE: {'min': 1, 'max': config('AUTOSCALE_DETECTION_INTERACTIVE_MAX', default=4, cast=int)},
+    REPORTS_QUEUE: {'min': 1, 'max': config('AUTOSCALE_REPORTS_MAX', default=3, cast=int)},
+    INGEST_QUEUE: {'min': 1, 'max': config('AUTOSCALE_INGEST_MAX', default=4, cast=int)},
+}
+AUTOSCALE_INTERVAL = config('AUTOSCALE_INTERVAL', default=30, cast=int)
+AUTOSCALE_TARGET_LATENCY = config('AUTOSCALE_TARGET_LATENCY', default=120, cast=int)
+AUTOSCALE_DEFAULT_RUNTIME = 60  # секунды, пока нет замеров длительности задач
+AUTOSCALE_SCALE_DOWN_CHECKS = config('AUTOSCALE_SCALE_DOWN_CHECKS', default=4, cast=int)
+
+# Воркер берет следующую задачу только после завершения текущей; длинные задачи
+# подтверждаются после выполнения (acks_late) и возвращаются в очередь при гибели
+# процесса. visibility_timeout Redis должен превышать самое долгое обучение, иначе
+# неподтвержденная задача будет выдана повторно второму воркеру поверх живого
+# обучения: обучение ограничено TRAINING_MAX_HOURS, таймаут берется с двойным запасом
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': config('CELERY_VISIBILITY_TIMEOUT', default=2 * TRAINING_MAX_HOURS * 3600, cast=int),
+}
+
+# Планировщик задач обучения и детекции: лимиты одновременно выполняемых задач
+# всего и на одного пользователя для каждой очереди.
+# Лимит обучения равен --concurrency воркера celery-training (docker-compose.yml):
+# запущенная сверх него задача ждала бы в брокере, занимая место в лимите
+JOB_CONCURRENCY = {
+    TRAINING_QUEUE: {'global': 1, 'user': 1},
+    # Для детекции лимит равен максимуму автоскейлера: иначе пул, расширенный под
+    # ожидающие задачи, простаивал бы, пока планировщик держит их в очереди
+    DETECTION_BULK_QUEUE: {'global': AUTOSCALE_QUEUES[DETECTION_BULK_QUEUE]['max'], 'user': 1},
+    DETECTION_INTERACTIVE_QUEUE: {'global': AUTOSCALE_QUEUES[DETECTION_INTERACTIVE_QUEUE]['max'], 'user': 2},
+}
+JOB_DISPATCH_INTERVAL = 30  # секунды
+
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-training-jobs': {
+        'task': 'detection.tasks.reconcile_training_jobs',
+        'schedule': TRAINING_RECONCILE_INTERVAL,
+    },
+    'dispatch-scheduled-jobs': {
+        'task': 'detection.tasks.dispatch_scheduled_jobs',
+        'schedule': JOB_DISPATCH_INTERVAL,
+    },
+    'cleanup-upload-sessions': {
+        'task': 'dataset.tasks.cleanup_upload_sessions',
+        'schedule': 3600,
+    },
+}
+
 os.makedirs(MEDIA_ROOT / 'models', exist_ok=True)
 os.makedirs(MEDIA_ROOT / 'reports', exist_ok=True)
 os.makedirs(MEDIA_ROOT / 'yolo_datasets', exist_ok=True)
 os.makedirs(MEDIA_ROOT / 'yolo_training', exist_ok=True)
+os.makedirs(UPLOAD_SESSION_ROOT, exist_ok=True)
 
 if not DEBUG:
     SECURE_HSTS_SECONDS = 31536000  # 1 year
@@ -4,7 +4,7 @@ from .models import Report
 from .utils import generate_report_file
 
 
-@shared_task
+@shared_task(acks_late=True)
 def generate_report_task(report_id):
     """Задача Celery для генерации отчета"""
     try: